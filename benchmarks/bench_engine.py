@@ -0,0 +1,354 @@
+"""
+Benchmark of the hot paths of the engine: pricing, simulation, fitting, result statistics and data loading.
+
+A synthetic analysis is generated through the models of flaskapp/models.py in a temporary SQLite database (or in the
+database given by --database-url), with --layers layers, --modelfiles simulated model files of --years years and
+--relationships pricing relationships mapping every layer to every model file. Each hot path is then timed and the
+median time, the throughput, the peak memory (tracemalloc) and the number of SQL statements are reported:
+- process_result: the pricing of the relationships run by the job of results/manage.process_result,
+  with the cache of the priced pairs disabled, then warm
+- save_loss_model: the simulation and storage of a model file run by the job of models/experience.save_loss_model
+- results/view.layout: the results page, with the summary of the result file and without (legacy result files)
+- get_lognorm_param: the fitting of a log-normal distribution to --years loss ratios
+- df_from_query: the loading of the result year losses of a result file as a DataFrame
+
+The results can be saved as a JSON baseline with --save-baseline and compared with the baseline of a previous run with
+--baseline: the benchmarks slower than their baseline by more than --tolerance are reported as regressions and the
+exit status is then 1. The baselines only compare runs of the same sizes on the same machine.
+
+The benchmarks whose number of statements does not depend on the sizes are also checked against their budget in
+QUERY_BUDGETS with assert_max_queries(), e.g. the results page issues at most 4 statements: a benchmark above its budget
+fails the run as well.
+
+Usage (from the project root, with the environment variables of config.py set):
+python -m benchmarks.bench_engine --layers 10 --modelfiles 5 --years 100000 --relationships 2
+python -m benchmarks.bench_engine --save-baseline benchmarks/baselines/engine.json
+python -m benchmarks.bench_engine --baseline benchmarks/baselines/engine.json
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, update, delete
+
+from config import SQLiteConfig
+from flaskapp import create_app
+from flaskapp.extensions import db
+from flaskapp.models import *
+from flaskapp.engine.cache import pricing_cache
+from flaskapp.engine.parallel import process_pricingrelationships
+from flaskapp.engine.simulation import save_lognorm_modelfile, ylt_cache
+from flaskapp.dashapp.pages.utils import df_from_query, get_lognorm_param
+from flaskapp.profiler import profile_queries, assert_max_queries
+
+# Maximum number of SQL statements of the benchmarks whose statements do not depend on the sizes
+QUERY_BUDGETS = {
+    'save_loss_model': 2,
+    'results/view.layout': 4,
+    'get_lognorm_param': 0,
+    'df_from_query': 1,
+}
+
+
+def create_analysis(nlayers, nmodelfiles, nyears, nrelationships):
+    """
+    Create an analysis with nlayers layers, nmodelfiles simulated model files of nyears years and nrelationships
+    pricing relationships mapping every layer to every model file.
+    Return the ids of the analysis and of its pricing relationships.
+    """
+    analysis = Analysis(name='Benchmark', quote=1, client='Benchmark')
+    db.session.add(analysis)
+    db.session.flush()
+
+    layers = [
+        Layer(name=f'Layer {i}', premium=1000000, deductible=60 + 10 * i, limit=50, display_order=i,
+              analysis_id=analysis.id)
+        for i in range(nlayers)
+    ]
+    db.session.add_all(layers)
+    db.session.commit()
+
+    modelfile_ids = [
+        save_lognorm_modelfile(analysis.id, f'Model {i}', s=0.2 + 0.05 * i, scale=0.7, nbyears=nyears, seed=i)
+        for i in range(nmodelfiles)
+    ]
+
+    pricingrelationships = [
+        PricingRelationship(name=f'Relationship {i}', analysis_id=analysis.id) for i in range(nrelationships)
+    ]
+    db.session.add_all(pricingrelationships)
+    db.session.flush()
+
+    db.session.add_all([
+        LayerToModelfile(name=f'{layer.name} - Model {j}', pricingrelationship_id=pricingrelationship.id,
+                         layer_id=layer.id, modelfile_id=modelfile_id)
+        for pricingrelationship in pricingrelationships
+        for layer in layers
+        for j, modelfile_id in enumerate(modelfile_ids)
+    ])
+    db.session.commit()
+
+    return analysis.id, [pricingrelationship.id for pricingrelationship in pricingrelationships]
+
+
+def measure(function, setup, repeat, units):
+    """
+    Time function after setup, repeat times, then run it once more under tracemalloc, which slows it down.
+    Return the metrics of the benchmark: median and minimum time, throughput in units per second, peak memory and
+    number of SQL statements.
+    """
+    timings = []
+    for _ in range(repeat):
+        setup()
+        db.session.remove()
+        start = time.perf_counter()
+        with profile_queries() as profile:
+            function()
+        timings.append(time.perf_counter() - start)
+    queries = profile.count
+
+    setup()
+    db.session.remove()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.session.remove()
+
+    median = float(np.median(timings))
+    return {
+        'time': median,
+        'min_time': float(np.min(timings)),
+        'throughput': units / median if median > 0 else None,
+        'units': units,
+        'peak_memory': peak,
+        'queries': queries,
+    }
+
+
+def get_benchmarks(app, analysis_id, pricingrelationship_ids, args):
+    """
+    Return a dictionary {name: (function, setup, units, unit)} of the benchmarks, units being the amount of work
+    done by a call of function, e.g. the number of priced year losses.
+    """
+    view = sys.modules['flaskapp.dashapp.pages.results.view']
+    nyears = args.years
+    npairs = args.layers * args.modelfiles * len(pricingrelationship_ids)
+    rng = np.random.default_rng(0)
+    loss_ratios = pd.Series(rng.lognormal(-0.4, 0.3, nyears))
+
+    def price():
+        process_pricingrelationships(pricingrelationship_ids, max_workers=args.workers)
+
+    def delete_results():
+        db.session.execute(delete(ResultFile).where(ResultFile.analysis_id == analysis_id))
+        db.session.commit()
+        ylt_cache.clear()
+
+    def disable_cache():
+        delete_results()
+        pricing_cache.clear()
+        pricing_cache.max_bytes = pricing_cache.max_disk_bytes = 0
+
+    def warm_cache():
+        delete_results()
+        pricing_cache.max_bytes, pricing_cache.max_disk_bytes = max_bytes, max_disk_bytes
+        if not pricing_cache.entries:
+            price()
+            delete_results()
+
+    max_bytes, max_disk_bytes = pricing_cache.max_bytes, pricing_cache.max_disk_bytes
+
+    def get_resultfile_id():
+        # The result files are priced once for the benchmarks that read them
+        resultfile_id = db.session.execute(
+            select(ResultFile.id).where(ResultFile.pricingrelationship_id == pricingrelationship_ids[0])
+        ).scalar()
+        if resultfile_id is None:
+            price()
+            return get_resultfile_id()
+        return resultfile_id
+
+    def view_layout():
+        with app.test_request_context():
+            view.layout(analysis_id, get_resultfile_id.resultfile_id)
+
+    def set_resultfile_id():
+        get_resultfile_id.resultfile_id = get_resultfile_id()
+
+    def reset_summary():
+        set_resultfile_id()
+        db.session.execute(
+            update(ResultFile).where(ResultFile.id == get_resultfile_id.resultfile_id).values(summary=None)
+        )
+        db.session.commit()
+
+    def load_resultyearlosses():
+        df_from_query(select(ResultYearLoss).filter_by(resultfile_id=get_resultfile_id.resultfile_id))
+
+    def simulate():
+        save_lognorm_modelfile(analysis_id, 'Benchmark simulation', s=0.3, scale=0.7, nbyears=nyears)
+
+    def nothing():
+        pass
+
+    return {
+        'process_result': (price, disable_cache, npairs * nyears, 'year losses'),
+        'process_result (warm cache)': (price, warm_cache, npairs * nyears, 'year losses'),
+        'save_loss_model': (simulate, nothing, nyears, 'years'),
+        'results/view.layout': (view_layout, set_resultfile_id, args.layers, 'layers'),
+        'results/view.layout (no summary)': (view_layout, reset_summary, args.layers, 'layers'),
+        'get_lognorm_param': (lambda: get_lognorm_param(loss_ratios), nothing, nyears, 'loss ratios'),
+        'df_from_query': (load_resultyearlosses, set_resultfile_id, args.layers * args.modelfiles * nyears, 'rows'),
+    }
+
+
+def check_query_budgets(benchmarks):
+    """
+    Run the benchmarks of QUERY_BUDGETS once more under assert_max_queries().
+    Return the names of the benchmarks above their budget.
+    """
+    failures = []
+
+    for name, budget in QUERY_BUDGETS.items():
+        if name not in benchmarks:
+            continue
+        function, setup, _, _ = benchmarks[name]
+        setup()
+        db.session.remove()
+        try:
+            with assert_max_queries(budget, name):
+                function()
+        except AssertionError as error:
+            print(f'\n{error}')
+            failures.append(name)
+        db.session.remove()
+
+    return failures
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the benchmarks with their change from the baseline.
+    Return the names of the benchmarks slower than their baseline by more than tolerance.
+    """
+    if baseline['parameters'] != results['parameters']:
+        print(f'\nWarning: the baseline was run with other parameters: {baseline["parameters"]}')
+
+    print(f'\n{"benchmark":<36}{"baseline (ms)":>15}{"time (ms)":>12}{"change":>9}{"queries":>10}{"memory":>10}')
+    regressions = []
+
+    for name, metrics in results['benchmarks'].items():
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            print(f'{name:<36}{"-":>15}{metrics["time"] * 1000:>12.1f}')
+            continue
+
+        change = metrics['time'] / reference['time'] - 1
+        queries = metrics['queries'] - reference['queries']
+        memory = metrics['peak_memory'] / reference['peak_memory'] - 1 if reference['peak_memory'] else 0
+        flag = '  REGRESSION' if change > tolerance else ''
+        print(f'{name:<36}{reference["time"] * 1000:>15.1f}{metrics["time"] * 1000:>12.1f}{change:>+9.0%}'
+              f'{queries:>+10d}{memory:>+10.0%}{flag}')
+
+        if change > tolerance:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layers', type=int, default=10, help='number of layers of the analysis')
+    parser.add_argument('--modelfiles', type=int, default=5, help='number of model files of the analysis')
+    parser.add_argument('--years', type=int, default=100000, help='number of years of the model files')
+    parser.add_argument('--relationships', type=int, default=2, help='number of pricing relationships')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes pricing the relationships (default: 1, in the current process)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timings per benchmark')
+    parser.add_argument('--only', nargs='+', help='names of the benchmarks to run, e.g. process_result')
+    parser.add_argument('--save-baseline', type=Path, help='JSON file where the results are saved')
+    parser.add_argument('--baseline', type=Path, help='JSON file of the results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown from the baseline reported as a regression (default: 0.2)')
+    parser.add_argument('--database-url',
+                        help='dedicated database to use instead of a temporary SQLite database (its tables are dropped)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+
+    class BenchmarkConfig(SQLiteConfig):
+        SQLALCHEMY_DATABASE_URI = args.database_url or f'sqlite:///{Path(tmpdir.name) / "benchmark.db"}'
+        # The priced pairs spilled to the disk do not outlive the benchmark
+        PRICING_CACHE_DIR = str(Path(tmpdir.name) / 'pricing-cache')
+
+    app = create_app(BenchmarkConfig)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        print(f'Generating an analysis of {args.layers} layers, {args.modelfiles} model files of {args.years:,} years '
+              f'and {args.relationships} relationships...')
+        start = time.perf_counter()
+        analysis_id, pricingrelationship_ids = create_analysis(
+            args.layers, args.modelfiles, args.years, args.relationships
+        )
+        print(f'Generated in {time.perf_counter() - start:.1f} s')
+
+        benchmarks = get_benchmarks(app, analysis_id, pricingrelationship_ids, args)
+        results = {
+            'parameters': {key: getattr(args, key) for key in ['layers', 'modelfiles', 'years', 'relationships',
+                                                                'workers']},
+            'python': platform.python_version(),
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'benchmarks': {},
+        }
+
+        print(f'\n{"benchmark":<36}{"time (ms)":>12}{"throughput":>14}{"":<16}{"peak memory":>14}{"queries":>10}')
+        for name, (function, setup, units, unit) in benchmarks.items():
+            if args.only and name not in args.only:
+                continue
+
+            metrics = measure(function, setup, args.repeat, units)
+            results['benchmarks'][name] = metrics | {'unit': unit}
+            print(f'{name:<36}{metrics["time"] * 1000:>12.1f}{metrics["throughput"]:>14,.0f} {unit + "/s":<15}'
+                  f'{metrics["peak_memory"] / 2 ** 20:>11.1f} MB{metrics["queries"]:>10}')
+
+        over_budget = check_query_budgets({name: benchmarks[name] for name in results['benchmarks']})
+
+        regressions = []
+        if args.baseline:
+            regressions = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+
+        if args.save_baseline:
+            args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+            args.save_baseline.write_text(json.dumps(results, indent=2))
+            print(f'\nBaseline saved to {args.save_baseline}')
+
+        if not args.database_url:
+            db.session.remove()
+            db.engine.dispose()
+
+    tmpdir.cleanup()
+
+    if regressions:
+        print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+    if over_budget:
+        print(f'\n{len(over_budget)} benchmark(s) above their query budget: {", ".join(over_budget)}')
+    if regressions or over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
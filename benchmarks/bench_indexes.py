@@ -0,0 +1,156 @@
+"""
+Benchmark of the hot query paths before and after the creation of the indexes.
+
+A synthetic book of result year losses is generated in a temporary SQLite database (or in the database given by
+--database-url), then each query is timed without the indexes declared in flaskapp/models.py and with them.
+
+Usage (from the project root, with the environment variables of config.py set):
+python -m benchmarks.bench_indexes --rows 3000000
+
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import select, func
+
+from config import SQLiteConfig
+from flaskapp import create_app
+from flaskapp.extensions import db
+from flaskapp.models import *
+from flaskapp.engine.bulk import bulk_insert
+from flaskapp.engine.statistics import get_result_statistics
+
+
+def create_book(nrows, nyears=10000, nlayers=5, nmodelfiles=5):
+    """
+    Create enough analyses, each with one priced relationship of nlayers x nmodelfiles pairs, to get nrows
+    result year losses. Return the list of the (analysis_id, pricingrelationship_id, resultfile_id) created.
+    """
+    rng = np.random.default_rng(0)
+    rows_per_analysis = nyears * nlayers * nmodelfiles
+    nanalyses = max(1, nrows // rows_per_analysis)
+    book = []
+
+    for i in range(nanalyses):
+        analysis = Analysis(name=f'Benchmark {i}', quote=i + 1, client='Benchmark')
+        db.session.add(analysis)
+        db.session.flush()
+
+        layers = [
+            Layer(name=f'Layer {j}', premium=1000000, deductible=80 + 10 * j, limit=50, display_order=j,
+                  analysis_id=analysis.id)
+            for j in range(nlayers)
+        ]
+        modelfiles = [ModelFile(name=f'Model {j}', analysis_id=analysis.id) for j in range(nmodelfiles)]
+        pricingrelationship = PricingRelationship(name='Benchmark', analysis_id=analysis.id)
+        db.session.add_all(layers + modelfiles + [pricingrelationship])
+        db.session.flush()
+
+        layertomodelfiles = [
+            LayerToModelfile(name=f'{layer.name} - {modelfile.name}', pricingrelationship_id=pricingrelationship.id,
+                             layer_id=layer.id, modelfile_id=modelfile.id)
+            for layer in layers for modelfile in modelfiles
+        ]
+        resultfile = ResultFile(name='Benchmark', analysis_id=analysis.id,
+                                pricingrelationship_id=pricingrelationship.id)
+        db.session.add_all(layertomodelfiles + [resultfile])
+        db.session.flush()
+
+        for layertomodelfile in layertomodelfiles:
+            grosslosses = rng.lognormal(13.5, 0.3, nyears)
+            recoveries = np.clip(grosslosses - 800000, 0, 500000)
+            bulk_insert(ResultYearLoss, {
+                'year': np.arange(1, nyears + 1),
+                'grossloss': np.rint(grosslosses).astype(np.int64),
+                'recovery': np.rint(recoveries).astype(np.int64),
+                'netloss': np.rint(grosslosses - recoveries).astype(np.int64),
+                'resultfile_id': resultfile.id,
+                'layertomodelfile_id': layertomodelfile.id,
+            })
+        db.session.commit()
+        book.append((analysis.id, pricingrelationship.id, resultfile.id))
+
+    return book
+
+
+def time_query(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+        db.session.rollback()
+    return np.median(timings)
+
+
+def get_queries(book):
+    # Query the last analysis of the book, which is the worst case for a scan in insertion order
+    analysis_id, pricingrelationship_id, resultfile_id = book[-1]
+
+    return {
+        'resultyearloss by resultfile_id': lambda: db.session.execute(
+            select(func.count()).select_from(ResultYearLoss).where(ResultYearLoss.resultfile_id == resultfile_id)
+        ).scalar(),
+        'results/view aggregation': lambda: get_result_statistics(resultfile_id),
+        'resultfile by (analysis_id, pricingrelationship_id)': lambda: db.session.execute(
+            select(ResultFile.id).filter_by(analysis_id=analysis_id, pricingrelationship_id=pricingrelationship_id)
+        ).first(),
+        'layertomodelfile by pricingrelationship_id': lambda: db.session.execute(
+            select(LayerToModelfile.id).filter_by(pricingrelationship_id=pricingrelationship_id)
+        ).all(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=3000000, help='number of result year losses to generate')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timings per query')
+    parser.add_argument('--database-url',
+                        help='dedicated database to use instead of a temporary SQLite database (its tables are dropped)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.TemporaryDirectory()
+
+    class BenchmarkConfig(SQLiteConfig):
+        SQLALCHEMY_DATABASE_URI = args.database_url or f'sqlite:///{Path(tmpdir.name) / "benchmark.db"}'
+
+    app = create_app(BenchmarkConfig)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        indexes = [index for table in db.metadata.sorted_tables for index in table.indexes]
+
+        print(f'Generating {args.rows:,} result year losses...')
+        start = time.perf_counter()
+        book = create_book(args.rows)
+        print(f'Generated in {time.perf_counter() - start:.1f} s')
+
+        queries = get_queries(book)
+
+        for index in indexes:
+            index.drop(db.engine)
+        before = {name: time_query(query, args.repeat) for name, query in queries.items()}
+
+        for index in indexes:
+            index.create(db.engine)
+        after = {name: time_query(query, args.repeat) for name, query in queries.items()}
+
+        print(f'\n{"query":<55}{"before (ms)":>14}{"after (ms)":>14}{"speedup":>10}')
+        for name in queries:
+            print(f'{name:<55}{before[name] * 1000:>14.2f}{after[name] * 1000:>14.2f}'
+                  f'{before[name] / after[name]:>9.0f}x')
+
+        if not args.database_url:
+            db.session.remove()
+            db.engine.dispose()
+
+    tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
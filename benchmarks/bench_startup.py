@@ -0,0 +1,109 @@
+"""
+Benchmark of the start of the app: import time and memory of create_app(), and heavy modules loaded by it.
+
+Each run starts a new Python process, as a new worker of the server would, which:
+1. imports the app and calls create_app(), like the start of a worker
+2. imports the compute libraries (pandas, plotly.express, scipy.stats) that the pages import on their first call,
+   like the first callback that fits or plots a model
+The time and the resident memory (RSS) after each step are reported as the median of the runs, with the heavy modules
+already loaded after create_app(). With --top, the slowest packages imported by create_app() are listed from python -X importtime.
+
+Usage (from the project root, with the environment variables of config.py set):
+python -m benchmarks.bench_startup --runs 5 --top 15
+
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+# Modules that the pages import on their first call rather than with the app
+HEAVY_MODULES = ['pandas', 'plotly.express', 'scipy.stats', 'openpyxl']
+
+# Script run by each process, printing its measures as JSON on its last line
+RUN_SCRIPT = '''
+import json, os, sys, time
+start = time.perf_counter()
+
+
+def get_rss():
+    # Resident memory of the process in MB, read from /proc on Linux
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+from config import SQLiteConfig
+from flaskapp import create_app
+app = create_app(SQLiteConfig)
+measures = {'create_app': time.perf_counter() - start, 'create_app_rss': get_rss()}
+measures['loaded'] = [module for module in %(heavy)r if module in sys.modules]
+
+start = time.perf_counter()
+import pandas, plotly.express, scipy.stats
+measures['first_compute'] = time.perf_counter() - start
+measures['first_compute_rss'] = get_rss()
+
+print(json.dumps(measures))
+'''
+
+
+def run(heavy_modules):
+    output = subprocess.run(
+        [sys.executable, '-c', RUN_SCRIPT % {'heavy': heavy_modules}], capture_output=True, text=True, check=True
+    )
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def get_slowest_imports(top):
+    """
+    Run create_app() under python -X importtime.
+    Return the top packages by import time, as a list of tuples (milliseconds, package), the time of a package being
+    the sum of the own times of its modules.
+    """
+    script = 'from config import SQLiteConfig\nfrom flaskapp import create_app\ncreate_app(SQLiteConfig)'
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True, text=True)
+
+    # python -X importtime writes a line 'import time: self [us] | cumulative | imported package' per module
+    packages = {}
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1000
+
+    return sorted(((duration, package) for package, duration in packages.items()), reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='number of processes started')
+    parser.add_argument('--top', type=int, default=0, help='number of the slowest packages imported by create_app() listed')
+    args = parser.parse_args()
+
+    runs = [run(HEAVY_MODULES) for _ in range(args.runs)]
+
+    print(f'{"step":<40}{"time (ms)":>12}{"RSS (MB)":>12}')
+    for step, label in [('create_app', 'create_app()'), ('first_compute', 'first fitting or plotting callback')]:
+        duration = np.median([measures[step] for measures in runs]) * 1000
+        rss = np.median([measures[f'{step}_rss'] for measures in runs])
+        print(f'{label:<40}{duration:>12.0f}{rss:>12.0f}')
+
+    loaded = runs[-1]['loaded']
+    print(f'\nHeavy modules loaded by create_app(): {", ".join(loaded) if loaded else "none"}')
+
+    if args.top:
+        print(f'\n{"slowest packages imported by create_app()":<44}{"time (ms)":>8}')
+        for duration, name in get_slowest_imports(args.top):
+            print(f'{name:<44}{duration:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
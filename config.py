@@ -2,10 +2,23 @@ import os
 from pathlib import Path
 
 
-class Config:
+class BaseConfig:
     SECRET_KEY = os.environ['SECRET_KEY']
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Maximum number of processes pricing the relationships, defaults to the number of cores
+    PRICING_MAX_WORKERS = int(os.environ.get('PRICING_MAX_WORKERS', 0)) or None
+    # Directory of the priced pairs spilled from the memory cache, defaults to a directory of the temporary directory
+    PRICING_CACHE_DIR = os.environ.get('PRICING_CACHE_DIR')
+    # Directory where the processes of the server share their metrics, by default each process reports its own
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    # Log the number of SQL statements of each request, the slow statements and the N+1 suspects (development)
+    SQL_PROFILER = bool(os.environ.get('SQL_PROFILER'))
+    SQL_SLOW_QUERY_MS = int(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+    # Raise on the lazy loads of the relationships that would emit SQL (tests)
+    SQL_RAISELOAD = bool(os.environ.get('SQL_RAISELOAD'))
 
+
+class Config(BaseConfig):
     # WEBSITE_HOSTNAME exists only in production environment
     if 'WEBSITE_HOSTNAME' not in os.environ:
         # Local deployment : we'll use environment variables
@@ -29,9 +42,7 @@ class Config:
         )
 
 
-class SQLiteConfig:
-    SECRET_KEY = os.environ['SECRET_KEY']
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
+class SQLiteConfig(BaseConfig):
     BASE_DIR = Path(__file__).resolve().parent
     DBNAME = 'app.db'
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{BASE_DIR}/{DBNAME}'
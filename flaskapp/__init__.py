@@ -5,19 +5,47 @@ import dash_bootstrap_components as dbc
 from flask.helpers import get_root_path
 
 
-def create_app():
+def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
 
     register_extensions(app)
     register_blueprints(app)
+    register_commands(app)
     register_dashapp(app)
 
     from flaskapp import models
+    # Register the creation of the search index with the analysis table
+    from flaskapp import search
 
     return app
 
 
+def init_worker(app, ylt_cache_max_bytes=None, pricing_cache_max_bytes=None):
+    """
+    Reset the state that a worker forked from the process that created the app (gunicorn --preload) inherits from it:
+    the connections of the pools, which belong to the parent, and the in-process caches and metrics.
+    The memory of the caches of the worker is bounded by ylt_cache_max_bytes and pricing_cache_max_bytes when given.
+    """
+    from flaskapp.extensions import db
+    from flaskapp.engine.cache import pricing_cache
+    from flaskapp.engine.simulation import ylt_cache
+    from flaskapp import metrics
+
+    with app.app_context():
+        # Drop the connections of the parent without closing them, the worker opens its own
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    ylt_cache.clear()
+    pricing_cache.clear()
+    if ylt_cache_max_bytes is not None:
+        ylt_cache.max_bytes = ylt_cache_max_bytes
+    if pricing_cache_max_bytes is not None:
+        pricing_cache.max_bytes = pricing_cache_max_bytes
+    metrics.reset_metrics()
+
+
 def register_extensions(app):
     from flaskapp.extensions import db
     from flaskapp.extensions import migrate
@@ -28,8 +56,16 @@ def register_extensions(app):
 
 def register_blueprints(app):
     from flaskapp.views.home import home
+    from flaskapp.views.metrics import metrics
 
     app.register_blueprint(home)
+    app.register_blueprint(metrics)
+
+
+def register_commands(app):
+    from flaskapp.jobs import jobs_cli
+
+    app.cli.add_command(jobs_cli)
 
 
 def register_dashapp(flask_app):
@@ -54,3 +90,8 @@ def register_dashapp(flask_app):
 
     with flask_app.app_context():
         dashapp.layout = layout
+
+    # Record the latency of the callbacks and the page layouts, and profile their SQL statements when enabled
+    from flaskapp import metrics, profiler
+    metrics.init_app(flask_app, dashapp)
+    profiler.init_app(flask_app, dashapp)
@@ -0,0 +1,145 @@
+"""
+This module defines the operations on whole analyses, which are run by the database without loading the rows.
+
+An analysis is cloned with one INSERT ... SELECT statement per table, in a single transaction. The copied rows of a
+table keep their order and get the ids old_id + offset, the offset being the same for all the rows of the table, so
+that the foreign keys of the copied children are remapped with the same arithmetic. On PostgreSQL, the tables are
+locked while they are copied so that no other insert takes the new ids, and their sequences are moved past the new ids.
+
+Functions:
+- clone_analysis(analysis_id, copy_results): Copy an analysis with its data, models, relationships and optionally
+  its results.
+
+Dependencies:
+- sqlalchemy
+
+"""
+
+from sqlalchemy import select, insert, func, literal, null, text
+from flaskapp.extensions import db
+from flaskapp.models import Analysis, Layer, HistoLossFile, HistoLoss, PremiumFile, Premium, RiskProfileFile, \
+    RiskProfile, ModelFile, ModelYearLoss, PricingRelationship, LayerToModelfile, ResultFile, ResultYearLoss
+
+# Tables of an analysis in the order of their copy: (model, foreign key to the parent, keep the ids)
+# The ids of the tables that are referenced by other copied tables are offset, the others get new ids
+ANALYSIS_TABLES = [
+    (Layer, Layer.analysis_id, True),
+    (HistoLossFile, HistoLossFile.analysis_id, True),
+    (HistoLoss, HistoLoss.lossfile_id, False),
+    (PremiumFile, PremiumFile.analysis_id, True),
+    (Premium, Premium.premiumfile_id, False),
+    (RiskProfileFile, RiskProfileFile.analysis_id, True),
+    (RiskProfile, RiskProfile.riskprofilefile_id, False),
+    (ModelFile, ModelFile.analysis_id, True),
+    (ModelYearLoss, ModelYearLoss.modelfile_id, False),
+    (PricingRelationship, PricingRelationship.analysis_id, True),
+    (LayerToModelfile, LayerToModelfile.pricingrelationship_id, True),
+]
+RESULT_TABLES = [
+    (ResultFile, ResultFile.pricingrelationship_id, True),
+    (ResultYearLoss, ResultYearLoss.resultfile_id, False),
+]
+
+# Columns that refer to the ids of the source analysis in their values, reset to null in the copy
+# The summary of a copied result file is computed again from its result year losses when it is first viewed,
+# a copied result file without fingerprints is stale and is priced again when it is processed
+RESET_COLUMNS = {
+    'resultfile': ['summary', 'fingerprints'],
+}
+
+
+def lock_table(table):
+    # Block the concurrent inserts until the end of the transaction, SQLite locks the whole database on write
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(f'LOCK TABLE {table.name} IN SHARE ROW EXCLUSIVE MODE'))
+
+
+def reset_sequence(table):
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT max(id) FROM {table.name}))"
+        ))
+
+
+def copy_rows(model, parent_key, keep_ids, source_ids, offsets, analysis_id):
+    """
+    Copy the rows of model whose parent is in source_ids, the ids of the parents of the source rows.
+    Return the offset of the ids of the copied rows, or None if the ids are not kept.
+    """
+    table = model.__table__
+    where = table.c[parent_key.key].in_(source_ids)
+
+    offset = None
+    if keep_ids:
+        lock_table(table)
+        min_id = db.session.execute(select(func.min(table.c.id)).where(where)).scalar()
+        if min_id is None:
+            return None
+        max_id = db.session.execute(select(func.max(table.c.id))).scalar()
+        offset = max_id + 1 - min_id
+
+    # Remap the id, the analysis and the foreign keys to the copied parents, copy the other columns as they are
+    columns = []
+    for column in table.columns:
+        referenced_tables = [foreign_key.column.table.name for foreign_key in column.foreign_keys]
+
+        if column.primary_key:
+            if not keep_ids:
+                continue
+            value = column + offset
+        elif column.key == 'analysis_id':
+            value = literal(analysis_id)
+        elif column.key in RESET_COLUMNS.get(table.name, []):
+            value = null()
+        elif referenced_tables and referenced_tables[0] in offsets:
+            value = column + offsets[referenced_tables[0]]
+        else:
+            value = column
+
+        columns.append((column.key, value.label(column.key)))
+
+    db.session.execute(
+        insert(table).from_select(
+            [key for key, _ in columns],
+            select(*[value for _, value in columns]).where(where).order_by(table.c.id),
+        )
+    )
+
+    if keep_ids:
+        reset_sequence(table)
+
+    return offset
+
+
+def clone_analysis(analysis_id, copy_results=False):
+    """
+    Copy an analysis with its layers, loss files, model files, pricing relationships and optionally its results,
+    in a single transaction.
+    Return a dictionary with the id of the new analysis ('analysis_id') and, for each table whose ids are kept,
+    the mapping {old_id: new_id} of its rows keyed by the name of the table, e.g. 'layer' or 'modelfile'.
+    """
+    analysis = db.session.get(Analysis, analysis_id)
+
+    new_analysis = Analysis(name=f'{analysis.name} (copy)'[:50], quote=analysis.quote, client=analysis.client)
+    db.session.add(new_analysis)
+    db.session.flush()
+
+    tables = ANALYSIS_TABLES + (RESULT_TABLES if copy_results else [])
+    offsets = {}
+    mappings = {'analysis_id': new_analysis.id}
+
+    for model, parent_key, keep_ids in tables:
+        # The parents of the rows are the analysis or the source rows of a table copied before
+        parent_table = next(iter(parent_key.foreign_keys)).column.table
+        source_ids = [analysis_id] if parent_table is Analysis.__table__ else list(mappings[parent_table.name])
+
+        offset = copy_rows(model, parent_key, keep_ids, source_ids, offsets, new_analysis.id)
+
+        if keep_ids:
+            old_ids = db.session.execute(select(model.id).where(parent_key.in_(source_ids))).scalars().all()
+            offsets[model.__tablename__] = offset or 0
+            mappings[model.__tablename__] = {old_id: old_id + offset for old_id in old_ids}
+
+    db.session.commit()
+
+    return mappings
@@ -3,25 +3,33 @@ from dash import html, dcc, dash_table, callback, Output, Input, State, no_updat
 from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_ag_grid as dag
+import dash_mantine_components as dmc
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
+from flaskapp.search import search_analyses
+from flaskapp.analyses import clone_analysis
+from sqlalchemy import select, delete
 
 dash.register_page(__name__, path='/')
 page_id = get_page_id(__name__)
 
 
-def layout():
-    if Analysis.query.all():
-        df = df_from_sqla(Analysis.query.order_by(Analysis.id.desc()).all())
-
+def get_row_data(rows):
+    # Link the quote and the name to the analysis
+    for row in rows:
         for col in ['quote', 'name']:
-            df[col] = '[' + df[col] + '](/dashapp/analysis/view/' + df['id'].astype(str) + ')'
-    else:
-        df = pd.DataFrame([])
+            row[col] = f'[{row[col]}](/dashapp/analysis/view/{row["id"]})'
+
+    return rows
+
+
+def layout():
+    # Only the first page of analyses is loaded: the search and the next pages are run by the database
+    rows, has_more = search_analyses()
 
     return html.Div([
+        dcc.Store(id=page_id + 'store', data={'text': None, 'last_id': rows[-1]['id'] if rows else None}),
         html.H5('Analysis Search', className='title'),
         html.Div([
             dbc.Row([
@@ -30,13 +38,26 @@ def layout():
                              href='/dashapp/analysis/create'),
                     dbc.Button('Copy', id=page_id + 'btn-copy', className='button'),
                     dbc.Button('Delete', id=page_id + 'btn-delete', className='button'),
-                ]),
+                ], width='auto'),
+                dbc.Col([
+                    dmc.Checkbox(id=page_id + 'checkbox-copy-results', label='Copy the results', checked=False),
+                ], align='center'),
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    dmc.TextInput(
+                        id=page_id + 'input-search',
+                        placeholder='Search by quote, name or client',
+                        debounce=300,
+                        className='mb-2',
+                    ),
+                ], width=6),
             ]),
             dbc.Row([
                 dbc.Col([
                     dag.AgGrid(
                         id=page_id + 'grid-analyses',
-                        rowData=df.to_dict('records'),
+                        rowData=get_row_data(rows),
                         columnDefs=[
                             {'field': 'id', 'hide': True},
                             {'field': 'quote', 'cellRenderer': 'markdown', 'checkboxSelection': True},
@@ -44,22 +65,77 @@ def layout():
                             {'field': 'client'},
                         ],
                         getRowId='params.data.id',
-                        defaultColDef={
-                            'flex': True, 'sortable': True, 'filter': True, 'floatingFilter': True,
-                        },
+                        defaultColDef={'flex': True},
                         columnSize='responsiveSizeToFit',
                         dashGridOptions={
                             'domLayout': 'autoHeight',
                             'rowSelection': 'multiple',
                         },
-                        className='ag-theme-alpine custom',
+                        className='ag-theme-alpine custom mb-2',
                     ),
+                    dbc.Button('Load more', id=page_id + 'btn-more', className='button', disabled=not has_more),
                 ], width=6),
             ]),
         ], className='div-standard'),
     ]),
 
 
+@callback(
+    Output(page_id + 'grid-analyses', 'rowData'),
+    Output(page_id + 'store', 'data'),
+    Output(page_id + 'btn-more', 'disabled'),
+    Input(page_id + 'input-search', 'value'),
+    config_prevent_initial_callbacks=True
+)
+def search(value):
+    # Type-ahead search: the first page of the matching analyses replaces the rows of the grid
+    rows, has_more = search_analyses(value)
+
+    return get_row_data(rows), {'text': value, 'last_id': rows[-1]['id'] if rows else None}, not has_more
+
+
+@callback(
+    Output(page_id + 'grid-analyses', 'rowTransaction', allow_duplicate=True),
+    Output(page_id + 'store', 'data', allow_duplicate=True),
+    Output(page_id + 'btn-more', 'disabled', allow_duplicate=True),
+    Input(page_id + 'btn-more', 'n_clicks'),
+    State(page_id + 'store', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def load_more(n_clicks, data):
+    # The next page starts after the last analysis of the grid (keyset pagination)
+    rows, has_more = search_analyses(data['text'], after_id=data['last_id'])
+
+    if not rows:
+        return no_update, no_update, True
+
+    return {'add': get_row_data(rows)}, data | {'last_id': rows[-1]['id']}, not has_more
+
+
+@callback(
+    Output(page_id + 'grid-analyses', 'rowTransaction', allow_duplicate=True),
+    Input(page_id + 'btn-copy', 'n_clicks'),
+    State(page_id + 'grid-analyses', 'selectedRows'),
+    State(page_id + 'checkbox-copy-results', 'checked'),
+    config_prevent_initial_callbacks=True
+)
+def copy_analysis(n_clicks, selectedRows, copy_results):
+    if not selectedRows:
+        raise PreventUpdate
+
+    # Each analysis is copied by the database with INSERT ... SELECT statements
+    analysis_ids = [clone_analysis(row['id'], copy_results=bool(copy_results))['analysis_id'] for row in selectedRows]
+
+    # Add the copies at the top of the grid
+    rows = db.session.execute(
+        select(Analysis.id, Analysis.quote, Analysis.name, Analysis.client)
+        .where(Analysis.id.in_(analysis_ids))
+        .order_by(Analysis.id.desc())
+    ).all()
+
+    return {'add': get_row_data([row._asdict() for row in rows]), 'addIndex': 0}
+
+
 # TODO: Add a modal to ask the user to confirm the deletion
 @callback(
     Output(page_id + 'grid-analyses', 'rowTransaction'),
@@ -70,12 +146,10 @@ def delete_analysis(n_clicks, selectedRows):
     if n_clicks is None or selectedRows is None:
         return no_update
 
-    # Delete selected analyses
-    for row in selectedRows:
-        analysis_id = row['id']
-        analysis = db.session.get(Analysis, analysis_id)
-        db.session.delete(analysis)
-    db.session.commit()  # Commit after the loop for DB performance
+    # Delete selected analyses in a single statement, the database cascades the delete to their data and results
+    analysis_ids = [row['id'] for row in selectedRows]
+    db.session.execute(delete(Analysis).where(Analysis.id.in_(analysis_ids)))
+    db.session.commit()
 
     # Update the analyses grid
     return {'remove': selectedRows}
@@ -6,7 +6,8 @@ import dash_ag_grid as dag
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
+from flaskapp.engine.bulk import bulk_upsert, bulk_update
+from sqlalchemy import select, delete
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -17,13 +18,7 @@ page_id = get_page_id(__name__)
 def layout(analysis_id):
     analysis = db.session.get(Analysis, analysis_id)
 
-    if analysis.layers:
-        df = df_from_sqla(analysis.layers)
-        df = df.sort_values(['display_order', 'id'], ascending=[True, True])
-    else:
-        # Create an empty pandas dataframe
-        # https://stackoverflow.com/questions/13784192/creating-an-empty-pandas-dataframe-and-then-filling-it
-        df = pd.DataFrame([])
+    df = df_from_query(select(Layer).filter_by(analysis_id=analysis.id).order_by(Layer.display_order, Layer.id))
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
@@ -116,42 +111,28 @@ for i in [1, 2, 3, 4, 5]:
     )
     def create_layers(n_clicks, data, n_layers):  # n_layers = children property of btn-create
         analysis_id = data['analysis_id']
-        analysis = db.session.get(Analysis, analysis_id)
         n_layers = int(n_layers[0])
 
-        # Initialize the grid transaction
-        newRows = []
-
-        for i in range(n_layers):
-            # Set the layers default parameters values
-            name = 'Enter a name'
-            premium = 0
-            deductible = 0
-            limit = 0
-            display_order = 999  # Set display_order to 999 so that the new layers are displayed in the last position
-
-            layer = Layer(
-                name=name,
-                premium=premium,
-                deductible=deductible,
-                limit=limit,
-                display_order=display_order,
-                analysis_id=analysis_id
-            )
-            db.session.add(layer)
-            db.session.commit()
-
-            newRows.append(
-                {
-                    'id': layer.id,
-                    'name': layer.name,
-                    'premium': layer.premium,
-                    'deductible': layer.deductible,
-                    'limit': layer.limit,
-                    'display_order': layer.display_order,
-                    'analysis_id': analysis_id
-                }
-            )
+        # Set the layers default parameters values
+        # display_order is set to 999 so that the new layers are displayed in the last position
+        newRows = [
+            {
+                'name': 'Enter a name',
+                'premium': 0,
+                'deductible': 0,
+                'limit': 0,
+                'display_order': 999,
+                'analysis_id': analysis_id
+            }
+            for i in range(n_layers)
+        ]
+
+        # Insert the layers in a single statement and add their ids to the grid transaction
+        layer_ids = bulk_upsert(Layer, newRows)
+        db.session.commit()
+
+        for row, layer_id in zip(newRows, layer_ids):
+            row['id'] = layer_id
 
         alert = dbc.Alert(
             'The layers have been modified. Save the changes with the Save button',
@@ -179,12 +160,10 @@ def delete_layers(n_clicks, selectedRows, data):
     analysis_id = data['analysis_id']
     analysis = db.session.get(Analysis, analysis_id)
 
-    # Delete the selected layers
-    for row in selectedRows:
-        layer_id = row['id']
-        layer = db.session.get(Layer, layer_id)
-        db.session.delete(layer)
-    db.session.commit()  # Commit after the loop for DB performance
+    # Delete the selected layers in a single statement, the database cascades the delete to their pricing pairs
+    layer_ids = [row['id'] for row in selectedRows]
+    db.session.execute(delete(Layer).where(Layer.id.in_(layer_ids)))
+    db.session.commit()
 
     alert = dbc.Alert(
         'The layers have been deleted',
@@ -216,18 +195,26 @@ def inform_layers_modified(cellValueChanged):
     Output(page_id + 'div-layers-modified', 'children'),
     Input(page_id + 'btn-save', 'n_clicks'),
     State(page_id + 'grid-layers', 'virtualRowData'),  # Use virtualRowData instead of rowData to get the rows order
+    State(page_id + 'store', 'data'),
     config_prevent_initial_callbacks=True
 )
-def save_layers(n_clicks, virtualRowData):
+def save_layers(n_clicks, virtualRowData, data):
     try:
-        for row in virtualRowData:
-            layer = db.session.get(Layer, row['id'])
-            layer.name = row['name']
-            layer.premium = row['premium']
-            layer.deductible = row['deductible']
-            layer.limit = row['limit']
-            layer.display_order = virtualRowData.index(row)
-        db.session.commit()  # Commit after the loop for DB performance and input data checking in bulk
+        # Check all the layers before saving them in a single transaction
+        # Only the existing layers of the analysis are updated: the layers are created with the create buttons
+        rows = [
+            {
+                'id': row['id'],
+                'name': row['name'],
+                'premium': row['premium'],
+                'deductible': row['deductible'],
+                'limit': row['limit'],
+                'display_order': display_order
+            }
+            for display_order, row in enumerate(virtualRowData)
+        ]
+        bulk_update(Layer, rows, analysis_id=data['analysis_id'])
+        db.session.commit()
 
         alert = dbc.Alert(
             'The changes have been saved',
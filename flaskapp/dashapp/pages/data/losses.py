@@ -6,8 +6,9 @@ import dash_ag_grid as dag
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
-from io import StringIO
+from flaskapp.lossfiles import decode_upload, parse_lossfile, save_lossfiles
+from sqlalchemy import select, delete
+import os
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -35,6 +36,23 @@ def layout(analysis_id):
                         dbc.Input(id=page_id + 'input-name', placeholder='Enter a value'),
                     ]),
                 ], className='mb-2'),
+                dbc.Row([
+                    dbc.Col([
+                        # Each uploaded file is saved as a loss file named after the file
+                        dcc.Upload(
+                            html.Div(['Drag and drop or ', html.A('select'), ' CSV, TSV or XLSX files']),
+                            id=page_id + 'upload-lossfiles',
+                            multiple=True,
+                            accept='.csv,.tsv,.txt,.xlsx,.xlsm',
+                            style={
+                                'width': '100%', 'height': 60, 'lineHeight': '60px', 'borderWidth': 1,
+                                'borderStyle': 'dashed', 'borderRadius': 5, 'textAlign': 'center',
+                            },
+                            className='mb-2',
+                        ),
+                        html.Div(id=page_id + 'div-upload-filenames', className='mb-2'),
+                    ]),
+                ]),
                 dbc.Row([
                     dbc.Col([
                         dbc.Textarea(
@@ -45,6 +63,12 @@ def layout(analysis_id):
                         ),
                         dbc.Button('Save', id=page_id + 'btn-save', className='mb-2 button'),
                         dbc.Button('Clear', id=page_id + 'btn-clear', className='mb-2 button'),
+                        dbc.Alert(
+                            id=page_id + 'alert-errors',
+                            color='danger',
+                            is_open=False,
+                            style={'maxHeight': 200, 'overflowY': 'auto'},
+                        ),
                     ]),
                 ]),
             ]),
@@ -74,7 +98,9 @@ def layout(analysis_id):
                     html.Div(
                         dag.AgGrid(
                             id=page_id + 'grid-lossfiles',
-                            rowData=df_from_sqla(analysis.histolossfiles).to_dict('records'),
+                            rowData=df_from_query(
+                                select(HistoLossFile).filter_by(analysis_id=analysis.id)
+                            ).to_dict('records'),
                             columnDefs=[
                                 {'field': 'id', 'hide': True},
                                 {'field': 'name', 'checkboxSelection': True, 'headerCheckboxSelection': True},
@@ -108,68 +134,82 @@ def toggle_modal(n_clicks):
     return True
 
 
+@callback(
+    Output(page_id + 'div-upload-filenames', 'children'),
+    Input(page_id + 'upload-lossfiles', 'filename'),
+)
+def display_upload_filenames(filenames):
+    if not filenames:
+        return None
+    return html.Small(', '.join(filenames))
+
+
 @callback(
     Output(page_id + 'modal-add-lossfile', 'is_open'),
     Output(page_id + 'grid-lossfiles', 'rowData', allow_duplicate=True),
     Output(page_id + 'text-area', 'value', allow_duplicate=True),
     Output(page_id + 'input-vintage', 'value', allow_duplicate=True),
     Output(page_id + 'input-name', 'value', allow_duplicate=True),
+    Output(page_id + 'upload-lossfiles', 'contents'),
+    Output(page_id + 'alert-errors', 'children'),
+    Output(page_id + 'alert-errors', 'is_open'),
     Input(page_id + 'btn-save', 'n_clicks'),
     State(page_id + 'store', 'data'),
     State(page_id + 'text-area', 'value'),
     State(page_id + 'input-vintage', 'value'),
     State(page_id + 'input-name', 'value'),
+    State(page_id + 'upload-lossfiles', 'contents'),
+    State(page_id + 'upload-lossfiles', 'filename'),
     config_prevent_initial_callbacks=True
 )
-def save_lossfile(n_clicks, data, value, vintage, name):    
-    # TODO: Add checking the input data properly and informing the user
-    # TODO: Add informing the user if the input data is incorrect using a dbc.Alert
-    if not (value and vintage and name):
+def save_lossfile(n_clicks, data, value, vintage, name, contents, filenames):
+    if not vintage or not (value and name or contents):
         raise PreventUpdate
 
-    # Save the new loss file in the database
-    analysis_id = data['analysis_id']
-    analysis = db.session.get(Analysis, analysis_id)
-    lossfile = HistoLossFile(
-        analysis_id=analysis.id,
-        vintage=vintage,
-        name=name
-    )
-    db.session.add(lossfile)
-    db.session.commit()
+    # The pasted losses are tab-separated, the uploaded files are named after their file name
+    files = [(name, 'pasted.tsv', value.encode())] if value and name else []
+    files += [
+        (os.path.splitext(filename)[0][:50], filename, decode_upload(content))
+        for filename, content in zip(filenames or [], contents or [])
+    ]
+
+    # Validate all the files before saving any of them
+    lossfiles = []
+    errors = []
+    for lossfile_name, filename, content in files:
+        losses, file_errors = parse_lossfile(filename, content)
+        lossfiles.append((lossfile_name, losses))
+        errors += file_errors
 
-    df_losses = pd.read_csv(StringIO(value), sep='\t')
-    df_losses['loss_ratio'] = df_losses['loss_ratio'].str.replace(',', '.').astype(float)
-
-    # Loop through the rows of a dataframe
-    # https://stackoverflow.com/questions/16476924/how-to-iterate-over-rows-in-a-dataframe-in-pandas
-    for index, row in df_losses.iterrows():
-        loss = HistoLoss(
-            lossfile_id=lossfile.id,
-            year=row['year'],
-            premium=row['premium'],
-            loss=row['loss'],
-            loss_ratio=row['loss_ratio']
-        )
-        db.session.add(loss)
-    db.session.commit()  # Commit after the loop for DB performance
+    if errors:
+        return no_update, no_update, no_update, no_update, no_update, no_update, html.Ul(
+            [html.Li(error) for error in errors]
+        ), True
+
+    # Save the new loss files and their losses in a single transaction
+    analysis_id = data['analysis_id']
+    save_lossfiles(analysis_id, vintage, lossfiles)
 
     # Update the loss files grid
-    rowData = df_from_sqla(analysis.histolossfiles).to_dict('records')
+    rowData = df_from_query(select(HistoLossFile).filter_by(analysis_id=analysis_id)).to_dict('records')
 
-    return False, rowData, None, None, None
+    return False, rowData, None, None, None, None, None, False
 
 
 @callback(
     Output(page_id + 'input-vintage', 'value'),
     Output(page_id + 'input-name', 'value'),
     Output(page_id + 'text-area', 'value'),
+    Output(page_id + 'upload-lossfiles', 'contents', allow_duplicate=True),
+    Output(page_id + 'upload-lossfiles', 'filename'),
+    Output(page_id + 'alert-errors', 'is_open', allow_duplicate=True),
     Input(page_id + 'btn-clear', 'n_clicks'),
+    config_prevent_initial_callbacks=True
 )
 def clear_modal(n_clicks):
     if not n_clicks:
-        return no_update, no_update, no_update
-    return None, None, None
+        return no_update, no_update, no_update, no_update, no_update, no_update
+    return None, None, None, None, None, False
 
 
 @callback(
@@ -179,24 +219,41 @@ def clear_modal(n_clicks):
 )
 def display_losses(cellClicked):
     lossfile_id = cellClicked['rowId']
-    lossfile = db.session.get(HistoLossFile, lossfile_id)
 
-    grid_losses = dag.AgGrid(
-        id=page_id + 'grid-oep',
-        rowData=df_from_sqla(lossfile.losses).to_dict('records'),
+    # The losses are requested page by page by the grid, see get_losses()
+    grid_losses = own_infinite_grid(
+        page_id + 'grid-losses',
         columnDefs=[
-            {'field': 'year'},
-            {'field': 'premium', 'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
-            {'field': 'loss', 'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
-            {'field': 'loss_ratio', 'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
+            {'field': 'year', 'filter': 'agNumberColumnFilter'},
+            {'field': 'premium', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+            {'field': 'loss', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+            {'field': 'loss_ratio', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
         ],
-        columnSize='responsiveSizeToFit',
-        dashGridOptions={
-            'domLayout': 'autoHeight',
-        }
+        style={'height': 400},
     )
 
-    return grid_losses
+    return html.Div([
+        dcc.Store(id=page_id + 'store-lossfile', data={'lossfile_id': lossfile_id}),
+        grid_losses,
+    ])
+
+
+@callback(
+    Output(page_id + 'grid-losses', 'getRowsResponse'),
+    Input(page_id + 'grid-losses', 'getRowsRequest'),
+    State(page_id + 'store-lossfile', 'data'),
+)
+def get_losses(request, data):
+    if request is None:
+        raise PreventUpdate
+
+    query = select(HistoLoss.year, HistoLoss.premium, HistoLoss.loss, HistoLoss.loss_ratio) \
+        .filter_by(lossfile_id=data['lossfile_id'])
+
+    return get_rows_response(query, request, order_by=[HistoLoss.id])
 
 
 @callback(
@@ -214,13 +271,12 @@ def delete_lossfiles(n_clicks, data, selectedRows):
     analysis_id = data['analysis_id']
     analysis = db.session.get(Analysis, analysis_id)
 
-    # Delete the selected loss files
-    for lossfile in selectedRows:
-        lossfile = db.session.get(HistoLossFile, lossfile['id'])
-        db.session.delete(lossfile)
-    db.session.commit()  # Commit after the loop for DB performance
+    # Delete the selected loss files in a single statement, the database cascades the delete to their losses
+    lossfile_ids = [row['id'] for row in selectedRows]
+    db.session.execute(delete(HistoLossFile).where(HistoLossFile.id.in_(lossfile_ids)))
+    db.session.commit()
 
     # Update the loss files grid
-    rowData = df_from_sqla(analysis.histolossfiles).to_dict('records')
+    rowData = df_from_query(select(HistoLossFile).filter_by(analysis_id=analysis.id)).to_dict('records')
 
     return rowData, None
@@ -7,10 +7,11 @@ import dash_mantine_components as dmc
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
+from sqlalchemy import select
+from flaskapp.engine.pricing import load_modelfile_ylt
+from flaskapp.engine.simulation import NBYEARS, MAX_NBYEARS, ylt_cache
+from flaskapp.jobs import submit_job, get_jobs, FINISHED, DONE
 import numpy as np
-from scipy.stats import lognorm
-import plotly.express as px
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -24,7 +25,10 @@ def layout(analysis_id):
     if analysis.histolossfiles:
         grid_lossfiles = dag.AgGrid(
             id=page_id + 'grid-lossfiles',
-            rowData=df_from_sqla(analysis.histolossfiles).sort_values('id', ascending=False).to_dict('records'),
+            rowData=df_from_query(
+                select(HistoLossFile).filter_by(analysis_id=analysis.id).order_by(HistoLossFile.id.desc()),
+                columns=['id', 'name', 'vintage'],
+            ).to_dict('records'),
             columnDefs=[
                 {'field': 'id', 'hide': True},
                 {'field': 'name'},
@@ -41,6 +45,8 @@ def layout(analysis_id):
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
+        dcc.Store(id=page_id + 'store-job'),
+        dcc.Interval(id=page_id + 'interval-job', interval=1000, disabled=True),
         own_title(__name__, analysis.name),
         own_nav_middle(__name__, analysis.id),
         own_nav_bottom(__name__, analysis.id),
@@ -70,34 +76,58 @@ def layout(analysis_id):
     config_prevent_initial_callbacks=True
 )
 def display_losses(cellClicked):
-    # Display the loss file losses
+    # Display the loss file losses, which are requested page by page by the grid (see get_losses)
     lossfile_id = cellClicked['rowId']
-    lossfile = db.session.get(HistoLossFile, lossfile_id)
 
-    grid_losses = dag.AgGrid(
-        id=page_id + 'grid-losses',
-        rowData=df_from_sqla(lossfile.losses).to_dict('records'),
+    grid_losses = own_infinite_grid(
+        page_id + 'grid-losses',
         columnDefs=[
-            {'field': 'year'},
-            {'field': 'premium', 'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
-            {'field': 'loss', 'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
-            {'field': 'loss_ratio', 'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
+            {'field': 'year', 'filter': 'agNumberColumnFilter'},
+            {'field': 'premium', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+            {'field': 'loss', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(",d")(params.value)'}},
+            {'field': 'loss_ratio', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
         ],
-        columnSize='responsiveSizeToFit',
+        style={'height': 400},
     )
 
     return html.Div([
+        dcc.Store(id=page_id + 'store-lossfile', data={'lossfile_id': lossfile_id}),
         html.Div('2. Selected set of losses:', className='h5 mb-3'),
         grid_losses,
     ]),
 
 
+@callback(
+    Output(page_id + 'grid-losses', 'getRowsResponse'),
+    Input(page_id + 'grid-losses', 'getRowsRequest'),
+    State(page_id + 'store-lossfile', 'data'),
+)
+def get_losses(request, data):
+    if request is None:
+        raise PreventUpdate
+
+    query = select(HistoLoss.year, HistoLoss.premium, HistoLoss.loss, HistoLoss.loss_ratio) \
+        .filter_by(lossfile_id=data['lossfile_id'])
+
+    return get_rows_response(query, request, order_by=[HistoLoss.id])
+
+
+def get_df_losses(lossfile_id):
+    return df_from_query(
+        select(HistoLoss).filter_by(lossfile_id=lossfile_id).order_by(HistoLoss.id),
+        columns=['year', 'loss_ratio'],
+    )
+
+
 @callback(
     Output(page_id + 'div-model-parameters', 'children'),
-    Input(page_id + 'grid-losses', 'rowData'),
+    Input(page_id + 'store-lossfile', 'data'),
 )
-def display_model_parameters(rowData):
-    df = pd.DataFrame(rowData)
+def display_model_parameters(data):
+    df = get_df_losses(data['lossfile_id'])
     df['year'] = df['year'].astype(int)
     year_min = min(df['year'])
     year_max = max(df['year'])
@@ -141,11 +171,11 @@ def display_model_parameters(rowData):
 @callback(
     Output(page_id + 'select-end-modeling-period', 'data'),
     Input(page_id + 'select-start-modeling-period', 'value'),
-    State(page_id + 'grid-losses', 'rowData'),
+    State(page_id + 'store-lossfile', 'data'),
 )
-def update_options_year_max(value, rowData):
+def update_options_year_max(value, data_lossfile):
     year_min = value
-    df = pd.DataFrame(rowData)
+    df = get_df_losses(data_lossfile['lossfile_id'])
     year_max = int(max(df['year']))
 
     rowData = [{'value': year, 'label': year} for year in list(range(year_min + 1, year_max + 1))]
@@ -159,10 +189,15 @@ def update_options_year_max(value, rowData):
     Input(page_id + 'select-start-modeling-period', 'value'),
     Input(page_id + 'select-end-modeling-period', 'value'),
     State(page_id + 'store', 'data'),
-    State(page_id + 'grid-losses', 'rowData'),
+    State(page_id + 'store-lossfile', 'data'),
 )
-def display_model(value_year_min, value_year_max, data, rowData):
-    df = pd.DataFrame(rowData)
+def display_model(value_year_min, value_year_max, data, data_lossfile):
+    # The fitting and plotting libraries are imported by the first call rather than with the pages
+    import pandas as pd
+    import plotly.express as px
+    from scipy.stats import lognorm
+
+    df = get_df_losses(data_lossfile['lossfile_id'])
     df['loss_ratio'] = df['loss_ratio'].astype(float)
     df['year'] = df['year'].astype(int)
 
@@ -217,10 +252,30 @@ def display_model(value_year_min, value_year_max, data, rowData):
                     placeholder='Enter the name of the loss model',
                 ),
             ], width=5),
+            dbc.Col([
+                dmc.NumberInput(
+                    id=page_id + 'input-nbyears',
+                    value=NBYEARS,
+                    min=1,
+                    max=MAX_NBYEARS,
+                    step=10000,
+                    precision=0,
+                ),
+            ], width=3),
             dbc.Col([
                 own_button(page_id + 'btn-save-model', 'Save'),
             ], width=1),
         ], className='mb-3'),
+        dbc.Row([
+            dbc.Col([
+                # A model file saved without its YLT regenerates it from its seed when it is used
+                dmc.Checkbox(
+                    id=page_id + 'checkbox-store-ylt',
+                    label='Store the simulated years (otherwise they are regenerated from the seed when needed)',
+                    checked=False,
+                ),
+            ]),
+        ], className='mb-3'),
         dbc.Row([
             dbc.Col([
                 dbc.Alert(
@@ -249,54 +304,88 @@ def display_model(value_year_min, value_year_max, data, rowData):
 
 
 @callback(
-    Output(page_id + 'div-modelyearloss', 'children'),
-    Output(page_id + 'alert-save', 'is_open'),
+    Output(page_id + 'store-job', 'data'),
+    Output(page_id + 'interval-job', 'disabled', allow_duplicate=True),
     Input(page_id + 'btn-save-model', 'n_clicks'),
     State(page_id + 'store', 'data'),
     State(page_id + 'input-name-modelfile', 'value'),
+    State(page_id + 'input-nbyears', 'value'),
+    State(page_id + 'checkbox-store-ylt', 'checked'),
     config_prevent_initial_callbacks=True
 )
-def save_loss_model(n_clicks, data, value):
-    analysis_id = data['analysis_id']
-    analysis = db.session.get(Analysis, analysis_id)
+def save_loss_model(n_clicks, data, value, nbyears, store_ylt):
+    # Queue the simulation of the loss model, which is run by the workers (flask jobs worker)
+    params = {
+        'analysis_id': data['analysis_id'],
+        'name': value,
+        's': data['s'],
+        'scale': data['scale'],
+        'nbyears': int(nbyears or NBYEARS),
+        'store_ylt': bool(store_ylt),
+    }
+    job_id = submit_job('save_lognorm_modelfile', params, name=value)
 
-    # Save the model file
-    modelfile = ModelFile(
-        analysis_id=analysis.id,
-        name=value,
-    )
-    db.session.add(modelfile)
-    db.session.commit()
-
-    # Create the model file year losses
-    s = data['s']
-    scale = data['scale']
-    fit_lognorm = lognorm(s=s, scale=scale)
-
-    NBYEARS = 10000  # TODO: Create a global constant giving the number of years
-    years = range(1, NBYEARS + 1)
-    loss_ratios = fit_lognorm.rvs(size=NBYEARS).tolist()
-
-    df = pd.DataFrame({'year': years, 'amount': loss_ratios})
-
-    # Save the model file year losses
-    for index, row in df.iterrows():
-        yearloss = ModelYearLoss(
-            year=row['year'],
-            amount=row['amount'],
-            modelfile_id=modelfile.id
-        )
-        db.session.add(yearloss)
-    db.session.commit()  # Commit after the loop for DB performance
+    return job_id, False
+
+
+@callback(
+    Output(page_id + 'div-modelyearloss', 'children'),
+    Output(page_id + 'alert-save', 'is_open'),
+    Output(page_id + 'interval-job', 'disabled'),
+    Input(page_id + 'interval-job', 'n_intervals'),
+    State(page_id + 'store-job', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def poll_loss_model(n_intervals, job_id):
+    if job_id is None:
+        raise PreventUpdate
+
+    job = get_jobs([job_id])[0]
+
+    if job['status'] not in FINISHED:
+        return dbc.Progress(value=100 * (job['progress'] or 0), striped=True, animated=True), False, False
+
+    if job['status'] != DONE:
+        return dbc.Alert(f'The loss model could not be saved ({job["status"]})', color='danger'), False, True
 
-    grid_yearlosses = dag.AgGrid(
-        id=page_id + 'grid-yearlosses',
-        rowData=df.to_dict('records'),
+    # The simulated years are requested page by page by the grid (see get_yearlosses)
+    # The whole YLT is never sent to the browser: it can have millions of years
+    grid_yearlosses = own_infinite_grid(
+        page_id + 'grid-yearlosses',
         columnDefs=[
-            {'field': 'year'},
-            {'field': 'amount', 'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
+            {'field': 'year', 'filter': 'agNumberColumnFilter'},
+            {'field': 'amount', 'filter': 'agNumberColumnFilter',
+             'valueFormatter': {'function': 'd3.format(".1%")(params.value)'}},
         ],
-        columnSize='responsiveSizeToFit',
+        style={'height': 400},
     )
 
-    return grid_yearlosses, True
+    return html.Div([
+        dcc.Store(id=page_id + 'store-modelfile', data={'modelfile_id': job['result']['modelfile_id']}),
+        grid_yearlosses,
+    ]), True, True
+
+
+def get_modelfile_ylt(modelfile_id):
+    # Keep the loss ratios in the bounded cache of the YLTs of the process while their pages are requested
+    ylt_digest = db.session.execute(select(ModelFile.ylt_digest).where(ModelFile.id == modelfile_id)).scalar()
+    key = ('modelfile', ylt_digest or modelfile_id)
+    loss_ratios = ylt_cache.get(key)
+
+    if loss_ratios is None:
+        loss_ratios = load_modelfile_ylt(modelfile_id)['amount']
+        ylt_cache.put(key, loss_ratios)
+
+    return {'year': np.arange(1, len(loss_ratios) + 1, dtype=np.int64), 'amount': loss_ratios}
+
+
+@callback(
+    Output(page_id + 'grid-yearlosses', 'getRowsResponse'),
+    Input(page_id + 'grid-yearlosses', 'getRowsRequest'),
+    State(page_id + 'store-modelfile', 'data'),
+)
+def get_yearlosses(request, data):
+    if request is None:
+        raise PreventUpdate
+
+    return get_rows_response_from_arrays(get_modelfile_ylt(data['modelfile_id']), request)
@@ -6,7 +6,7 @@ import dash_ag_grid as dag
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
+from sqlalchemy import select
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -16,7 +16,7 @@ page_id = get_page_id(__name__)
 
 def layout(analysis_id):
     analysis = db.session.get(Analysis, analysis_id)
-    df = df_from_sqla(analysis.modelfiles)
+    df = df_from_query(select(ModelFile).filter_by(analysis_id=analysis.id), columns=['id', 'name'])
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
@@ -5,9 +5,7 @@ import dash_bootstrap_components as dbc
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
 import numpy as np
-import plotly.express as px
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
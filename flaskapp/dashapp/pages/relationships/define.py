@@ -6,7 +6,8 @@ import dash_mantine_components as dmc
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
+from flaskapp.engine.bulk import bulk_upsert
+from sqlalchemy import select
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -120,32 +121,46 @@ def save_relationships(n_clicks, data, id_, value, name):
     # value is a list of the lists that give the ids of the selected model files for each layer
     # e.g. [[54, 65], [54], [54]]
     analysis_id = data['analysis_id']
-    n_layers = len(id_)
+    layer_ids = [component_id['layer_id'] for component_id in id_]
+
+    # Get the names of the layers and of the model files of the analysis
+    layer_names = dict(db.session.execute(
+        select(Layer.id, Layer.name).where(Layer.id.in_(layer_ids)).filter_by(analysis_id=analysis_id)
+    ).all())
+    modelfile_names = dict(db.session.execute(
+        select(ModelFile.id, ModelFile.name).filter_by(analysis_id=analysis_id)
+    ).all())
+
+    # The layers or the model files may have been deleted since the page was loaded, e.g. from another tab
+    unknown_layers = [layer_id for layer_id in layer_ids if layer_id not in layer_names]
+    unknown_modelfiles = {
+        modelfile_id for modelfile_ids in value for modelfile_id in modelfile_ids or []
+        if modelfile_id not in modelfile_names
+    }
+    if unknown_layers or unknown_modelfiles:
+        alert = dbc.Alert(
+            'Some layers or model files no longer exist. Reload the page and save the relationships again',
+            id=page_id + 'alert-relationships-invalid',
+            color='danger',
+        )
+        return alert
 
     # Save the pricing relationship file
-    pricingrelationship = PricingRelationship(
-        name=name,
-        analysis_id=analysis_id,
-    )
-    db.session.add(pricingrelationship)
-    db.session.commit()
+    pricingrelationship_id, = bulk_upsert(PricingRelationship, [{'name': name, 'analysis_id': analysis_id}])
 
     # Save the layer-to-modelfiles relationships
-    for i in range(n_layers):
-        layer_id = id_[i]['layer_id']
-        layer = db.session.get(Layer, layer_id)
-
-        for modelfile_id in value[i]:
-            modelfile = db.session.get(ModelFile, modelfile_id)
-
-            layertomodelfile = LayerToModelfile(
-                name=f'{layer.name} - {modelfile.name}',
-                pricingrelationship_id=pricingrelationship.id,
-                layer_id=layer.id,
-                modelfile_id=modelfile.id
-            )
-            db.session.add(layertomodelfile)
-        db.session.commit()  # Commit after the loop for DB performance
+    rows = [
+        {
+            'name': f'{layer_names[layer_id]} - {modelfile_names[modelfile_id]}',
+            'pricingrelationship_id': pricingrelationship_id,
+            'layer_id': layer_id,
+            'modelfile_id': modelfile_id
+        }
+        for layer_id, modelfile_ids in zip(layer_ids, value)
+        for modelfile_id in modelfile_ids or []
+    ]
+    bulk_upsert(LayerToModelfile, rows)
+    db.session.commit()  # Commit once for the relationship and all its pairs
 
     alert = dbc.Alert(
         'The relationships have been saved',
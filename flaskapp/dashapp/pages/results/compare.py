@@ -6,7 +6,6 @@ import dash_mantine_components as dmc
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -6,8 +6,9 @@ import dash_ag_grid as dag
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
-import time
+from flaskapp.jobs import submit_job, get_jobs, cancel_job, FINISHED, DONE, FAILED
+from flaskapp.engine.pricing import get_stale_pricingrelationship_ids
+import numpy as np
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -15,13 +16,30 @@ dash.register_page(__name__, path_template=f'/{directory}/{page}/<analysis_id>',
 page_id = get_page_id(__name__)
 
 
+def get_df_relationships(analysis_id):
+    # Get the pricing relationships with the id of their last result file in a single query
+    df = df_from_query(
+        select_with_last_child_id(PricingRelationship, ResultFile.pricingrelationship_id, 'resultfile_id')
+        .where(PricingRelationship.analysis_id == analysis_id)
+    )
+    df['resultfile_id'] = df['resultfile_id'].astype('Int64')
+    df['results'] = get_link_results(df)
+
+    # Flag the results whose layers or model files have changed since they were processed
+    stale_ids = get_stale_pricingrelationship_ids(df['id'].tolist())
+    df['status'] = np.where(df['id'].isin(stale_ids), 'Stale', np.where(df['resultfile_id'].notna(), 'Up to date', ''))
+
+    return df
+
+
 def layout(analysis_id):
     analysis = db.session.get(Analysis, analysis_id)
-    df = df_from_sqla(analysis.pricingrelationships)
-    df['results'] = df.apply(get_link_results, axis=1)
+    df = get_df_relationships(analysis.id)
 
     return html.Div([
         dcc.Store(id=page_id + 'store', data={'analysis_id': analysis_id}),
+        dcc.Store(id=page_id + 'store-jobs', data=[]),
+        dcc.Interval(id=page_id + 'interval-jobs', interval=1000, disabled=True),
         own_title(__name__, analysis.name),
         own_nav_middle(__name__, analysis.id),
         own_nav_bottom(__name__, analysis.id),
@@ -30,6 +48,7 @@ def layout(analysis_id):
             dbc.Row([
                 dbc.Col([
                     own_button(page_id + 'btn-process', 'Process'),
+                    own_button(page_id + 'btn-cancel', 'Cancel'),
                     own_button(page_id + 'btn-delete', 'Delete'),
                     dcc.Loading(
                         html.Div(
@@ -40,6 +59,14 @@ def layout(analysis_id):
                                     {'field': 'id', 'hide': True},
                                     {'field': 'name', 'checkboxSelection': True},
                                     {'field': 'results', 'cellRenderer': 'markdown'},
+                                    {
+                                        'field': 'status',
+                                        'cellStyle': {
+                                            'styleConditions': [
+                                                {'condition': "params.value == 'Stale'", 'style': {'color': 'red'}},
+                                            ],
+                                        },
+                                    },
                                 ],
                                 getRowId='params.data.id',
                                 columnSize='responsiveSizeToFit',
@@ -55,6 +82,14 @@ def layout(analysis_id):
             ]),
             dbc.Row([
                 dbc.Col([
+                    dbc.Progress(
+                        id=page_id + 'progress-jobs',
+                        value=0,
+                        striped=True,
+                        animated=True,
+                        style={'display': 'none'},
+                        className='mb-2',
+                    ),
                     dbc.Alert(
                         'The result has been saved',
                         id=page_id + 'alert_save',
@@ -62,6 +97,11 @@ def layout(analysis_id):
                         is_open=False,
                         duration=4000,
                     ),
+                    dbc.Alert(
+                        id=page_id + 'alert-failed',
+                        color='danger',
+                        is_open=False,
+                    ),
                 ], width=5),
             ]),
             dbc.Row([
@@ -74,70 +114,80 @@ def layout(analysis_id):
 
 
 @callback(
-    Output(page_id + 'grid-relationships', 'rowData'),
-    Output(page_id + 'alert_save', 'is_open'),
+    Output(page_id + 'store-jobs', 'data'),
+    Output(page_id + 'interval-jobs', 'disabled', allow_duplicate=True),
     Input(page_id + 'btn-process', 'n_clicks'),
-    State(page_id + 'store', 'data'),
     State(page_id + 'grid-relationships', 'selectedRows'),
+    config_prevent_initial_callbacks=True
 )
-def process_result(n_clicks, data, selectedRows):
-    if n_clicks is None or selectedRows is None:
+def process_result(n_clicks, selectedRows):
+    if n_clicks is None or not selectedRows:
         return no_update
 
-    analysis_id = data['analysis_id']
-    analysis = db.session.get(Analysis, analysis_id)
-    is_open = False
-    start = time.perf_counter()  # TODO: Timer
-
-    for row in selectedRows:
-        # Check if the pricing relationships has already been processed
-        # If not, process and save the result file and the result year losses
-        pricingrelationship_id = row['id']
-        check = db.session.query(ResultFile). \
-            filter_by(analysis_id=analysis_id, pricingrelationship_id=pricingrelationship_id).first()
-
-        if not check:
-            # Save the result file
-            resultfile = ResultFile(
-                name=db.session.get(PricingRelationship, pricingrelationship_id).name,
-                analysis_id=analysis_id,
-                pricingrelationship_id=pricingrelationship_id
-            )
-            db.session.add(resultfile)
-            db.session.commit()
-
-            # Save the result year losses
-            for layertomodelfile in resultfile.pricingrelationship.layertomodelfiles:
-                layer = layertomodelfile.layer
-                modelfile = layertomodelfile.modelfile
-
-                for modelyearloss in modelfile.modelyearlosses:
-                    resultyearloss = ResultYearLoss(
-                        name=modelyearloss.name,
-                        resultfile_id=resultfile.id,
-                        layertomodelfile_id=layertomodelfile.id,
-                        year=modelyearloss.year,
-                        # For the SL, the amount contains the simulated loss ratio
-                        grossloss=layer.premium * modelyearloss.amount
-                    )
-
-                    # Apply the SL cover to get the recovery and net amount
-                    resultyearloss.recovery = get_sl_recovery(
-                        resultyearloss.grossloss,
-                        layer.premium,
-                        layer.limit,
-                        layer.deductible,
-                    )
-                    resultyearloss.netloss = resultyearloss.grossloss - resultyearloss.recovery
-
-                    db.session.add(resultyearloss)
-                db.session.commit()  # Commit after the loop for DB performance
-
-            is_open = True
-
-    df = df_from_sqla(analysis.pricingrelationships)
-    df['results'] = df.apply(get_link_results, axis=1)
-    rowData = df.to_dict('records')
-
-    print(f'Elapsed time: {time.perf_counter() - start}')  # TODO: Timer
-    return rowData, is_open
+    # Queue a single job pricing the relationships that have not been processed yet or whose results are stale
+    # over a process pool, only the changed pairs of the stale results being priced again
+    # The job is run by the workers (flask jobs worker) and polled with the interval component
+    rows = [row for row in selectedRows if row.get('resultfile_id') is None or row.get('status') == 'Stale']
+
+    if not rows:
+        return no_update
+
+    job_ids = [
+        submit_job(
+            'process_pricingrelationships',
+            {'pricingrelationship_ids': [row['id'] for row in rows]},
+            name=', '.join(row['name'] for row in rows)[:50],
+        )
+    ]
+
+    return job_ids, False
+
+
+@callback(
+    Output(page_id + 'grid-relationships', 'rowData'),
+    Output(page_id + 'alert_save', 'is_open'),
+    Output(page_id + 'alert-failed', 'children'),
+    Output(page_id + 'alert-failed', 'is_open'),
+    Output(page_id + 'progress-jobs', 'value'),
+    Output(page_id + 'progress-jobs', 'label'),
+    Output(page_id + 'progress-jobs', 'style'),
+    Output(page_id + 'interval-jobs', 'disabled'),
+    Input(page_id + 'interval-jobs', 'n_intervals'),
+    State(page_id + 'store', 'data'),
+    State(page_id + 'store-jobs', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def poll_jobs(n_intervals, data, job_ids):
+    if not job_ids:
+        raise PreventUpdate
+
+    jobs = get_jobs(job_ids)
+    progress = 100 * sum(job['progress'] or 0 for job in jobs) / len(jobs)
+
+    if not all(job['status'] in FINISHED for job in jobs):
+        return no_update, no_update, no_update, no_update, progress, f'{progress:.0f}%', {'display': 'flex'}, False
+
+    # All the jobs are finished: update the relationships grid
+    rowData = get_df_relationships(data['analysis_id']).to_dict('records')
+    is_open = any(job['status'] == DONE for job in jobs)
+    failed = [job['name'] for job in jobs if job['status'] == FAILED]
+    alert_failed = f'The processing failed for: {", ".join(failed)}' if failed else None
+
+    return rowData, is_open, alert_failed, bool(failed), 100, '', {'display': 'none'}, True
+
+
+@callback(
+    Output(page_id + 'interval-jobs', 'disabled', allow_duplicate=True),
+    Input(page_id + 'btn-cancel', 'n_clicks'),
+    State(page_id + 'store-jobs', 'data'),
+    config_prevent_initial_callbacks=True
+)
+def cancel_jobs(n_clicks, job_ids):
+    if not job_ids:
+        raise PreventUpdate
+
+    for job_id in job_ids:
+        cancel_job(job_id)
+
+    # Keep polling until the running jobs have stopped
+    return False
@@ -7,7 +7,9 @@ import dash_mantine_components as dmc
 from flaskapp.dashapp.pages.utils import *
 from flaskapp.extensions import db
 from flaskapp.models import *
-import pandas as pd
+from flaskapp.engine.statistics import QUANTILES, get_result_statistics
+from flaskapp.metrics import span
+from sqlalchemy import select
 
 directory = get_directory(__name__)['directory']
 page = get_directory(__name__)['page']
@@ -16,10 +18,12 @@ page_id = get_page_id(__name__)
 
 
 def layout(analysis_id, resultfile_id=None):
+    # pandas is imported by the first call rather than with the pages
+    import pandas as pd
+
     analysis = db.session.get(Analysis, analysis_id)
 
     # Initialize the OEP and summary tables
-    QUANTILES = [.999, .998, .996, .995, .99, .98, .9667, .96, .95, .9, .8, .5]
     df_oep = pd.DataFrame(
         {
             'quantile': [f'{quantile:.2%}' for quantile in QUANTILES],
@@ -47,15 +51,22 @@ def layout(analysis_id, resultfile_id=None):
         # Set the title of the page
         title = resultfile.name.capitalize()
 
-        # Get the layers and model files for the result's pricing relationship
+        # Get the layers and model files for the result's pricing relationship with a single query
         # Use the set() function to get the layers without repetition
-        # Sort the objects by name with the sorted() function
-        layertomodelfiles = resultfile.pricingrelationship.layertomodelfiles
-
-        modelfiles = set([layertomodelfile.modelfile for layertomodelfile in layertomodelfiles])
+        # Sort the layers and model files by name with the sorted() function
+        with span('query'):
+            layertomodelfiles = db.session.execute(
+                select(Layer, ModelFile)
+                .select_from(LayerToModelfile)
+                .join(Layer, LayerToModelfile.layer_id == Layer.id)
+                .join(ModelFile, LayerToModelfile.modelfile_id == ModelFile.id)
+                .where(LayerToModelfile.pricingrelationship_id == resultfile.pricingrelationship_id)
+            ).all()
+
+        modelfiles = set([modelfile for layer, modelfile in layertomodelfiles])
         modelfiles = sorted(modelfiles, key=lambda modelfile: modelfile.name)
 
-        layers = set([layertomodelfile.layer for layertomodelfile in layertomodelfiles])
+        layers = set([layer for layer, modelfile in layertomodelfiles])
         layers = sorted(layers, key=lambda layer: layer.name)
 
         # Add rows to df_summary relating to the model files
@@ -96,38 +107,24 @@ def layout(analysis_id, resultfile_id=None):
         
         """
 
-        # Get the result file's year loss table
-        resultyearlosses = resultfile.resultyearlosses
+        # Get the statistics of the result file: the result year losses are aggregated by the database
+        with span('statistics'):
+            statistics = get_result_statistics(resultfile.id)
 
         for layer in layers:
-            # Get the year loss table for the current layer
-            resultyearlosses_for_layer = [
-                resultyearloss for resultyearloss in resultyearlosses
-                if resultyearloss.layertomodelfile.layer == layer
-            ]
-
-            if len(resultyearlosses_for_layer) > 0:
-                recoveries = df_from_sqla(resultyearlosses_for_layer)[['year', 'recovery']]
-                recoveries['recovery'] = recoveries['recovery'].astype(int)
+            layer_statistics = statistics.get(layer.id, {})
 
-                recoveries_by_year = recoveries.groupby('year')['recovery'].sum()
-                df_oep[layer.name] = df_oep['proba'].map(lambda proba: f'{recoveries_by_year.quantile(proba):,.0f}')
+            if 'oep' in layer_statistics:
+                df_oep[layer.name] = [f'{quantile:,.0f}' for quantile in layer_statistics['oep']]
 
-                df_summary.at['Pure premium', layer.name] = f'{recoveries_by_year.mean():,.0f}'
-                df_summary.at['Standard deviation', layer.name] = f'{recoveries_by_year.std():,.0f}'
+                df_summary.at['Pure premium', layer.name] = f'{layer_statistics["pure_premium"]:,.0f}'
+                df_summary.at['Standard deviation', layer.name] = f'{layer_statistics["std"]:,.0f}'
 
             # Get the expected loss by loss model
             for modelfile in modelfiles:
-                resultyearlosses_for_layer_and_modelfile = [
-                    resultyearloss for resultyearloss in resultyearlosses_for_layer
-                    if resultyearloss.layertomodelfile.modelfile == modelfile
-                ]
-                recoveries_modelfile = df_from_sqla(resultyearlosses_for_layer_and_modelfile)
-
-                if len(recoveries_modelfile) > 0:
-                    recoveries_modelfile['recovery'] = recoveries_modelfile['recovery'].astype(int)
+                if modelfile.id in layer_statistics.get('modelfiles', {}):
                     df_summary.at[f'PP {modelfile.name}', layer.name] \
-                        = f'{round(recoveries_modelfile["recovery"].mean()):,.0f}'
+                        = f'{round(layer_statistics["modelfiles"][modelfile.id]):,.0f}'
 
     else:
         # Set the title of the page
@@ -10,7 +10,10 @@ Functions:
 - get_directory(module): Extract the directory and page names from a module path.
 - get_navloc(module): Determine the navigation location for a given page.
 - get_page_id(module): Generate a unique page ID based on the directory and page names.
-- df_from_query(query): Convert SQLAlchemy query results into a pandas DataFrame.
+- df_from_query(query, columns, chunksize): Build a typed pandas DataFrame from a SQLAlchemy select.
+- own_infinite_grid(component_id, columnDefs, **kwargs): Create an AG Grid whose rows are requested page by page.
+- get_rows_response(query, request, order_by): Serve a page of sorted and filtered rows of a select to an AG Grid.
+- get_rows_response_from_arrays(data, request): Serve a page of sorted and filtered rows of NumPy arrays to an AG Grid.
 - get_table_analyses(component_id, query): Generate a data table for analysis records.
 - get_table_layers(component_id, query): Generate a data table for layers records.
 - get_table_lossfiles(component_id, query): Generate a data table for loss files records.
@@ -37,8 +40,9 @@ from dash import html, dash_table
 import dash_bootstrap_components as dbc
 from flaskapp.extensions import db
 from flaskapp.models import *
+from sqlalchemy import select, func, and_, or_, not_
+import dash_ag_grid as dag
 import numpy as np
-import pandas as pd
 
 
 def own_nav_top():
@@ -208,27 +212,218 @@ def get_page_id(module):
     return page_id
 
 
-def df_from_sqla(query):
-    # https://stackoverflow.com/questions/1958219/how-to-convert-sqlalchemy-row-object-to-a-python-dict
-    list_from_query = \
-        [{col.name: str(getattr(record, col.name)) for col in record.__table__.columns} for record in query]
+def df_from_query(query, columns=None, chunksize=None):
+    """
+    Build a pandas DataFrame directly from the cursor of a SQLAlchemy select, without creating ORM objects.
+    The columns keep the types of the database (integers, floats, strings...).
 
-    return pd.DataFrame(list_from_query)
+    query: a select, e.g. select(Layer).filter_by(analysis_id=analysis_id)
+           or select(HistoLoss).where(with_parent(lossfile, HistoLossFile.losses)) for a relationship
+    columns: optional list of the names of the columns to load
+    chunksize: if given, return an iterator of DataFrames of at most chunksize rows instead of a single DataFrame
+    """
+    if columns is not None:
+        query = query.with_only_columns(*[query.selected_columns[col] for col in columns])
 
+    # pandas is imported on the first call rather than with the pages, to keep the start of the server fast
+    import pandas as pd
 
-def get_link_results(row):
-    # Check if the pricing relationships has already been processed,
-    # that is if a corresponding result file exists
+    # Execute the select at the Core level so that the rows are tuples rather than ORM objects
+    connection = db.session.connection()
+
+    if chunksize is None:
+        result = connection.execute(query)
+        return pd.DataFrame.from_records(result.fetchall(), columns=list(result.keys()))
+
+    def iter_chunks():
+        # The options are set on the statement: on the connection, they would apply to the rest of the transaction
+        result = connection.execute(query.execution_options(stream_results=True, yield_per=chunksize))
+        columns = list(result.keys())
+        for rows in result.partitions(chunksize):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    return iter_chunks()
+
+
+# Number of rows of a page of an infinite grid
+INFINITE_GRID_PAGE_SIZE = 100
+
+
+def own_infinite_grid(component_id, columnDefs, **kwargs):
+    """
+    Create an AG Grid with the infinite row model: the grid sends a getRowsRequest for each page of rows it displays
+    and a callback answers with the getRowsResponse of the page, built with get_rows_response(), so that the whole
+    table is never sent to the browser.
+    """
+    dashGridOptions = {
+        'cacheBlockSize': INFINITE_GRID_PAGE_SIZE,
+        'maxBlocksInCache': 10,
+        'rowBuffer': 0,
+        'infiniteInitialRowCount': 1,
+    } | kwargs.pop('dashGridOptions', {})
+
+    return dag.AgGrid(
+        id=component_id,
+        columnDefs=columnDefs,
+        rowModelType='infinite',
+        dashGridOptions=dashGridOptions,
+        defaultColDef={'sortable': True, 'filter': True, 'floatingFilter': True} | kwargs.pop('defaultColDef', {}),
+        columnSize='responsiveSizeToFit',
+        **kwargs,
+    )
+
+
+def get_filter_condition(column, filter_model):
+    # Translate an AG Grid text or number filter into a SQL condition
+    # https://www.ag-grid.com/react-data-grid/filter-provided-simple/
+    if 'conditions' in filter_model:
+        conditions = [get_filter_condition(column, condition) for condition in filter_model['conditions']]
+        return and_(*conditions) if filter_model['operator'] == 'AND' else or_(*conditions)
+
+    value = filter_model.get('filter')
+
+    match filter_model['type']:
+        case 'contains':
+            return column.ilike(f'%{value}%')
+        case 'notContains':
+            return not_(column.ilike(f'%{value}%'))
+        case 'startsWith':
+            return column.ilike(f'{value}%')
+        case 'endsWith':
+            return column.ilike(f'%{value}')
+        case 'equals':
+            return column == value
+        case 'notEqual':
+            return column != value
+        case 'lessThan':
+            return column < value
+        case 'lessThanOrEqual':
+            return column <= value
+        case 'greaterThan':
+            return column > value
+        case 'greaterThanOrEqual':
+            return column >= value
+        case 'inRange':
+            return column.between(value, filter_model['filterTo'])
+        case 'blank':
+            return column.is_(None)
+        case 'notBlank':
+            return column.is_not(None)
+        case _:
+            raise ValueError(f'The filter type {filter_model["type"]} is not supported')
+
+
+def get_rows_response(query, request, order_by=()):
+    """
+    Serve the getRowsRequest of an infinite grid from a select: the filters and the sort of the grid are applied by
+    the database, which returns only the rows of the requested page.
+
+    query: a select whose columns are the fields of the grid, e.g. select(HistoLoss).filter_by(lossfile_id=1)
+    request: the getRowsRequest of the grid
+    order_by: the default order of the rows, applied after the sort of the grid, e.g. [HistoLoss.id]
+    Return the getRowsResponse of the grid.
+    """
+    columns = query.selected_columns
+
+    for col, filter_model in (request.get('filterModel') or {}).items():
+        query = query.where(get_filter_condition(columns[col], filter_model))
+
+    sort_clauses = [
+        columns[sort['colId']].desc() if sort['sort'] == 'desc' else columns[sort['colId']].asc()
+        for sort in request.get('sortModel') or []
+    ]
+    query = query.order_by(*sort_clauses, *order_by)
+
+    start_row, end_row = request['startRow'], request['endRow']
+    df = df_from_query(query.offset(start_row).limit(end_row - start_row))
+
+    return {'rowData': df.to_dict('records'), 'rowCount': get_row_count(start_row, end_row, len(df))}
+
+
+def get_row_count(start_row, end_row, nbrows):
+    # The number of rows is known when the last page is reached, -1 tells the grid that there are more rows
+    return start_row + nbrows if nbrows < end_row - start_row else -1
+
+
+def get_rows_response_from_arrays(data, request):
+    """
+    Serve the getRowsRequest of an infinite grid from a dictionary of aligned NumPy arrays, e.g. a YLT.
+    Only the number filters are supported.
+    """
+    mask = np.ones(len(next(iter(data.values()))), dtype=bool)
+
+    for col, filter_model in (request.get('filterModel') or {}).items():
+        mask &= get_filter_mask(data[col], filter_model)
+
+    index = np.flatnonzero(mask)
+
+    # Sort with a stable sort on the last sort key first, so that the first sort key prevails
+    for sort in reversed(request.get('sortModel') or []):
+        values = data[sort['colId']][index]
+        order = np.argsort(-values if sort['sort'] == 'desc' else values, kind='stable')
+        index = index[order]
+
+    start_row, end_row = request['startRow'], request['endRow']
+    index = index[start_row:end_row]
+    rowData = [dict(zip(data, row)) for row in zip(*(data[col][index].tolist() for col in data))]
+
+    return {'rowData': rowData, 'rowCount': get_row_count(start_row, end_row, len(index))}
+
+
+def get_filter_mask(values, filter_model):
+    if 'conditions' in filter_model:
+        masks = [get_filter_mask(values, condition) for condition in filter_model['conditions']]
+        return np.logical_and.reduce(masks) if filter_model['operator'] == 'AND' else np.logical_or.reduce(masks)
+
+    value = filter_model.get('filter')
+
+    match filter_model['type']:
+        case 'equals':
+            return values == value
+        case 'notEqual':
+            return values != value
+        case 'lessThan':
+            return values < value
+        case 'lessThanOrEqual':
+            return values <= value
+        case 'greaterThan':
+            return values > value
+        case 'greaterThanOrEqual':
+            return values >= value
+        case 'inRange':
+            return (values >= value) & (values <= filter_model['filterTo'])
+        case _:
+            raise ValueError(f'The filter type {filter_model["type"]} is not supported')
+
+
+def select_with_last_child_id(model, child_foreign_key, label):
+    """
+    Select the rows of model with the id of their last child, or None if they have no child,
+    with a single joined and grouped query instead of one query per row.
+
+    e.g. select_with_last_child_id(PricingRelationship, ResultFile.pricingrelationship_id, 'resultfile_id')
+    The select can be filtered further, e.g. .where(PricingRelationship.analysis_id == analysis_id)
+    """
+    child = child_foreign_key.class_
+    columns = model.__table__.columns
+
+    return (
+        select(*columns, func.max(child.id).label(label))
+        .outerjoin(child, child_foreign_key == model.id)
+        .group_by(*columns)
+        .order_by(model.id)
+    )
+
+
+def get_link_results(df):
+    # Check if the pricing relationships have already been processed,
+    # that is if the column resultfile_id gives a corresponding result file
     # If so, create a link to the result
-    resultfile = db.session.query(ResultFile) \
-        .filter_by(analysis_id=row['analysis_id'], pricingrelationship_id=row['id']).first()
+    links = '[View results]' \
+        + '(/dashapp/results/view/' + df['analysis_id'].astype(str) \
+        + '?resultfile_id=' + df['resultfile_id'].astype('Int64').astype(str) + ')'
 
-    if resultfile:
-        # Link to the result
-        return '[View results]' \
-            + '(/dashapp/results/view/' + row['analysis_id'] + '?resultfile_id=' + str(resultfile.id) + ')'
-    else:
-        return 'Process to get results'
+    return links.where(df['resultfile_id'].notna(), 'Process to get results')
 
 
 def own_button(component_id, name):
@@ -256,7 +451,3 @@ def get_lognorm_param(serie):
         'scale': scale,
         's': s
     }
-
-
-def get_sl_recovery(gross_loss, premium, limit, deductible):
-    return min(limit / 100 * premium, max(0, gross_loss - deductible / 100 * premium))
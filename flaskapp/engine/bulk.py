@@ -0,0 +1,192 @@
+"""
+This module defines the bulk writers used to persist year loss tables and batches of edited rows without ORM objects.
+
+On PostgreSQL, the rows are streamed to the server with COPY FROM STDIN.
+On the other databases (e.g. SQLite with SQLiteConfig), the rows are inserted with executemany in batches.
+In both cases, the rows are written in the transaction of the current session and are never held in memory
+all at once: the columns are serialized batch by batch.
+
+The rows edited in a grid, e.g. the layers of an analysis, are saved with a single query that reads the existing ids,
+one executemany INSERT ... RETURNING for the new rows and one executemany UPDATE for the others.
+
+Functions:
+- bulk_insert(table, data, batch_size): Insert the columns of data into table.
+- bulk_upsert(model, rows): Insert or update the rows of a model and get their ids.
+- bulk_update(model, rows, **filters): Update existing rows of a model, restricted to the rows matching filters.
+
+Dependencies:
+- numpy
+- sqlalchemy
+
+"""
+
+import numpy as np
+from sqlalchemy import select, insert, update
+from flaskapp.extensions import db
+
+BATCH_SIZE = 10000
+
+
+class _CopyStream:
+    # File-like object read by psycopg2's copy_expert
+    # The text format of COPY is generated one batch of rows at a time
+    def __init__(self, batches):
+        self.batches = batches
+        self.buffer = ''
+        self.nrows = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            batch = next(self.batches, None)
+            if batch is None:
+                break
+            lines = ['\t'.join(_copy_value(value) for value in row) for row in batch]
+            self.buffer += '\n'.join(lines) + '\n'
+            self.nrows += len(lines)
+
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def _copy_value(value):
+    return r'\N' if value is None else str(value)
+
+
+def _iter_chunks(data):
+    # data is either a dictionary of columns or an iterable of such dictionaries
+    if isinstance(data, dict):
+        yield data
+    else:
+        yield from data
+
+
+def _iter_batches(data, columns, batch_size):
+    # Yield lists of row tuples with at most batch_size rows
+    for chunk in _iter_chunks(data):
+        length = max((np.size(value) for value in chunk.values() if np.ndim(value) > 0), default=1)
+
+        for start in range(0, length, batch_size):
+            stop = min(start + batch_size, length)
+            values = [
+                np.asarray(chunk[col])[start:stop].tolist() if np.ndim(chunk[col]) > 0
+                else [chunk[col]] * (stop - start)
+                for col in columns
+            ]
+            yield list(zip(*values))
+
+
+def bulk_insert(table, data, batch_size=BATCH_SIZE):
+    """
+    Insert the columns of data into table within the transaction of the current session.
+
+    table is a SQLAlchemy table or a model, e.g. ResultYearLoss.
+    data is a dictionary {column name: array or scalar} or an iterable of such dictionaries, e.g. a generator
+    of chunks. The scalars are broadcast to the length of the arrays.
+    Return the number of inserted rows.
+    """
+    table = getattr(table, '__table__', table)
+    data = iter(_iter_chunks(data))
+    first_chunk = next(data, None)
+
+    if first_chunk is None:
+        return 0
+
+    columns = list(first_chunk)
+
+    def chunks():
+        yield first_chunk
+        yield from data
+
+    batches = _iter_batches(chunks(), columns, batch_size)
+    connection = db.session.connection()
+
+    if connection.dialect.name == 'postgresql':
+        stream = _CopyStream(batches)
+        quote = connection.dialect.identifier_preparer.quote
+        sql = f'COPY {quote(table.name)} ({", ".join(quote(col) for col in columns)}) FROM STDIN'
+        cursor = connection.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(sql, stream, size=65536)
+        finally:
+            cursor.close()
+        return stream.nrows
+
+    nrows = 0
+    for batch in batches:
+        connection.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+        nrows += len(batch)
+    return nrows
+
+
+def _validate_row(model, row):
+    # Run the validators of the model (@validates) as the ORM does when the attributes are set
+    instance = model(**row)
+    return {key: getattr(instance, key) for key in row}
+
+
+def bulk_upsert(model, rows):
+    """
+    Insert or update the rows of a model within the transaction of the current session.
+
+    rows is a list of dictionaries {attribute: value}. The rows whose id exists in the table are updated, the other
+    rows are inserted with a new id. All the rows are checked by the validators of the model before any write,
+    which raise a ValueError for invalid data.
+    Return the list of the ids of the rows, in the order of rows.
+    """
+    rows = [_validate_row(model, row) for row in rows]
+
+    # Read the existing ids with a single query
+    ids = [row['id'] for row in rows if row.get('id') is not None]
+    existing_ids = set(db.session.execute(select(model.id).where(model.id.in_(ids))).scalars()) if ids else set()
+
+    new_rows = [
+        (position, {key: value for key, value in row.items() if key != 'id'})
+        for position, row in enumerate(rows) if row.get('id') not in existing_ids
+    ]
+    updated_rows = [row for row in rows if row.get('id') in existing_ids]
+
+    # The ORM bulk statements run as executemany, batched in multi-row INSERT ... RETURNING statements
+    result_ids = [row.get('id') for row in rows]
+    if new_rows:
+        # SQLite cannot sort the returned ids by row (SQLAlchemy would then insert the rows one at a time),
+        # but it gives the new rows increasing ids in the order of the rows, under its database-wide write lock
+        sqlite = db.session.connection().dialect.name == 'sqlite'
+        statement = insert(model).returning(model.id, sort_by_parameter_order=not sqlite)
+        new_ids = db.session.execute(statement, [row for _, row in new_rows]).scalars().all()
+        if sqlite:
+            new_ids = sorted(new_ids)
+
+        for (position, _), new_id in zip(new_rows, new_ids):
+            result_ids[position] = new_id
+
+    if updated_rows:
+        db.session.execute(update(model), updated_rows)
+
+    return result_ids
+
+
+def bulk_update(model, rows, **filters):
+    """
+    Update existing rows of a model within the transaction of the current session, e.g. the layers of an analysis
+    with filters analysis_id=analysis_id.
+
+    rows is a list of dictionaries {attribute: value} with their id. All the rows are checked by the validators of the
+    model, and their ids must exist among the rows matching filters, before any write: a ValueError is raised otherwise,
+    so that rows deleted in the meantime or of another parent are never written.
+    """
+    rows = [_validate_row(model, row) for row in rows]
+
+    ids = [row.get('id') for row in rows]
+    existing_ids = set(db.session.execute(
+        select(model.id).where(model.id.in_([id_ for id_ in ids if id_ is not None])).filter_by(**filters)
+    ).scalars())
+    if any(id_ not in existing_ids for id_ in ids):
+        raise ValueError(f'Some {model.__tablename__}s no longer exist. Reload the page and save the changes again')
+
+    if rows:
+        db.session.execute(update(model), rows)
@@ -0,0 +1,175 @@
+"""
+This module defines the content-addressed cache of the priced layer-to-modelfile pairs.
+
+The year losses of a pair only depend on the YLT of its model file and on the terms of its layer. A priced pair is
+therefore cached under a key computed from the digest of the YLT (the ylt_digest column of the model file) and the
+premium, deductible and limit of the layer, whatever the analysis, the relationship or the pair: the same model file
+priced against the same terms, e.g. in a copied analysis or in another relationship, is served from the cache without
+loading its YLT. The key also holds PRICING_VERSION, the version of the pricing of a pair, so that a change of the
+pricing never serves the pairs priced by the previous code from the disk shared across deployments.
+
+The cache is bounded in memory (PRICING_CACHE_MAX_BYTES). The least recently used entries are spilled to a directory
+on disk (the PRICING_CACHE_DIR setting, by default in the temporary directory), which is itself bounded
+(PRICING_CACHE_MAX_DISK_BYTES) and shared by the processes of the server.
+
+Functions:
+- get_pricing_key(ylt_digest, premium, deductible, limit): Get the key of a priced pair in the cache.
+
+Dependencies:
+- numpy
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from flask import current_app, has_app_context
+
+# Version of the pricing of a pair (flaskapp.engine.pricing.price_layertomodelfile and get_sl_recoveries), to be
+# incremented with any change of the priced year losses
+PRICING_VERSION = 1
+
+# Memory used by the priced pairs kept in the cache of a process
+PRICING_CACHE_MAX_BYTES = 256 * 2 ** 20
+
+# Disk space used by the priced pairs spilled from the memory, shared by all the processes
+PRICING_CACHE_MAX_DISK_BYTES = 2 * 2 ** 30
+
+# Columns of a priced pair that are cached, the layer-to-modelfile id being added when the pair is reused
+CACHED_COLUMNS = ['year', 'grossloss', 'recovery', 'netloss']
+
+
+def get_pricing_key(ylt_digest, premium, deductible, limit):
+    terms = json.dumps([PRICING_VERSION, ylt_digest, premium, deductible, limit])
+    return hashlib.sha256(terms.encode()).hexdigest()
+
+
+def get_cache_dir():
+    if has_app_context() and current_app.config.get('PRICING_CACHE_DIR'):
+        return current_app.config['PRICING_CACHE_DIR']
+    return os.path.join(tempfile.gettempdir(), 'sly-pricing-cache')
+
+
+def get_nbytes(results):
+    return sum(results[col].nbytes for col in CACHED_COLUMNS)
+
+
+class PricingCache:
+    """
+    LRU cache of the priced pairs, bounded by the total size of their arrays, with a bounded spill to disk.
+    The arrays are read-only since they are shared by all the callers.
+    """
+
+    def __init__(self, max_bytes=PRICING_CACHE_MAX_BYTES, max_disk_bytes=PRICING_CACHE_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            results = self.entries.get(key)
+            if results is not None:
+                self.entries.move_to_end(key)
+                return results
+
+        results = self.read(key)
+        if results is not None:
+            self.put(key, results)
+        return results
+
+    def put(self, key, results):
+        results = {col: results[col] for col in CACHED_COLUMNS}
+        for array in results.values():
+            array.setflags(write=False)
+
+        nbytes = get_nbytes(results)
+        # An entry larger than the memory of the cache goes straight to the disk
+        if nbytes > self.max_bytes:
+            self.write(key, results)
+            return
+
+        spilled = []
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = results
+            self.nbytes += nbytes
+
+            # Evict the least recently used entries from the memory
+            while self.nbytes > self.max_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                self.nbytes -= get_nbytes(evicted)
+                spilled.append((evicted_key, evicted))
+
+        # The evicted entries are written to the disk outside of the lock
+        for evicted_key, evicted in spilled:
+            self.write(evicted_key, evicted)
+
+    def clear(self):
+        # Only the memory is cleared: the disk is shared with the other processes
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def get_path(self, key):
+        return os.path.join(get_cache_dir(), f'{key}.npz')
+
+    def read(self, key):
+        path = self.get_path(key)
+        try:
+            with np.load(path) as npz:
+                results = {col: npz[col] for col in CACHED_COLUMNS}
+            # Mark the file as recently used
+            os.utime(path)
+        except (OSError, KeyError, ValueError):
+            return None
+        return results
+
+    def write(self, key, results):
+        if self.max_disk_bytes <= 0:
+            return
+
+        path = self.get_path(key)
+        if os.path.exists(path):
+            return
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file renamed at the end, so that the other processes never read a partial file
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    np.savez(file, **results)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.prune()
+        except OSError:
+            # The disk is only a spill of the memory: a failed write loses the entry, not the pricing
+            pass
+
+    def prune(self):
+        # Remove the least recently used files until the disk space is below its bound
+        files = [entry for entry in os.scandir(get_cache_dir()) if entry.name.endswith('.npz')]
+        sizes = {entry.path: entry.stat() for entry in files}
+        total = sum(stat.st_size for stat in sizes.values())
+
+        for path, stat in sorted(sizes.items(), key=lambda item: item[1].st_mtime):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= stat.st_size
+
+
+pricing_cache = PricingCache()
@@ -0,0 +1,173 @@
+"""
+This module defines the multi-core processing of several pricing relationships.
+
+The layer-to-modelfile pairs of the relationships are independent: each pair is priced as a task of a process pool.
+Each worker process opens its own database connection (without connection pool) to read the YLTs and keeps the last
+YLTs it has read in memory, since a model file usually feeds several layers.
+The parent process collects the priced pairs and saves the result file of a relationship in a single transaction as
+soon as all its pairs are priced, so that a relationship is either fully saved or not saved at all.
+Only the pairs of the relationships without result file and the changed pairs of the stale result files are priced,
+the pairs found in the cache of the parent process being reused without starting a task.
+
+Functions:
+- get_max_workers(nbtasks): Get the number of worker processes.
+- process_pricingrelationships(pricingrelationship_ids, max_workers, on_progress): Price relationships over a process
+  pool and save their result files.
+
+Dependencies:
+- numpy
+- sqlalchemy
+
+"""
+
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+
+from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from flaskapp.extensions import db
+from flaskapp.engine.pricing import get_layertomodelfiles, get_pricing_plan, load_modelfile_ylt, \
+    price_layertomodelfile, get_cached_layertomodelfile, cache_layertomodelfile, concatenate_results, \
+    price_pricingrelationship, save_resultfile
+
+# Number of YLTs kept in memory by a worker process
+YLT_CACHE_SIZE = 8
+
+# Seconds after which the progress is reported again while no relationship is saved, so that a job waiting for long
+# pairs is still heartbeating and can be cancelled
+PROGRESS_INTERVAL = 30
+
+# Database engine of a worker process, created by _init_worker
+_engine = None
+
+
+def _init_worker(database_uri):
+    global _engine
+    # The connections must not be shared with the parent process: each worker opens its own
+    _engine = create_engine(database_uri, poolclass=NullPool)
+
+
+@lru_cache(maxsize=YLT_CACHE_SIZE)
+def _load_modelfile_ylt(modelfile_id):
+    with _engine.connect() as connection:
+        return load_modelfile_ylt(modelfile_id, connection)
+
+
+def _price_layertomodelfile(modelfile_id, layertomodelfile_id, premium, deductible, limit):
+    return price_layertomodelfile(_load_modelfile_ylt(modelfile_id), layertomodelfile_id, premium, deductible, limit)
+
+
+def get_max_workers(nbtasks):
+    # PRICING_MAX_WORKERS bounds the number of processes, which defaults to the number of cores
+    max_workers = current_app.config.get('PRICING_MAX_WORKERS') or os.cpu_count() or 1
+    return max(1, min(max_workers, nbtasks))
+
+
+def process_pricingrelationships(pricingrelationship_ids, max_workers=None, on_progress=None):
+    """
+    Price pricing relationships over a process pool and save their result files.
+
+    The relationships whose result file is up to date are skipped, only the changed pairs of the stale result files
+    are priced again.
+    on_progress(nbdone, nbtotal) is called after each saved relationship, and every PROGRESS_INTERVAL seconds while
+    the processes are pricing, and may raise to stop the processing: the relationships already saved are kept.
+    Return a dictionary {pricingrelationship_id: resultfile_id} of the saved result files.
+    """
+    # The fingerprints are read before the inputs: inputs changed in between make the result file stale, not wrong
+    plan = get_pricing_plan(pricingrelationship_ids)
+    pricingrelationship_ids = [pr_id for pr_id in pricingrelationship_ids if pr_id in plan]
+    resultfile_ids = {}
+
+    def save(pricingrelationship_id, results):
+        resultfile_id, fingerprints, _ = plan[pricingrelationship_id]
+        resultfile_ids[pricingrelationship_id] = save_resultfile(
+            pricingrelationship_id, results, fingerprints, resultfile_id
+        )
+        if on_progress:
+            on_progress(len(resultfile_ids), len(pricingrelationship_ids))
+
+    # Group the layer-to-modelfile pairs to price by relationship, the relationships without pair get an empty result
+    pairs = defaultdict(list)
+    for pricingrelationship_id, *pair in get_layertomodelfiles(pricingrelationship_ids):
+        layertomodelfile_ids = plan[pricingrelationship_id][2]
+        if layertomodelfile_ids is None or pair[0] in layertomodelfile_ids:
+            pairs[pricingrelationship_id].append(pair)
+
+    # Take the priced pairs from the cache, only the others are priced by the processes
+    priced_pairs = {
+        pricingrelationship_id: [
+            get_cached_layertomodelfile(ylt_digest, layertomodelfile_id, premium, deductible, limit)
+            for layertomodelfile_id, _, premium, deductible, limit, ylt_digest in pr_pairs
+        ]
+        for pricingrelationship_id, pr_pairs in pairs.items()
+    }
+
+    nbtasks = sum(results is None for pr_priced_pairs in priced_pairs.values() for results in pr_priced_pairs)
+    max_workers = max_workers or get_max_workers(nbtasks)
+
+    # Starting processes is not worth it for a single task or a single core: price in the current process
+    if max_workers == 1 or nbtasks <= 1:
+        for pricingrelationship_id in pricingrelationship_ids:
+            layertomodelfile_ids = plan[pricingrelationship_id][2]
+            save(pricingrelationship_id, price_pricingrelationship(pricingrelationship_id, layertomodelfile_ids))
+        return resultfile_ids
+
+    # The relationships without pair to price or whose pairs are all cached are saved now
+    for pricingrelationship_id in pricingrelationship_ids:
+        pr_priced_pairs = priced_pairs.get(pricingrelationship_id, [])
+        if all(results is not None for results in pr_priced_pairs):
+            save(pricingrelationship_id, concatenate_results(pr_priced_pairs))
+            priced_pairs.pop(pricingrelationship_id, None)
+
+    # Release the connection of the session before starting the processes
+    db.session.commit()
+    database_uri = db.engine.url.render_as_string(hide_password=False)
+
+    # spawn rather than fork: the children must not inherit the connections and the threads of the parent
+    executor = ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(database_uri,),
+    )
+
+    try:
+        futures = {}
+        for pricingrelationship_id, pr_priced_pairs in priced_pairs.items():
+            for position, results in enumerate(pr_priced_pairs):
+                if results is not None:
+                    continue
+                pair = pairs[pricingrelationship_id][position]
+                layertomodelfile_id, modelfile_id, premium, deductible, limit, _ = pair
+                future = executor.submit(
+                    _price_layertomodelfile, modelfile_id, layertomodelfile_id, premium, deductible, limit
+                )
+                futures[future] = (pricingrelationship_id, position)
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            if not done and on_progress:
+                on_progress(len(resultfile_ids), len(pricingrelationship_ids))
+
+            for future in done:
+                pricingrelationship_id, position = futures[future]
+                _, _, premium, deductible, limit, ylt_digest = pairs[pricingrelationship_id][position]
+                pr_priced_pairs = priced_pairs[pricingrelationship_id]
+                pr_priced_pairs[position] = future.result()
+                cache_layertomodelfile(ylt_digest, pr_priced_pairs[position], premium, deductible, limit)
+
+                # All the pairs of the relationship are priced: save its result file in a single transaction
+                if all(results is not None for results in pr_priced_pairs):
+                    save(pricingrelationship_id, concatenate_results(pr_priced_pairs))
+                    del priced_pairs[pricingrelationship_id]
+
+    finally:
+        # On error or cancellation, the pending tasks are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return resultfile_ids
@@ -0,0 +1,350 @@
+"""
+This module defines the vectorized stop-loss (SL) pricing engine.
+
+The year loss table (YLT) of a model file is loaded once as a NumPy array and the terms of the layer
+(premium, deductible and limit) are applied to the whole array in one shot.
+The YLT is read from its binary storage, regenerated from its seed for the simulated model files saved without it,
+or read from the model year losses for the legacy model files.
+
+A result file records the fingerprint of the inputs of each of its layer-to-modelfile pairs: the terms of the layer
+and the digest of the YLT of the model file, or the id of the model file for the legacy model files without digest.
+When the inputs of some pairs change, the result file is stale and only these pairs are priced again, the result year
+losses of the other pairs being kept.
+
+The priced pairs are cached under the digest of the YLT of their model file and the terms of their layer
+(see flaskapp.engine.cache): a model file priced again against the same terms, in any analysis, is not loaded.
+
+Functions:
+- load_modelfile_ylt(modelfile_id, connection): Load the year loss table of a model file as NumPy arrays.
+- get_sl_recoveries(loss_ratios, premium, deductible, limit): Apply a SL cover to an array of loss ratios.
+- get_layertomodelfiles(pricingrelationship_ids): Get the layer-to-modelfile pairs of relationships with their terms.
+- price_layertomodelfile(ylt, layertomodelfile_id, premium, deductible, limit): Price a layer-to-modelfile pair.
+- get_cached_layertomodelfile(ylt_digest, layertomodelfile_id, premium, deductible, limit): Get a priced pair from
+  the cache.
+- cache_layertomodelfile(ylt_digest, results, premium, deductible, limit): Put a priced pair in the cache.
+- concatenate_results(priced_pairs): Concatenate the results of several layer-to-modelfile pairs.
+- price_pricingrelationship(pricingrelationship_id, layertomodelfile_ids): Price the layer-to-modelfile pairs of a
+  relationship.
+- get_fingerprints(pricingrelationship_ids): Get the fingerprints of the inputs of the pairs of relationships.
+- get_pricing_plan(pricingrelationship_ids): Get the relationships to price and their pairs whose inputs changed.
+- get_stale_pricingrelationship_ids(pricingrelationship_ids): Get the relationships whose result file is stale.
+- save_resultfile(pricingrelationship_id, results, fingerprints, resultfile_id): Save a result file, its statistics
+  and its result year losses, or update the changed pairs of a stale result file.
+- process_pricingrelationship(pricingrelationship_id): Price a relationship and save its result file.
+
+Dependencies:
+- numpy
+- sqlalchemy
+
+"""
+
+import hashlib
+import json
+
+import numpy as np
+from sqlalchemy import select, update, delete, func
+from flaskapp.extensions import db
+from flaskapp.models import Layer, LayerToModelfile, ModelFile, ModelYearLoss, PricingRelationship, ResultFile, \
+    ResultYearLoss
+from flaskapp.engine.bulk import bulk_insert
+from flaskapp.engine.cache import pricing_cache, get_pricing_key
+from flaskapp.engine.ylt import unpack_ylt
+from flaskapp.engine.simulation import generate_ylt
+from flaskapp.engine.statistics import get_results_statistics, query_result_statistics, dump_statistics
+
+RESULT_COLUMNS = ['layertomodelfile_id', 'year', 'grossloss', 'recovery', 'netloss']
+
+
+def load_modelfile_ylt(modelfile_id, connection=None):
+    # connection defaults to the session, another connection can be given e.g. in a worker process
+    connection = connection or db.session
+
+    # The year loss table is stored as a binary array, the year being implied by the position
+    blob, distribution, parameters, seed, nbyears = connection.execute(
+        select(ModelFile.ylt, ModelFile.distribution, ModelFile.parameters, ModelFile.seed, ModelFile.nbyears)
+        .where(ModelFile.id == modelfile_id)
+    ).one()
+
+    if blob is not None:
+        loss_ratios = unpack_ylt(blob)
+        return {'year': np.arange(1, len(loss_ratios) + 1, dtype=np.int64), 'amount': loss_ratios}
+
+    # Simulated model files saved without their year loss table: regenerate it from the seed
+    if distribution is not None:
+        loss_ratios = generate_ylt(distribution, parameters, seed, nbyears)
+        return {'year': np.arange(1, nbyears + 1, dtype=np.int64), 'amount': loss_ratios}
+
+    # Legacy model files: fetch the year loss table rows with a single query and no ORM object
+    rows = connection.execute(
+        select(ModelYearLoss.year, ModelYearLoss.amount)
+        .where(ModelYearLoss.modelfile_id == modelfile_id)
+        .order_by(ModelYearLoss.year)
+    ).all()
+
+    years = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    loss_ratios = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+
+    return {'year': years, 'amount': loss_ratios}
+
+
+def get_sl_recoveries(loss_ratios, premium, deductible, limit):
+    # For the SL, the amounts of the YLT are loss ratios that apply to the premium of the layer
+    # The deductible and the limit are expressed as a percentage of the premium
+    grosslosses = premium * loss_ratios
+    recoveries = np.minimum(limit / 100 * premium, np.maximum(0, grosslosses - deductible / 100 * premium))
+    netlosses = grosslosses - recoveries
+
+    # The result year losses are stored as integers
+    return {
+        'grossloss': np.rint(grosslosses).astype(np.int64),
+        'recovery': np.rint(recoveries).astype(np.int64),
+        'netloss': np.rint(netlosses).astype(np.int64),
+    }
+
+
+def get_layertomodelfiles(pricingrelationship_ids):
+    return db.session.execute(
+        select(
+            LayerToModelfile.pricingrelationship_id,
+            LayerToModelfile.id,
+            LayerToModelfile.modelfile_id,
+            Layer.premium,
+            Layer.deductible,
+            Layer.limit,
+            ModelFile.ylt_digest,
+        )
+        .join(Layer, LayerToModelfile.layer_id == Layer.id)
+        .join(ModelFile, LayerToModelfile.modelfile_id == ModelFile.id)
+        .where(LayerToModelfile.pricingrelationship_id.in_(pricingrelationship_ids))
+        .order_by(LayerToModelfile.id)
+    ).all()
+
+
+def price_layertomodelfile(ylt, layertomodelfile_id, premium, deductible, limit):
+    results = get_sl_recoveries(ylt['amount'], premium, deductible, limit)
+    results['layertomodelfile_id'] = np.full(len(ylt['year']), layertomodelfile_id, dtype=np.int64)
+    results['year'] = ylt['year']
+
+    return results
+
+
+def get_cached_layertomodelfile(ylt_digest, layertomodelfile_id, premium, deductible, limit):
+    # The legacy model files have no digest and are not cached
+    if ylt_digest is None:
+        return None
+
+    results = pricing_cache.get(get_pricing_key(ylt_digest, premium, deductible, limit))
+    if results is None:
+        return None
+
+    return results | {'layertomodelfile_id': np.full(len(results['year']), layertomodelfile_id, dtype=np.int64)}
+
+
+def cache_layertomodelfile(ylt_digest, results, premium, deductible, limit):
+    if ylt_digest is not None:
+        pricing_cache.put(get_pricing_key(ylt_digest, premium, deductible, limit), results)
+
+
+def concatenate_results(priced_pairs):
+    # Return a dictionary of NumPy arrays keyed by the columns of RESULT_COLUMNS
+    return {
+        col: np.concatenate([results[col] for results in priced_pairs]) if priced_pairs else np.empty(0, np.int64)
+        for col in RESULT_COLUMNS
+    }
+
+
+def price_pricingrelationship(pricingrelationship_id, layertomodelfile_ids=None):
+    """
+    Price the layer-to-modelfile pairs of a pricing relationship, all of them or only those of layertomodelfile_ids.
+
+    The pairs found in the cache are not priced again. The YLT of a model file is loaded only once, even if it feeds
+    several layers, and only if one of its pairs is not in the cache.
+    Return a dictionary of NumPy arrays keyed by the columns of RESULT_COLUMNS.
+    """
+    ylts = {}
+    priced_pairs = []
+
+    for _, layertomodelfile_id, modelfile_id, premium, deductible, limit, ylt_digest \
+            in get_layertomodelfiles([pricingrelationship_id]):
+        if layertomodelfile_ids is not None and layertomodelfile_id not in layertomodelfile_ids:
+            continue
+
+        results = get_cached_layertomodelfile(ylt_digest, layertomodelfile_id, premium, deductible, limit)
+
+        if results is None:
+            if modelfile_id not in ylts:
+                ylts[modelfile_id] = load_modelfile_ylt(modelfile_id)
+            results = price_layertomodelfile(ylts[modelfile_id], layertomodelfile_id, premium, deductible, limit)
+            cache_layertomodelfile(ylt_digest, results, premium, deductible, limit)
+
+        priced_pairs.append(results)
+
+    return concatenate_results(priced_pairs)
+
+
+def get_fingerprint(premium, deductible, limit, modelfile_id, ylt_digest):
+    # The YLT of a model file is identified by its digest, whatever the model file, or by the id of a legacy model file
+    inputs = json.dumps([premium, deductible, limit, ylt_digest or f'modelfile-{modelfile_id}'])
+    return hashlib.sha1(inputs.encode()).hexdigest()[:16]
+
+
+def get_fingerprints(pricingrelationship_ids):
+    """
+    Get the fingerprints of the current inputs of the layer-to-modelfile pairs of pricing relationships.
+    Return a dictionary {pricingrelationship_id: {layertomodelfile_id: fingerprint}}.
+    """
+    rows = db.session.execute(
+        select(
+            LayerToModelfile.pricingrelationship_id,
+            LayerToModelfile.id,
+            Layer.premium,
+            Layer.deductible,
+            Layer.limit,
+            ModelFile.id,
+            ModelFile.ylt_digest,
+        )
+        .join(Layer, LayerToModelfile.layer_id == Layer.id)
+        .join(ModelFile, LayerToModelfile.modelfile_id == ModelFile.id)
+        .where(LayerToModelfile.pricingrelationship_id.in_(pricingrelationship_ids))
+    ).all()
+
+    fingerprints = {pricingrelationship_id: {} for pricingrelationship_id in pricingrelationship_ids}
+    for pricingrelationship_id, layertomodelfile_id, *inputs in rows:
+        fingerprints[pricingrelationship_id][layertomodelfile_id] = get_fingerprint(*inputs)
+
+    return fingerprints
+
+
+def get_pricing_plan(pricingrelationship_ids):
+    """
+    Compare the fingerprints of the inputs of pricing relationships with those of their last result file.
+
+    Return a dictionary {pricingrelationship_id: (resultfile_id, fingerprints, layertomodelfile_ids)} of the
+    relationships to price, the relationships whose result file is up to date being left out:
+    - resultfile_id is None for a relationship without result file, and layertomodelfile_ids is None (all the pairs)
+    - for a stale result file, layertomodelfile_ids is the set of the pairs whose inputs changed
+    The result files saved before the fingerprints are stale, all their pairs being priced again.
+    """
+    last_resultfile_ids = (
+        select(func.max(ResultFile.id))
+        .where(ResultFile.pricingrelationship_id.in_(pricingrelationship_ids))
+        .group_by(ResultFile.pricingrelationship_id)
+    )
+    resultfiles = {
+        pricingrelationship_id: (resultfile_id, fingerprints)
+        for pricingrelationship_id, resultfile_id, fingerprints in db.session.execute(
+            select(ResultFile.pricingrelationship_id, ResultFile.id, ResultFile.fingerprints)
+            .where(ResultFile.id.in_(last_resultfile_ids))
+        )
+    }
+
+    plan = {}
+    for pricingrelationship_id, fingerprints in get_fingerprints(pricingrelationship_ids).items():
+        if pricingrelationship_id not in resultfiles:
+            plan[pricingrelationship_id] = (None, fingerprints, None)
+            continue
+
+        # The keys of the JSON object are strings
+        resultfile_id, saved_fingerprints = resultfiles[pricingrelationship_id]
+        saved_fingerprints = {int(key): value for key, value in (saved_fingerprints or {}).items()}
+
+        changed_ids = {
+            layertomodelfile_id for layertomodelfile_id, fingerprint in fingerprints.items()
+            if saved_fingerprints.get(layertomodelfile_id) != fingerprint
+        }
+        if changed_ids or saved_fingerprints.keys() - fingerprints.keys():
+            plan[pricingrelationship_id] = (resultfile_id, fingerprints, changed_ids)
+
+    return plan
+
+
+def get_stale_pricingrelationship_ids(pricingrelationship_ids):
+    return {
+        pricingrelationship_id
+        for pricingrelationship_id, (resultfile_id, _, _) in get_pricing_plan(pricingrelationship_ids).items()
+        if resultfile_id is not None
+    }
+
+
+def update_resultfile(resultfile_id, results, fingerprints):
+    # Replace the result year losses of the priced pairs and remove those of the pairs that no longer exist
+    priced_ids = np.unique(results['layertomodelfile_id']).tolist()
+    db.session.execute(
+        delete(ResultYearLoss)
+        .where(ResultYearLoss.resultfile_id == resultfile_id)
+        .where(ResultYearLoss.layertomodelfile_id.in_(priced_ids)
+               | ResultYearLoss.layertomodelfile_id.not_in(list(fingerprints)))
+    )
+    bulk_insert(ResultYearLoss, results | {'resultfile_id': resultfile_id})
+
+    # The statistics depend on the year losses of all the pairs: compute them in the database
+    db.session.execute(
+        update(ResultFile)
+        .where(ResultFile.id == resultfile_id)
+        .values(
+            summary=dump_statistics(query_result_statistics(resultfile_id)),
+            fingerprints={str(key): value for key, value in fingerprints.items()},
+        )
+    )
+    db.session.commit()
+
+    return resultfile_id
+
+
+def save_resultfile(pricingrelationship_id, results, fingerprints=None, resultfile_id=None):
+    """
+    Save the result file of a pricing relationship and its result year losses in a single transaction.
+    results is a dictionary of NumPy arrays keyed by the columns of RESULT_COLUMNS.
+    fingerprints is the dictionary {layertomodelfile_id: fingerprint} of the inputs of the pairs when they were read.
+    The statistics of the result are computed while the result year losses are in memory and saved as its summary.
+    When resultfile_id is given, the stale result file is updated with the results of its changed pairs instead.
+    Return the id of the result file.
+    """
+    if resultfile_id is not None:
+        return update_resultfile(resultfile_id, results, fingerprints)
+
+    pricingrelationship = db.session.get(PricingRelationship, pricingrelationship_id)
+
+    layertomodelfiles = {
+        layertomodelfile_id: (layer_id, modelfile_id)
+        for layertomodelfile_id, layer_id, modelfile_id in db.session.execute(
+            select(LayerToModelfile.id, LayerToModelfile.layer_id, LayerToModelfile.modelfile_id)
+            .where(LayerToModelfile.pricingrelationship_id == pricingrelationship_id)
+        )
+    }
+
+    resultfile = ResultFile(
+        name=pricingrelationship.name,
+        analysis_id=pricingrelationship.analysis_id,
+        pricingrelationship_id=pricingrelationship_id,
+        summary=dump_statistics(get_results_statistics(results, layertomodelfiles)),
+        fingerprints={str(key): value for key, value in fingerprints.items()} if fingerprints is not None else None,
+    )
+    db.session.add(resultfile)
+    db.session.flush()
+
+    bulk_insert(ResultYearLoss, results | {'resultfile_id': resultfile.id})
+    db.session.commit()
+
+    return resultfile.id
+
+
+def process_pricingrelationship(pricingrelationship_id):
+    """
+    Price a pricing relationship and save its result file.
+    A relationship whose result file is up to date is skipped, only the changed pairs of a stale result file are
+    priced again.
+    Return the id of the result file.
+    """
+    # The fingerprints are read before the inputs: inputs changed in between make the result file stale, not wrong
+    plan = get_pricing_plan([pricingrelationship_id])
+
+    if pricingrelationship_id not in plan:
+        return db.session.execute(
+            select(func.max(ResultFile.id)).filter_by(pricingrelationship_id=pricingrelationship_id)
+        ).scalar()
+
+    resultfile_id, fingerprints, layertomodelfile_ids = plan[pricingrelationship_id]
+    results = price_pricingrelationship(pricingrelationship_id, layertomodelfile_ids)
+
+    return save_resultfile(pricingrelationship_id, results, fingerprints, resultfile_id)
@@ -0,0 +1,182 @@
+"""
+This module defines the simulation of the loss models.
+
+The years are simulated in chunks of CHUNK_SIZE years, each chunk being written to the YLT of the model file
+before the next one is drawn. The YLT is saved as a single value of the model file, read back in memory once: the
+memory of a simulation is bounded by the size of its serialized YLT, at most 8 bytes per year, and the number of
+years by MAX_NBYEARS (40 MB).
+
+The simulations are reproducible: the random numbers are drawn with the counter-based bit generator Philox, seeded with
+the seed saved with the model file. The same seed gives the same YLT bit for bit, whatever the process or the machine.
+A model file can therefore be saved without its YLT, which is then regenerated on demand and kept in an in-process
+cache whose memory is bounded by YLT_CACHE_MAX_BYTES. The digest of such a YLT is computed from its definition.
+
+Functions:
+- new_seed(): Draw a new seed from the entropy of the operating system.
+- get_rng(seed): Get the random generator of a seed.
+- simulate_lognorm(s, scale, nbyears, rng, chunk_size): Draw the loss ratios of a log-normal loss model by chunks.
+- generate_ylt(distribution, parameters, seed, nbyears): Regenerate the loss ratios of a simulated model file.
+- get_definition_digest(distribution, parameters, seed, nbyears): Get the digest of the YLT of a simulated model file
+  saved without its YLT.
+- save_lognorm_modelfile(analysis_id, name, s, scale, nbyears, seed, store_ylt, on_progress): Simulate a log-normal
+  loss model and save it as a model file.
+
+Dependencies:
+- numpy
+
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from flaskapp.extensions import db
+from flaskapp.models import ModelFile
+from flaskapp.engine.ylt import YltWriter
+
+NBYEARS = 10000
+# Bounds the memory of a simulation saved with its YLT to 40 MB (see flaskapp.engine.ylt)
+MAX_NBYEARS = 5000000
+CHUNK_SIZE = 100000
+
+# Memory used by the regenerated YLTs kept in the cache of a process
+YLT_CACHE_MAX_BYTES = 512 * 2 ** 20
+
+
+class YltCache:
+    """
+    LRU cache of the regenerated YLTs, bounded by the total size of the arrays.
+    The arrays are read-only since they are shared by all the callers.
+    """
+
+    def __init__(self, max_bytes=YLT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.ylts = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            ylt = self.ylts.get(key)
+            if ylt is not None:
+                self.ylts.move_to_end(key)
+            return ylt
+
+    def put(self, key, ylt):
+        ylt.setflags(write=False)
+
+        # An array larger than the cache is not kept
+        if ylt.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.ylts:
+                return
+            self.ylts[key] = ylt
+            self.nbytes += ylt.nbytes
+
+            # Evict the least recently used YLTs
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.ylts.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.ylts.clear()
+            self.nbytes = 0
+
+
+ylt_cache = YltCache()
+
+
+def new_seed():
+    # The seeds are stored as signed 64-bit integers (BigInteger)
+    return int(np.random.SeedSequence().generate_state(1, np.uint64)[0] >> np.uint64(1))
+
+
+def get_rng(seed):
+    return np.random.Generator(np.random.Philox(seed))
+
+
+def simulate_lognorm(s, scale, nbyears, rng=None, chunk_size=CHUNK_SIZE):
+    # With the parametrization of scipy.stats.lognorm, log(X) follows a normal distribution N(log(scale), s)
+    # The chunks are drawn one after the other from the same generator: the size of the chunks does not change the YLT
+    rng = rng or np.random.default_rng()
+
+    for start in range(0, nbyears, chunk_size):
+        yield rng.lognormal(mean=np.log(scale), sigma=s, size=min(chunk_size, nbyears - start))
+
+
+DISTRIBUTIONS = {
+    'lognorm': simulate_lognorm,
+}
+
+
+def generate_ylt(distribution, parameters, seed, nbyears):
+    """
+    Regenerate the loss ratios of a simulated model file from its distribution, parameters, seed and number of years.
+    Return a read-only NumPy array, which is cached in the process.
+    """
+    key = (distribution, tuple(sorted(parameters.items())), seed, nbyears)
+    loss_ratios = ylt_cache.get(key)
+
+    if loss_ratios is None:
+        loss_ratios = np.empty(nbyears, dtype=np.float64)
+        start = 0
+        for chunk in DISTRIBUTIONS[distribution](**parameters, nbyears=nbyears, rng=get_rng(seed)):
+            loss_ratios[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        ylt_cache.put(key, loss_ratios)
+
+    return loss_ratios
+
+
+def get_definition_digest(distribution, parameters, seed, nbyears):
+    # The YLT is fully defined by its distribution, parameters, seed and number of years
+    definition = json.dumps([distribution, parameters, seed, nbyears], sort_keys=True)
+    return hashlib.sha256(definition.encode()).hexdigest()
+
+
+def save_lognorm_modelfile(analysis_id, name, s, scale, nbyears=NBYEARS, seed=None, store_ylt=True, on_progress=None):
+    """
+    Simulate nbyears years of a log-normal loss model and save them as the YLT of a new model file.
+
+    The distribution, its parameters and the seed are always saved with the model file. When store_ylt is False,
+    the YLT is not simulated now nor stored: it is regenerated on demand by generate_ylt().
+    on_progress(progress) is called after each chunk with the simulated fraction of the years.
+    Return the id of the model file.
+    """
+    if not 1 <= nbyears <= MAX_NBYEARS:
+        raise ValueError(f'The number of simulated years must be between 1 and {MAX_NBYEARS:,}')
+
+    seed = new_seed() if seed is None else seed
+
+    modelfile = ModelFile(
+        analysis_id=analysis_id,
+        name=name,
+        nbyears=nbyears,
+        distribution='lognorm',
+        parameters={'s': s, 'scale': scale},
+        seed=seed,
+    )
+
+    if store_ylt:
+        # Stream the simulated chunks to the compressed YLT
+        writer = YltWriter()
+        for loss_ratios in simulate_lognorm(s, scale, nbyears, get_rng(seed)):
+            writer.write(loss_ratios)
+            if on_progress:
+                on_progress(writer.nbyears / nbyears)
+
+        # Save the model file and its year losses as a single binary array
+        modelfile.ylt = writer.getvalue()
+        modelfile.ylt_digest = writer.digest
+    else:
+        modelfile.ylt_digest = get_definition_digest(modelfile.distribution, modelfile.parameters, seed, nbyears)
+
+    db.session.add(modelfile)
+    db.session.commit()
+
+    return modelfile.id
@@ -0,0 +1,206 @@
+"""
+This module defines the statistics of the result files (OEP quantiles, pure premiums and standard deviations).
+
+The statistics are computed once, from the result year losses still in memory, when a result file is processed,
+and saved in the summary column of the result file.
+For the legacy result files without summary, the aggregation of the result year losses is done by the database in a
+single grouped query, and the summary is then saved.
+In both cases, the quantiles of all the layers are computed with a single vectorized NumPy call.
+
+Functions:
+- query_result_aggregates(resultfile_id): Get the recoveries by layer and year, and the mean recoveries by layer
+  and model file.
+- get_layer_statistics(layer_ids, years, recoveries): Compute the OEP quantiles, pure premium and standard
+  deviation of each layer.
+- get_results_statistics(results, layertomodelfiles): Compute all the statistics of priced result year losses.
+- query_result_statistics(resultfile_id): Compute all the statistics of a result file from its result year losses.
+- dump_statistics(statistics): Convert statistics to the JSON summary of a result file.
+- load_statistics(summary): Convert the JSON summary of a result file back to statistics.
+- get_result_statistics(resultfile_id): Get all the statistics of a result file.
+
+Dependencies:
+- numpy
+- sqlalchemy
+
+"""
+
+import numpy as np
+from sqlalchemy import select, update, func, literal, union_all, Float, Integer
+from flaskapp.extensions import db
+from flaskapp.models import LayerToModelfile, ResultFile, ResultYearLoss
+
+QUANTILES = [.999, .998, .996, .995, .99, .98, .9667, .96, .95, .9, .8, .5]
+
+
+def query_result_aggregates(resultfile_id):
+    """
+    Run a single query that returns the union of:
+    - the sum of the recoveries by layer and year, with a null model file id
+    - the mean of the recoveries by layer and model file, with a null year
+    """
+    recoveries_by_year = (
+        select(
+            LayerToModelfile.layer_id,
+            literal(None, Integer).label('modelfile_id'),
+            ResultYearLoss.year,
+            func.sum(ResultYearLoss.recovery).cast(Float).label('recovery'),
+        )
+        .join(LayerToModelfile, ResultYearLoss.layertomodelfile_id == LayerToModelfile.id)
+        .where(ResultYearLoss.resultfile_id == resultfile_id)
+        .group_by(LayerToModelfile.layer_id, ResultYearLoss.year)
+    )
+    recoveries_by_modelfile = (
+        select(
+            LayerToModelfile.layer_id,
+            LayerToModelfile.modelfile_id,
+            literal(None, Integer).label('year'),
+            func.avg(ResultYearLoss.recovery).cast(Float).label('recovery'),
+        )
+        .join(LayerToModelfile, ResultYearLoss.layertomodelfile_id == LayerToModelfile.id)
+        .where(ResultYearLoss.resultfile_id == resultfile_id)
+        .group_by(LayerToModelfile.layer_id, LayerToModelfile.modelfile_id)
+    )
+    rows = db.session.execute(union_all(recoveries_by_year, recoveries_by_modelfile)).all()
+
+    by_year = [row for row in rows if row.modelfile_id is None]
+    by_modelfile = [row for row in rows if row.modelfile_id is not None]
+
+    return {
+        'layer_id': np.array([row.layer_id for row in by_year], dtype=np.int64),
+        'year': np.array([row.year for row in by_year], dtype=np.int64),
+        'recovery': np.array([row.recovery for row in by_year], dtype=np.float64),
+        'modelfile_means': {(row.layer_id, row.modelfile_id): row.recovery for row in by_modelfile},
+    }
+
+
+def get_layer_statistics(layer_ids, years, recoveries):
+    """
+    Compute the statistics of the recoveries by year of each layer.
+
+    layer_ids, years and recoveries are aligned arrays with one element per (layer, year).
+    Return a dictionary {layer_id: {'oep': [quantiles], 'pure_premium': mean, 'std': standard deviation}}.
+    """
+    if len(layer_ids) == 0:
+        return {}
+
+    # Pivot the recoveries to a (layers x years) matrix
+    # The layers may not have the same number of years: the missing years are NaN and ignored
+    unique_layer_ids, layer_index = np.unique(layer_ids, return_inverse=True)
+    unique_years, year_index = np.unique(years, return_inverse=True)
+
+    matrix = np.full((len(unique_layer_ids), len(unique_years)), np.nan)
+    matrix[layer_index, year_index] = recoveries
+
+    # Same linear interpolation and degrees of freedom as pandas' quantile and std
+    oep = np.nanquantile(matrix, QUANTILES, axis=1)
+    pure_premiums = np.nanmean(matrix, axis=1)
+    stds = np.nanstd(matrix, axis=1, ddof=1) if len(unique_years) > 1 else np.full(len(unique_layer_ids), np.nan)
+
+    return {
+        int(layer_id): {
+            'oep': oep[:, i].tolist(),
+            'pure_premium': float(pure_premiums[i]),
+            'std': float(stds[i]),
+        }
+        for i, layer_id in enumerate(unique_layer_ids)
+    }
+
+
+def add_modelfile_means(statistics, modelfile_means):
+    for (layer_id, modelfile_id), mean in modelfile_means.items():
+        statistics.setdefault(layer_id, {}).setdefault('modelfiles', {})[modelfile_id] = mean
+
+    return statistics
+
+
+def get_results_statistics(results, layertomodelfiles):
+    """
+    Compute the statistics of the result year losses of a result file before they are saved.
+
+    results is a dictionary of NumPy arrays with the columns layertomodelfile_id, year and recovery.
+    layertomodelfiles is a dictionary {layertomodelfile_id: (layer_id, modelfile_id)}.
+    Return the same statistics as query_result_statistics().
+    """
+    if len(results['layertomodelfile_id']) == 0:
+        return {}
+
+    # Map the layer-to-modelfile pairs of the result year losses to their layer and model file
+    pair_ids = np.array(list(layertomodelfiles), dtype=np.int64)
+    pair_layer_ids = np.array([layer_id for layer_id, _ in layertomodelfiles.values()], dtype=np.int64)
+    pair_modelfile_ids = np.array([modelfile_id for _, modelfile_id in layertomodelfiles.values()], dtype=np.int64)
+
+    order = np.argsort(pair_ids)
+    position = order[np.searchsorted(pair_ids, results['layertomodelfile_id'], sorter=order)]
+    layer_ids = pair_layer_ids[position]
+    modelfile_ids = pair_modelfile_ids[position]
+    recoveries = results['recovery'].astype(np.float64)
+
+    # Sum of the recoveries by layer and year
+    keys, index = np.unique(np.column_stack([layer_ids, results['year']]), axis=0, return_inverse=True)
+    sums = np.bincount(index.ravel(), weights=recoveries, minlength=len(keys))
+    statistics = get_layer_statistics(keys[:, 0], keys[:, 1], sums)
+
+    # Mean of the recoveries by layer and model file
+    keys, index = np.unique(np.column_stack([layer_ids, modelfile_ids]), axis=0, return_inverse=True)
+    means = np.bincount(index.ravel(), weights=recoveries) / np.bincount(index.ravel())
+    modelfile_means = {(int(layer_id), int(modelfile_id)): float(mean) for (layer_id, modelfile_id), mean in
+                       zip(keys, means)}
+
+    return add_modelfile_means(statistics, modelfile_means)
+
+
+def query_result_statistics(resultfile_id):
+    aggregates = query_result_aggregates(resultfile_id)
+    statistics = get_layer_statistics(aggregates['layer_id'], aggregates['year'], aggregates['recovery'])
+
+    return add_modelfile_means(statistics, aggregates['modelfile_means'])
+
+
+def dump_statistics(statistics):
+    # The keys of a JSON object are strings and NaN (e.g. the standard deviation of a single year) is not valid JSON
+    def dump_value(value):
+        return None if isinstance(value, float) and np.isnan(value) else value
+
+    return {
+        str(layer_id): {
+            key: {str(modelfile_id): mean for modelfile_id, mean in value.items()} if key == 'modelfiles'
+            else [dump_value(v) for v in value] if key == 'oep'
+            else dump_value(value)
+            for key, value in layer_statistics.items()
+        }
+        for layer_id, layer_statistics in statistics.items()
+    }
+
+
+def load_statistics(summary):
+    def load_value(value):
+        return np.nan if value is None else value
+
+    return {
+        int(layer_id): {
+            key: {int(modelfile_id): mean for modelfile_id, mean in value.items()} if key == 'modelfiles'
+            else [load_value(v) for v in value] if key == 'oep'
+            else load_value(value)
+            for key, value in layer_statistics.items()
+        }
+        for layer_id, layer_statistics in summary.items()
+    }
+
+
+def get_result_statistics(resultfile_id):
+    """
+    Get the statistics of a result file from its summary.
+    The summary of a legacy result file is computed from its result year losses and saved.
+    Return a dictionary {layer_id: {'oep', 'pure_premium', 'std', 'modelfiles': {modelfile_id: pure premium}}}.
+    """
+    summary = db.session.execute(select(ResultFile.summary).where(ResultFile.id == resultfile_id)).scalar()
+
+    if summary is None:
+        statistics = query_result_statistics(resultfile_id)
+        db.session.execute(
+            update(ResultFile).where(ResultFile.id == resultfile_id).values(summary=dump_statistics(statistics))
+        )
+        db.session.commit()
+        return statistics
+
+    return load_statistics(summary)
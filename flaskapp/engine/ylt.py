@@ -0,0 +1,134 @@
+"""
+This module defines the columnar binary storage of the model files' year loss tables (YLT).
+
+A YLT is stored as a single binary array of loss ratios in the ylt column of its model file,
+the year being implied by the position in the array (the first loss ratio is year 1).
+
+Binary layout:
+- a header of 16 bytes: magic b'SLYT', format version, dtype code, compression code, padding, number of years
+- the loss ratios as float64 or float32, little-endian, optionally compressed with zlib
+
+A YLT is written chunk by chunk by YltWriter to a temporary file, which stays in memory up to SPOOL_MAX_BYTES and
+is spilled to the disk beyond. The database stores a YLT as a single value: the serialized YLT is read back in one
+bytes object to be saved, so the peak memory of a save is the size of the serialized YLT (at most 8 bytes per year,
+i.e. 40 MB for the MAX_NBYEARS of flaskapp.engine.simulation) on top of a chunk, whatever the number of chunks.
+
+The digest of a YLT is the SHA-256 of its loss ratios as float64, saved in the ylt_digest column of its model file:
+two model files with the same digest give the same results (see flaskapp.engine.cache).
+
+Functions:
+- get_ylt_digest(loss_ratios): Get the digest of the loss ratios of a YLT.
+- pack_ylt(loss_ratios, dtype, compress): Serialize an array of loss ratios.
+- unpack_ylt(blob): Deserialize a YLT and return a read-only NumPy array.
+- write_modelfile_ylt(modelfile, loss_ratios, dtype): Store the YLT of a model file.
+- read_modelfile_ylt(modelfile): Read the YLT of a model file.
+
+Dependencies:
+- numpy
+
+"""
+
+import hashlib
+import struct
+import tempfile
+import zlib
+import numpy as np
+
+MAGIC = b'SLYT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBBxQ')
+
+DTYPES = {0: np.dtype('<f8'), 1: np.dtype('<f4')}
+DTYPE_CODES = {dtype: code for code, dtype in DTYPES.items()}
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+
+# Size of a serialized YLT kept in memory by YltWriter, the larger ones being written to a temporary file
+SPOOL_MAX_BYTES = 8 * 2 ** 20
+
+
+def get_ylt_digest(loss_ratios):
+    return hashlib.sha256(np.ascontiguousarray(loss_ratios, dtype='<f8').tobytes()).hexdigest()
+
+
+class YltWriter:
+    """
+    Incremental YLT serializer: the loss ratios are written and compressed chunk by chunk to a temporary file,
+    so that a large simulation is held in memory in full only once, by getvalue().
+    The digest of the YLT is computed along the way.
+    """
+
+    def __init__(self, dtype='float64', compress=True):
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        if self.dtype not in DTYPE_CODES:
+            raise ValueError('The YLT loss ratios must be stored as float64 or float32')
+        self.compression = COMPRESSION_ZLIB if compress else COMPRESSION_NONE
+        self.compressor = zlib.compressobj(level=1) if compress else None
+        # The header is written last, when the number of years is known
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.file.seek(HEADER.size)
+        self.nbyears = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, loss_ratios):
+        loss_ratios = np.ascontiguousarray(loss_ratios, dtype=self.dtype)
+        data = loss_ratios.tobytes()
+        self.file.write(self.compressor.compress(data) if self.compressor else data)
+        self.hash.update(data if self.dtype == np.dtype('<f8') else loss_ratios.astype('<f8').tobytes())
+        self.nbyears += len(loss_ratios)
+
+    @property
+    def digest(self):
+        return self.hash.hexdigest()
+
+    def getvalue(self):
+        """
+        Return the serialized YLT as bytes, the writer being closed.
+        """
+        if self.compressor:
+            self.file.write(self.compressor.flush())
+            self.compressor = None
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[self.dtype], self.compression, self.nbyears))
+        self.file.seek(0)
+        try:
+            return self.file.read()
+        finally:
+            self.file.close()
+
+
+def pack_ylt(loss_ratios, dtype='float64', compress=True):
+    writer = YltWriter(dtype, compress)
+    writer.write(loss_ratios)
+    return writer.getvalue()
+
+
+def unpack_ylt(blob):
+    magic, version, dtype_code, compression, nbyears = HEADER.unpack_from(blob)
+
+    if magic != MAGIC:
+        raise ValueError('The binary data is not a year loss table')
+    if version > FORMAT_VERSION:
+        raise ValueError(f'The YLT format version {version} is not supported')
+
+    payload = memoryview(blob)[HEADER.size:]
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+
+    # np.frombuffer does not copy the data: the array is a read-only view of the payload
+    return np.frombuffer(payload, dtype=DTYPES[dtype_code], count=nbyears)
+
+
+def write_modelfile_ylt(modelfile, loss_ratios, dtype='float64'):
+    writer = YltWriter(dtype)
+    writer.write(loss_ratios)
+    modelfile.ylt = writer.getvalue()
+    modelfile.ylt_digest = writer.digest
+    modelfile.nbyears = len(loss_ratios)
+
+
+def read_modelfile_ylt(modelfile):
+    if modelfile.ylt is None:
+        return None
+    return unpack_ylt(modelfile.ylt)
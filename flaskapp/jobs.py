@@ -0,0 +1,303 @@
+"""
+This module defines the job queue used to run the long pricing and simulation work outside the web requests.
+
+The queue is the job table of the shared database, so that the workers of several app nodes can drain it.
+A worker is a separate process started with the command: flask jobs worker
+
+Job life cycle:
+- queued: submitted with submit_job() and waiting for a worker
+- running: claimed by a worker, which reports its progress, and its heartbeat from a thread while the handler runs
+- done: the handler returned, its return value is saved in job.result
+- failed: the handler raised an exception, or its worker died, max_attempts times (the job is queued again after the
+  first failures)
+- cancelled: the cancellation was requested with cancel_job() before the job finished
+
+A claim is identified by the worker and the attempt number: a runner whose job was requeued and claimed again (e.g.
+after a network partition longer than HEARTBEAT_TIMEOUT) can no longer report its progress nor write the final status,
+which belong to the new claim.
+
+Functions:
+- job_handler(kind): Decorator registering the function that runs the jobs of a kind.
+- submit_job(kind, params, name, max_attempts): Queue a job, params being the keyword arguments of the handler.
+- get_jobs(job_ids): Get the status, progress and result of jobs.
+- cancel_job(job_id): Request the cancellation of a job.
+- claim_job(worker): Claim the oldest queued job.
+- run_job(job): Run a claimed job with its handler, return its final status or LOST if it was claimed again.
+- run_worker(worker, poll_interval, once): Claim and run the queued jobs until interrupted.
+
+Dependencies:
+- click
+- sqlalchemy
+
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import select, update
+from flaskapp.extensions import db
+from flaskapp.models import Job
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = [DONE, FAILED, CANCELLED]
+
+# A running job without heartbeat for this long is considered abandoned by a dead worker and is queued again
+HEARTBEAT_TIMEOUT = timedelta(minutes=10)
+
+# Seconds between two heartbeats of a running job, well below HEARTBEAT_TIMEOUT
+HEARTBEAT_INTERVAL = 60
+
+# Returned by run_job() when the job was claimed again by another runner, it is not a status of the job table
+LOST = 'lost'
+
+HANDLERS = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLost(Exception):
+    pass
+
+
+class JobContext:
+    """
+    Passed to the job handlers as their first argument to report their progress.
+
+    The progress and the heartbeat are written with their own connections, so that they are visible while the job is
+    running. The heartbeat is written every HEARTBEAT_INTERVAL seconds by a daemon thread, whatever the handler does.
+    report_progress() raises JobCancelled if the cancellation of the job was requested, and JobLost if the job was
+    claimed again by another runner: the handlers should call it between their units of work, after committing them.
+    """
+
+    def __init__(self, job_id, worker, attempts):
+        self.job_id = job_id
+        self.worker = worker
+        self.attempts = attempts
+        # The engine is taken in the app context of the runner, the heartbeat thread has none
+        self.engine = db.engine
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get_claim_condition(self):
+        # The job is still running under the claim of this runner
+        return [Job.id == self.job_id, Job.worker == self.worker, Job.attempts == self.attempts, Job.status == RUNNING]
+
+    def beat(self, **values):
+        """
+        Write the heartbeat of the claim with values, e.g. the progress.
+        Return True if the cancellation of the job was requested.
+        """
+        with self.engine.begin() as connection:
+            updated = connection.execute(
+                update(Job).where(*self.get_claim_condition()).values(heartbeat_at=datetime.utcnow(), **values)
+            ).rowcount
+            cancel_requested = connection.execute(
+                select(Job.cancel_requested).where(Job.id == self.job_id)
+            ).scalar()
+
+        if not updated:
+            self.lost = True
+        return cancel_requested
+
+    def report_progress(self, progress, message=None):
+        cancel_requested = self.beat(progress=progress, message=message)
+
+        if self.lost:
+            raise JobLost(f'The job {self.job_id} has been claimed again after the attempt {self.attempts}')
+        if cancel_requested:
+            raise JobCancelled(f'The job {self.job_id} has been cancelled')
+
+    def run_heartbeat(self):
+        while not self.stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                self.beat()
+            except Exception:
+                # A failed heartbeat is retried at the next interval, the job is requeued only after HEARTBEAT_TIMEOUT
+                logger.exception(f'The heartbeat of the job {self.job_id} failed')
+            if self.lost:
+                return
+
+    def start_heartbeat(self):
+        self.thread = threading.Thread(target=self.run_heartbeat, name=f'job-{self.job_id}-heartbeat', daemon=True)
+        self.thread.start()
+
+    def stop_heartbeat(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+def job_handler(kind):
+    def decorator(function):
+        HANDLERS[kind] = function
+        return function
+
+    return decorator
+
+
+def submit_job(kind, params, name=None, max_attempts=3):
+    job = Job(kind=kind, name=name, params=params, max_attempts=max_attempts, status=QUEUED)
+    db.session.add(job)
+    db.session.commit()
+
+    return job.id
+
+
+def get_jobs(job_ids):
+    rows = db.session.execute(
+        select(Job.id, Job.name, Job.status, Job.progress, Job.message, Job.result, Job.error)
+        .where(Job.id.in_(job_ids))
+        .order_by(Job.id)
+    ).all()
+
+    return [row._asdict() for row in rows]
+
+
+def cancel_job(job_id):
+    # A queued job is cancelled at once, a running job is cancelled by its handler at its next progress report
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == QUEUED)
+        .values(status=CANCELLED, finished_at=datetime.utcnow())
+    )
+    db.session.execute(update(Job).where(Job.id == job_id).values(cancel_requested=True))
+    db.session.commit()
+
+
+def requeue_abandoned_jobs():
+    # A job whose worker died at each of its max_attempts attempts, e.g. out of memory, fails instead of killing the
+    # next worker, like a job whose handler raised
+    now = datetime.utcnow()
+    abandoned = [Job.status == RUNNING, Job.heartbeat_at < now - HEARTBEAT_TIMEOUT]
+    db.session.execute(
+        update(Job)
+        .where(*abandoned, (Job.attempts >= Job.max_attempts) | Job.cancel_requested)
+        .values(status=FAILED, worker=None, finished_at=now,
+                error='The worker stopped sending the heartbeat of the job at its last attempt')
+    )
+    db.session.execute(update(Job).where(*abandoned).values(status=QUEUED, worker=None))
+    db.session.commit()
+
+
+def claim_job(worker):
+    # On PostgreSQL, SKIP LOCKED lets several workers look for a job at the same time
+    # The conditional update makes sure that a job is claimed only once, including on SQLite
+    job_id = db.session.execute(
+        select(Job.id)
+        .where(Job.status == QUEUED)
+        .order_by(Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalar()
+
+    if job_id is None:
+        db.session.rollback()
+        return None
+
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == QUEUED)
+        .values(status=RUNNING, attempts=Job.attempts + 1, worker=worker, progress=0, started_at=now,
+                heartbeat_at=now)
+    ).rowcount
+    db.session.commit()
+
+    return db.session.get(Job, job_id) if claimed else None
+
+
+def run_job(job):
+    handler = HANDLERS[job.kind]
+    job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+    context = JobContext(job_id, job.worker, attempts)
+
+    context.start_heartbeat()
+    try:
+        result = handler(context, **job.params)
+        status, values = DONE, {'result': result, 'progress': 1, 'error': None}
+
+    except JobCancelled:
+        db.session.rollback()
+        status, values = CANCELLED, {}
+
+    except JobLost:
+        db.session.rollback()
+        status, values = LOST, {}
+
+    except Exception:
+        db.session.rollback()
+        cancel_requested = db.session.execute(select(Job.cancel_requested).where(Job.id == job_id)).scalar()
+        status = QUEUED if attempts < max_attempts and not cancel_requested else FAILED
+        values = {'error': traceback.format_exc()}
+        logger.exception(f'The job {job_id} failed at attempt {attempts}')
+
+    finally:
+        context.stop_heartbeat()
+
+    if status != LOST:
+        if status != QUEUED:
+            values['finished_at'] = datetime.utcnow()
+
+        # The status is written only if the job was not claimed again in the meantime
+        updated = db.session.execute(
+            update(Job).where(*context.get_claim_condition()).values(status=status, **values)
+        ).rowcount
+        db.session.commit()
+        if not updated:
+            status = LOST
+
+    if status == LOST:
+        logger.warning(f'The job {job_id} was claimed again after the attempt {attempts}, its result is dropped')
+
+    return status
+
+
+def run_worker(worker=None, poll_interval=2, once=False):
+    worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+    logger.info(f'Worker {worker} started')
+
+    # Register the job handlers
+    from flaskapp import tasks
+
+    while True:
+        requeue_abandoned_jobs()
+        job = claim_job(worker)
+
+        if job:
+            logger.info(f'Worker {worker} runs the job {job.id} {job.kind}')
+            status = run_job(job)
+            logger.info(f'Worker {worker} finished the job {job.id} with the status {status}')
+            # Release the session (and its identity map) between the jobs
+            db.session.remove()
+        elif once:
+            return
+        else:
+            time.sleep(poll_interval)
+
+
+jobs_cli = AppGroup('jobs', help='Manage the background jobs.')
+
+
+@jobs_cli.command('worker')
+@click.option('--poll-interval', default=2.0, help='Seconds to wait when the queue is empty.')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty.')
+def worker_command(poll_interval, once):
+    """Claim and run the queued jobs."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    run_worker(poll_interval=poll_interval, once=once)
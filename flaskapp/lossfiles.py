@@ -0,0 +1,231 @@
+"""
+This module defines the ingestion of the historic loss files from CSV, TSV and XLSX files.
+
+A loss file has the columns year, premium, loss and loss_ratio, the loss ratio being computed from the loss and the
+premium when it is missing. In an XLSX file, the table can be anywhere in the first sheet that has a year header,
+e.g. in the Losses sheet of the sly excel helper.xlsx workbook.
+
+The amounts (year, premium and loss) may have thousands separators, e.g. 1,234,567, 1.234.567,50 or 1'234, a
+separator followed by groups of 3 digits being read as a thousands separator, and the other commas as decimal commas.
+
+The files are parsed and validated with vectorized pandas operations, pandas being imported by the first file read
+rather than with the pages that import this module. The validation errors are reported with the row of the file where
+they occur, and the losses of all the files are saved with a bulk insert in a single transaction.
+
+Functions:
+- decode_upload(contents): Decode the contents of a dcc.Upload component.
+- read_lossfile(filename, content): Read the table of losses of a CSV, TSV or XLSX file.
+- validate_losses(df): Convert the losses to numbers and get the errors by row.
+- parse_lossfile(filename, content): Read and validate a loss file.
+- save_lossfiles(analysis_id, vintage, lossfiles): Save loss files and their losses in a single transaction.
+
+Dependencies:
+- numpy
+- openpyxl
+- pandas
+
+"""
+
+import base64
+import io
+import os
+import re
+
+import numpy as np
+from flaskapp.extensions import db
+from flaskapp.models import HistoLossFile, HistoLoss
+from flaskapp.engine.bulk import bulk_insert
+
+LOSS_COLUMNS = ['year', 'premium', 'loss', 'loss_ratio']
+REQUIRED_COLUMNS = ['year', 'premium', 'loss']
+# Columns saved as integers, which may have thousands separators
+INTEGER_COLUMNS = ['year', 'premium', 'loss']
+
+# A number with thousands separators: groups of 3 digits separated by commas, dots or apostrophes, followed by decimals
+# after another separator, e.g. 1,234,567.5 or 1.234.567,5
+THOUSANDS = re.compile(
+    r"^(?P<sign>[+-]?)(?P<integer>\d{1,3}(?P<separator>[,.'])\d{3}(?:(?P=separator)\d{3})*)"
+    r"(?:(?P<point>[.,])(?P<decimals>\d+))?$"
+)
+
+
+class LossFileError(ValueError):
+    pass
+
+
+def decode_upload(contents):
+    # The contents of a dcc.Upload are a data URL, e.g. 'data:text/csv;base64,eWVhci...'
+    _, data = contents.split(',', 1)
+    return base64.b64decode(data)
+
+
+def find_table(df):
+    # Find the header row of the table of losses in a sheet read without header, and the columns of the table
+    cells = df.apply(lambda col: col.astype(str).str.strip().str.lower())
+    header_rows, header_cols = np.nonzero((cells == 'year').to_numpy())
+
+    if len(header_rows) == 0:
+        return None
+
+    header_row = header_rows[0]
+    header = cells.iloc[header_row]
+    columns = {col: header.index[header == col][0] for col in LOSS_COLUMNS if (header == col).any()}
+
+    table = df.loc[header_row + 1:, list(columns.values())]
+    table.columns = list(columns)
+
+    # The table ends at the first row without year, e.g. the notes below the table
+    empty = table['year'].isna().to_numpy()
+    end = np.argmax(empty) if empty.any() else len(table)
+    table = table.iloc[:end]
+
+    # Report the rows of the spreadsheet (1-based)
+    table.index = table.index + 1
+
+    return table
+
+
+def read_lossfile(filename, content):
+    """
+    Read the table of losses of a file.
+    Return a DataFrame of strings or numbers with the columns found among LOSS_COLUMNS, indexed by the row of the file.
+    """
+    import pandas as pd
+
+    extension = os.path.splitext(filename)[1].lower()
+
+    if extension in ('.xlsx', '.xlsm'):
+        sheets = pd.read_excel(io.BytesIO(content), sheet_name=None, header=None, engine='openpyxl')
+        for df in sheets.values():
+            table = find_table(df)
+            if table is not None:
+                return table
+        raise LossFileError(f'{filename}: no sheet has a year column')
+
+    if extension in ('.csv', '.tsv', '.txt'):
+        # The text files pasted from Excel are tab-separated with a decimal comma
+        sep = ',' if extension == '.csv' else '\t'
+        df = pd.read_csv(io.BytesIO(content), sep=sep, dtype=str, skip_blank_lines=True)
+        df.columns = df.columns.str.strip().str.lower()
+        # The decimal commas of the amounts are read with their thousands separators by validate_losses()
+        if sep == '\t' and 'loss_ratio' in df.columns:
+            df['loss_ratio'] = df['loss_ratio'].str.replace(',', '.', regex=False)
+        # Report the lines of the file (1-based, the first line being the header)
+        df.index = df.index + 2
+        return df[[col for col in LOSS_COLUMNS if col in df.columns]]
+
+    raise LossFileError(f'{filename}: the file type {extension} is not supported (CSV, TSV or XLSX)')
+
+
+def normalize_integers(values):
+    """
+    Remove the thousands separators and the spaces of a Series of strings, and replace their decimal commas by points,
+    e.g. '1,234' -> '1234', '1.234,5' -> '1234.5', '1234,5' -> '1234.5'. Other strings, e.g. '1,23,456', are left
+    to fail the conversion to numbers.
+    """
+    values = values.str.replace(r'\s', '', regex=True)
+    parts = values.str.extract(THOUSANDS)
+    grouped = parts['integer'].notna() & (parts['point'].isna() | (parts['point'] != parts['separator']))
+
+    ungrouped = parts['sign'] + parts['integer'].str.replace(r"[,.']", '', regex=True)
+    ungrouped = ungrouped + ('.' + parts['decimals']).fillna('')
+
+    return ungrouped.where(grouped, values.str.replace(',', '.', regex=False))
+
+
+def validate_losses(df):
+    """
+    Convert the columns of the losses to numbers and check them.
+    Return a tuple (losses, errors): losses is a DataFrame with the columns of LOSS_COLUMNS, errors is a list of
+    dictionaries {'row', 'error'}.
+    """
+    import pandas as pd
+
+    missing = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing:
+        raise LossFileError(f'the columns {", ".join(missing)} are missing')
+
+    losses = pd.DataFrame(index=df.index)
+    problems = []
+
+    for col in LOSS_COLUMNS:
+        if col not in df.columns:
+            losses[col] = np.nan
+            continue
+
+        if df[col].dtype != object:
+            values = df[col]
+        elif col in INTEGER_COLUMNS:
+            # Only the strings are normalized, the numbers of the cells of a spreadsheet are kept as they are
+            text = df[col].map(lambda value: isinstance(value, str))
+            values = df[col].copy()
+            values[text] = normalize_integers(df[col][text].astype(str))
+        else:
+            # Remove the spaces used as thousands separators
+            values = df[col].astype(str).str.replace(r'\s', '', regex=True)
+        losses[col] = pd.to_numeric(values, errors='coerce')
+        blank = df[col].isna() | (df[col].astype(str).str.strip() == '')
+        problems.append(pd.Series(np.where(~blank & losses[col].isna(), f'{col} is not a number', ''), df.index))
+        problems.append(pd.Series(np.where(blank & (col in REQUIRED_COLUMNS), f'{col} is missing', ''), df.index))
+
+    year = losses['year']
+    problems.append(pd.Series(np.where(year.notna() & (year != year.round()), 'year is not an integer', ''), df.index))
+    problems.append(pd.Series(np.where(year.duplicated(keep=False) & year.notna(), 'year is duplicated', ''), df.index))
+    problems.append(pd.Series(np.where(losses['premium'] <= 0, 'premium must be positive', ''), df.index))
+    problems.append(pd.Series(np.where(losses['loss'] < 0, 'loss must not be negative', ''), df.index))
+
+    # The loss ratio is computed when it is not given
+    losses['loss_ratio'] = losses['loss_ratio'].fillna(losses['loss'] / losses['premium'])
+
+    messages = pd.concat(problems, axis=1).apply(lambda row: ', '.join(message for message in row if message), axis=1)
+    errors = [{'row': int(row), 'error': message} for row, message in messages[messages != ''].items()]
+
+    return losses, errors
+
+
+def parse_lossfile(filename, content):
+    """
+    Read and validate a loss file.
+    Return a tuple (losses, errors), errors being a list of messages with the file name and the row.
+    """
+    try:
+        losses, errors = validate_losses(read_lossfile(filename, content))
+    except LossFileError as error:
+        return None, [str(error) if str(error).startswith(filename) else f'{filename}: {error}']
+    except Exception as error:
+        return None, [f'{filename}: the file could not be read ({error})']
+
+    if losses.empty:
+        errors.append({'row': None, 'error': 'the file has no losses'})
+
+    return losses, [
+        f'{filename}, row {error["row"]}: {error["error"]}' if error['row'] else f'{filename}: {error["error"]}'
+        for error in errors
+    ]
+
+
+def save_lossfiles(analysis_id, vintage, lossfiles):
+    """
+    Save loss files and their losses in a single transaction.
+    lossfiles is a list of tuples (name, losses), losses being a DataFrame validated by validate_losses().
+    Return the ids of the loss files.
+    """
+    lossfile_ids = []
+
+    for name, losses in lossfiles:
+        lossfile = HistoLossFile(analysis_id=analysis_id, vintage=vintage, name=name)
+        db.session.add(lossfile)
+        db.session.flush()
+
+        bulk_insert(HistoLoss, {
+            'lossfile_id': lossfile.id,
+            'year': losses['year'].to_numpy(np.int64),
+            'premium': losses['premium'].round().to_numpy(np.int64),
+            'loss': losses['loss'].round().to_numpy(np.int64),
+            'loss_ratio': losses['loss_ratio'].to_numpy(np.float64),
+        })
+        lossfile_ids.append(lossfile.id)
+
+    db.session.commit()
+
+    return lossfile_ids
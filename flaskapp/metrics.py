@@ -0,0 +1,325 @@
+"""
+This module defines the latency metrics of the Dash callbacks and page layouts, exposed in the Prometheus text format.
+
+Every Dash callback and every page layout is wrapped by instrument(), which records under its id, e.g.
+'results.manage.process_result' or 'results.view.layout':
+- dash_callback_duration_seconds: the latency histogram, the serialization of the response included for a callback
+- dash_callback_errors_total: the number of calls that raised an exception, PreventUpdate excepted
+- dash_callback_db_duration_seconds: the time spent in the database by the call
+- dash_callback_response_bytes: the size of the JSON response of a callback
+- dash_callback_span_duration_seconds: the time of the sub-steps of a call delimited with span(), e.g. 'query',
+  the names of the nested spans being joined with '/', e.g. 'compute/query'
+A page layout is called by the routing callback of Dash pages, whose metrics include those of the layout.
+
+The metrics are kept in the memory of each process. When the METRICS_DIR setting is set, each process also writes its
+metrics to a file of this directory every METRICS_DUMP_INTERVAL seconds, and the metrics endpoint sums the files of
+all the processes, e.g. of the workers of a server. The files of the stopped processes are kept so that the counters
+never decrease; the directory is emptied when the server is deployed.
+
+Functions:
+- instrument(callback_id, function): Wrap a function to record its metrics under callback_id.
+- span(name): Context manager recording the duration of a sub-step of the current callback.
+- init_app(flask_app, dashapp): Instrument the callbacks and the page layouts of a Dash app.
+- render_metrics(): Get the metrics of all the processes in the Prometheus text format.
+- reset_metrics(): Clear the metrics of the current process.
+
+Dependencies:
+- dash
+- sqlalchemy
+
+"""
+
+import copy
+import functools
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import dash
+from dash.exceptions import PreventUpdate
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the buckets of the latency histograms in seconds, and of the response size histogram in bytes
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+SIZE_BUCKETS = [1000, 10000, 100000, 1000000, 10000000]
+
+# Interval between two writes of the metrics of a process to METRICS_DIR
+METRICS_DUMP_INTERVAL = 5
+
+# Prefix of the modules of the pages removed from the callback ids
+PAGES_MODULE = 'flaskapp.dashapp.pages.'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, value=1):
+        with lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def merge(self, values):
+        for labels, value in values.items():
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def get_samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # For each labels: the counts of the buckets (not cumulative, the last one being +Inf) and the sum
+        self.values = {}
+
+    def observe(self, value, *labels):
+        with lock:
+            counts, total = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            position = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[position] += 1
+            self.values[labels] = counts, total + value
+
+    def merge(self, values):
+        for labels, (counts, total) in values.items():
+            current_counts, current_total = self.values.get(labels) or ([0] * len(counts), 0)
+            self.values[labels] = [a + b for a, b in zip(current_counts, counts)], current_total + total
+
+    def get_samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                yield f'{self.name}_bucket', labels | {'le': str(bound)}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+lock = threading.Lock()
+
+CALLBACK_DURATION = Histogram(
+    'dash_callback_duration_seconds', 'Duration of the Dash callbacks and page layouts.', ['callback']
+)
+CALLBACK_ERRORS = Counter(
+    'dash_callback_errors_total', 'Number of the Dash callbacks and page layouts that raised an exception.',
+    ['callback']
+)
+CALLBACK_DB_DURATION = Histogram(
+    'dash_callback_db_duration_seconds', 'Time spent in the database by the Dash callbacks and page layouts.',
+    ['callback']
+)
+CALLBACK_RESPONSE_SIZE = Histogram(
+    'dash_callback_response_bytes', 'Size of the responses of the Dash callbacks.', ['callback'], SIZE_BUCKETS
+)
+SPAN_DURATION = Histogram(
+    'dash_callback_span_duration_seconds', 'Duration of the sub-steps of the Dash callbacks and page layouts.',
+    ['callback', 'span']
+)
+METRICS = [CALLBACK_DURATION, CALLBACK_ERRORS, CALLBACK_DB_DURATION, CALLBACK_RESPONSE_SIZE, SPAN_DURATION]
+
+# Scopes of the callbacks and spans running in the current context, the innermost last
+scopes = ContextVar('metrics_scopes', default=())
+
+# Directory where the processes write their metrics, None to keep them in memory only
+metrics_dir = None
+last_dump = 0
+
+
+class Scope:
+    def __init__(self, callback_id, span_name=None):
+        self.callback_id = callback_id
+        self.span_name = span_name
+        self.db_duration = 0
+
+
+@contextmanager
+def enter_scope(scope):
+    token = scopes.set(scopes.get() + (scope,))
+    try:
+        yield scope
+    finally:
+        scopes.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if scopes.get():
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_start', None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    # The time of a statement counts for the callback and for all the enclosing spans
+    for scope in scopes.get():
+        scope.db_duration += duration
+
+
+def get_callback_id(function):
+    module = function.__module__ or ''
+    if module.startswith(PAGES_MODULE):
+        module = module[len(PAGES_MODULE):]
+    return f'{module}.{function.__name__}'
+
+
+def instrument(callback_id, function):
+    """
+    Wrap function to record its duration, its errors, its time in the database and the size of its response
+    (when it returns a string, such as the callbacks of a Dash app) under callback_id.
+    """
+    @functools.wraps(function)
+    def instrumented(*args, **kwargs):
+        start = time.perf_counter()
+        with enter_scope(Scope(callback_id)) as scope:
+            try:
+                result = function(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                CALLBACK_ERRORS.inc(callback_id)
+                raise
+            finally:
+                CALLBACK_DURATION.observe(time.perf_counter() - start, callback_id)
+                CALLBACK_DB_DURATION.observe(scope.db_duration, callback_id)
+                dump_metrics()
+
+        if isinstance(result, (str, bytes)):
+            CALLBACK_RESPONSE_SIZE.observe(len(result), callback_id)
+        return result
+
+    instrumented.instrumented = True
+    return instrumented
+
+
+@contextmanager
+def span(name):
+    """
+    Record the duration of a sub-step of the current callback or layout, e.g. with span('query'): ...
+    Outside of a callback, nothing is recorded.
+    """
+    parents = scopes.get()
+    if not parents:
+        yield
+        return
+
+    parent = parents[-1]
+    span_name = f'{parent.span_name}/{name}' if parent.span_name else name
+    start = time.perf_counter()
+    try:
+        with enter_scope(Scope(parent.callback_id, span_name)):
+            yield
+    finally:
+        SPAN_DURATION.observe(time.perf_counter() - start, parent.callback_id, span_name)
+
+
+def instrument_callbacks(dashapp):
+    # The callbacks are copied to the callback map of the app by Dash before the first request
+    for callback in dashapp.callback_map.values():
+        function = callback.get('callback')
+        if function is not None and not getattr(function, 'instrumented', False):
+            callback['callback'] = instrument(get_callback_id(function), function)
+
+
+def init_app(flask_app, dashapp):
+    """
+    Instrument the page layouts of dashapp now and its callbacks before each request, since the callbacks of the
+    pages and the routing callback of Dash are only registered by the first request.
+    """
+    global metrics_dir
+    metrics_dir = flask_app.config.get('METRICS_DIR')
+
+    for page in dash.page_registry.values():
+        layout = page.get('layout')
+        if callable(layout) and not getattr(layout, 'instrumented', False):
+            page['layout'] = instrument(get_callback_id(layout), layout)
+
+    flask_app.before_request(lambda: instrument_callbacks(dashapp))
+
+
+def get_snapshot():
+    # Serialized under the lock, since the counts of the histograms are updated in place
+    with lock:
+        return json.dumps({
+            metric.name: [[list(labels), value] for labels, value in metric.values.items()] for metric in METRICS
+        })
+
+
+def dump_metrics(force=False):
+    # Write the metrics of the process to its file of metrics_dir, at most every METRICS_DUMP_INTERVAL seconds
+    global last_dump
+    if metrics_dir is None or (not force and time.monotonic() - last_dump < METRICS_DUMP_INTERVAL):
+        return
+    last_dump = time.monotonic()
+
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        # Write to a temporary file renamed at the end, so that the endpoint never reads a partial file
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=metrics_dir)
+        with os.fdopen(fd, 'w') as file:
+            file.write(get_snapshot())
+        os.replace(tmp_path, os.path.join(metrics_dir, f'metrics-{os.getpid()}.json'))
+    except OSError:
+        # The metrics of the process are written again at the next call
+        pass
+
+
+def get_metrics():
+    # Sum the metrics of all the processes, or return the metrics of the current process
+    if metrics_dir is None:
+        return METRICS
+
+    dump_metrics(force=True)
+    merged = [copy.copy(metric) for metric in METRICS]
+    for total in merged:
+        total.values = {}
+
+    for path in glob.glob(os.path.join(metrics_dir, 'metrics-*.json')):
+        try:
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for total in merged:
+            total.merge({tuple(labels): value for labels, value in snapshot.get(total.name, [])})
+
+    return merged
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_metrics():
+    lines = []
+    for metric in get_metrics():
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {"counter" if isinstance(metric, Counter) else "histogram"}')
+        for name, labels, value in metric.get_samples():
+            labels = ','.join(f'{key}="{escape(label)}"' for key, label in labels.items())
+            lines.append(f'{name}{{{labels}}} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    # Used by a forked process, which must not report the metrics of its parent as its own
+    global last_dump
+    with lock:
+        for metric in METRICS:
+            metric.values = {}
+    last_dump = 0
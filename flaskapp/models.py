@@ -17,10 +17,11 @@ The models include:
 - RiskProfileFile: Represents risk profile data files (not used for SL pricing).
 - RiskProfile: Represents individual risk profiles (not used for SL pricing).
 - ModelFile: Represents a loss model associated with an analysis.
-- ModelYearLoss: Represents individual year loss records.
+- ModelYearLoss: Represents individual year loss records (legacy storage of the model files' year loss tables).
 - ResultFile: Represents analysis results.
 - PricingRelationship: Represents pricing relationships between layers and model files in results.
 - ResultYearLoss: Represents individual year loss records in analysis results.
+- Job: Represents a background job of the job queue (see flaskapp.jobs).
 
 These models are designed to work with SQLAlchemy and are used to interact with the underlying database.
 
@@ -58,8 +59,10 @@ Resources:
 """
 
 from flaskapp.extensions import db
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import validates, relationship, backref
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, LargeBinary, Index, Boolean, Text, JSON, \
+    BigInteger
+from sqlalchemy.orm import validates, relationship, backref, deferred
+from datetime import datetime
 
 
 class Analysis(db.Model):
@@ -92,13 +95,19 @@ class Analysis(db.Model):
         return value
 
     # Define the 1-to-many relationship between Analysis and Layer, HistoLossFile, PremiumFile, RiskProfileFile, ModelFile, PricingRelationship, ResultFile
-    layers = relationship('Layer', back_populates='analysis', cascade='all, delete-orphan')
-    histolossfiles = relationship('HistoLossFile', back_populates='analysis', cascade='all, delete-orphan')
-    premiumfiles = relationship('PremiumFile', back_populates='analysis', cascade='all, delete-orphan')
-    riskprofilefiles = relationship('RiskProfileFile', back_populates='analysis', cascade='all, delete-orphan')
-    modelfiles = relationship('ModelFile', back_populates='analysis', cascade='all, delete-orphan')
-    pricingrelationships = relationship('PricingRelationship', back_populates='analysis', cascade='all, delete-orphan')
-    resultfiles = relationship('ResultFile', back_populates='analysis', cascade='all, delete-orphan')
+    layers = relationship('Layer', back_populates='analysis', cascade='all, delete-orphan', passive_deletes=True)
+    histolossfiles = relationship('HistoLossFile', back_populates='analysis',
+                                  cascade='all, delete-orphan', passive_deletes=True)
+    premiumfiles = relationship('PremiumFile', back_populates='analysis',
+                                cascade='all, delete-orphan', passive_deletes=True)
+    riskprofilefiles = relationship('RiskProfileFile', back_populates='analysis',
+                                    cascade='all, delete-orphan', passive_deletes=True)
+    modelfiles = relationship('ModelFile', back_populates='analysis',
+                              cascade='all, delete-orphan', passive_deletes=True)
+    pricingrelationships = relationship('PricingRelationship', back_populates='analysis',
+                                        cascade='all, delete-orphan', passive_deletes=True)
+    resultfiles = relationship('ResultFile', back_populates='analysis',
+                               cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -131,7 +140,7 @@ class Layer(db.Model):
         return value
 
     # Define the 1-to-many relationship between Analysis and Layer
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'), index=True)
     analysis = relationship('Analysis', back_populates='layers')
 
     def __repr__(self):
@@ -147,11 +156,11 @@ class HistoLossFile(db.Model):
     vintage = Column(Integer)
 
     # Define the 1-to-many relationship between Analysis and HistoLossFile
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'), index=True)
     analysis = relationship('Analysis', back_populates='histolossfiles')
 
     # Define the 1-to-many relationship between HistoLossFile and HistoLoss
-    losses = relationship('HistoLoss', back_populates='lossfile', cascade='all, delete')
+    losses = relationship('HistoLoss', back_populates='lossfile', cascade='all, delete', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -169,7 +178,7 @@ class HistoLoss(db.Model):
     loss_ratio = Column(Float)
 
     # Define the 1-to-many relationship between HistoLossFile and HistoLoss
-    lossfile_id = Column(Integer, ForeignKey(HistoLossFile.id))
+    lossfile_id = Column(Integer, ForeignKey(HistoLossFile.id, ondelete='CASCADE'), index=True)
     lossfile = relationship('HistoLossFile', back_populates='losses')
 
     def __repr__(self):
@@ -182,11 +191,11 @@ class PremiumFile(db.Model):  # This model is not necessary for SL pricing
     name = Column(String(50))
 
     # Define the 1-to-many relationship between Analysis and PremiumFile
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'), index=True)
     analysis = relationship('Analysis', back_populates='premiumfiles')
 
     # Define the 1-to-many relationship between PremiumFile and Premium
-    premiums = relationship('Premium', back_populates='premiumfile', cascade='all, delete-orphan')
+    premiums = relationship('Premium', back_populates='premiumfile', cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -202,7 +211,7 @@ class Premium(db.Model):  # This model is not necessary for SL pricing
     amount = Column(Integer)
 
     # Define the 1-to-many relationship between PremiumFile and Premium
-    premiumfile_id = Column(Integer, ForeignKey(PremiumFile.id))
+    premiumfile_id = Column(Integer, ForeignKey(PremiumFile.id, ondelete='CASCADE'), index=True)
     premiumfile = relationship('PremiumFile', back_populates='premiums')
 
     def __repr__(self):
@@ -215,11 +224,12 @@ class RiskProfileFile(db.Model):  # This model is not necessary for SL pricing
     name = Column(String(50))
 
     # Define the 1-to-many relationship between Analysis and RiskProfile
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'), index=True)
     analysis = relationship('Analysis', back_populates='riskprofilefiles')
 
     # Define the 1-to-many relationship between RiskProfileFile and RiskProfile
-    riskprofiles = relationship('RiskProfile', back_populates='riskprofilefile', cascade='all, delete-orphan')
+    riskprofiles = relationship('RiskProfile', back_populates='riskprofilefile',
+                                cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -231,7 +241,7 @@ class RiskProfile(db.Model):  # This model is not necessary for SL pricing
     name = Column(String(50))
 
     # Define the 1-to-many relationship between RiskProfileFile and RiskProfile
-    riskprofilefile_id = Column(Integer, ForeignKey(RiskProfileFile.id))
+    riskprofilefile_id = Column(Integer, ForeignKey(RiskProfileFile.id, ondelete='CASCADE'), index=True)
     riskprofilefile = relationship('RiskProfileFile', back_populates='riskprofiles')
 
     def __repr__(self):
@@ -243,12 +253,30 @@ class ModelFile(db.Model):
     id = Column(Integer, primary_key=True)
     name = Column(String(50))
 
+    # Define the specific columns
+    # The year loss table is stored as a single binary array of loss ratios (see flaskapp.engine.ylt)
+    # The column is deferred so that listing the model files does not load their year loss tables
+    nbyears = Column(Integer)
+    ylt = deferred(Column(LargeBinary))
+
+    # SHA-256 of the year loss table, under which its priced pairs are cached (see flaskapp.engine.cache)
+    # Null for the legacy model files, which are not cached
+    ylt_digest = Column(String(64))
+
+    # A simulated model file is defined by its distribution, the parameters of the distribution and its seed
+    # When ylt is null, the year loss table is regenerated on demand from them (see flaskapp.engine.simulation)
+    distribution = Column(String(50))  # e.g. 'lognorm'
+    parameters = Column(JSON)  # e.g. {'s': 0.3, 'scale': 0.7}
+    seed = Column(BigInteger)
+
     # Define the 1-to-many relationship between Analysis and ModelFile
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'), index=True)
     analysis = relationship('Analysis', back_populates='modelfiles')
 
     # Define the 1-to-many relationship between ModelFile and ModelYearLoss
-    modelyearlosses = relationship('ModelYearLoss', back_populates='modelfile', cascade='all, delete')
+    # The model year losses are only used by the model files saved before the binary storage of the YLT
+    modelyearlosses = relationship('ModelYearLoss', back_populates='modelfile',
+                                   cascade='all, delete', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -264,9 +292,14 @@ class ModelYearLoss(db.Model):
     amount = Column(Float)  # For a SL, the amount is a loss ratio, that is a floating point number
 
     # Define the 1-to-many relationship between ModelFile and ModelYearLoss
-    modelfile_id = Column(Integer, ForeignKey(ModelFile.id))
+    modelfile_id = Column(Integer, ForeignKey(ModelFile.id, ondelete='CASCADE'))
     modelfile = relationship('ModelFile', back_populates='modelyearlosses')
 
+    # The year loss table of a model file is read by year
+    __table_args__ = (
+        Index('ix_modelyearloss_modelfile_id_year', 'modelfile_id', 'year'),
+    )
+
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
 
@@ -277,15 +310,16 @@ class PricingRelationship(db.Model):
     name = Column(String(50))
 
     # Define the 1-to-many relationship between Analysis and PricingRelationship
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'), index=True)
     analysis = relationship('Analysis', back_populates='pricingrelationships')
 
     # Define the 1-to-many relationship between PricingRelationship and ResultFile
-    resultfiles = relationship('ResultFile', back_populates='pricingrelationship', cascade='all, delete-orphan')
+    resultfiles = relationship('ResultFile', back_populates='pricingrelationship',
+                               cascade='all, delete-orphan', passive_deletes=True)
 
     # Define the 1-to-many relationship between PricingRelationship and LayerToModelfile
     layertomodelfiles = relationship('LayerToModelfile', back_populates='pricingrelationship',
-                                     cascade='all, delete-orphan')
+                                     cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -297,14 +331,14 @@ class LayerToModelfile(db.Model):
     name = Column(String(50))
 
     # Define the 1-to-many relationship between PricingRelationship and LayerToModelfile
-    pricingrelationship_id = Column(Integer, ForeignKey(PricingRelationship.id))
+    pricingrelationship_id = Column(Integer, ForeignKey(PricingRelationship.id, ondelete='CASCADE'), index=True)
     pricingrelationship = relationship('PricingRelationship', back_populates='layertomodelfiles')
 
     # Define the many-to-many relationship between Layer and ModelFile in the association object LayerToModelfile
-    layer_id = Column(Integer, ForeignKey(Layer.id))
+    layer_id = Column(Integer, ForeignKey(Layer.id, ondelete='CASCADE'), index=True)
     layer = relationship('Layer')
 
-    modelfile_id = Column(Integer, ForeignKey(ModelFile.id))
+    modelfile_id = Column(Integer, ForeignKey(ModelFile.id, ondelete='CASCADE'), index=True)
     modelfile = relationship('ModelFile')
 
     def __repr__(self):
@@ -316,16 +350,32 @@ class ResultFile(db.Model):
     id = Column(Integer, primary_key=True)
     name = Column(String(50))
 
+    # Define the specific columns
+    # The statistics of the result (OEP quantiles, pure premiums and standard deviations by layer and model file)
+    # are computed once when the result is processed (see flaskapp.engine.statistics)
+    summary = Column(JSON)
+
+    # The fingerprints of the inputs of the layer-to-modelfile pairs when they were priced, keyed by their id
+    # A result file is stale when the terms of a layer or the YLT digest of a model file have changed since
+    # (see flaskapp.engine.pricing)
+    fingerprints = Column(JSON)
+
     # Define the 1-to-many relationship between Analysis and ResultFile
-    analysis_id = Column(Integer, ForeignKey(Analysis.id))
+    analysis_id = Column(Integer, ForeignKey(Analysis.id, ondelete='CASCADE'))
     analysis = relationship('Analysis', back_populates='resultfiles')
 
     # Define the 1-to-many relationship between PricingRelationship and ResultFile
-    pricingrelationship_id = Column(Integer, ForeignKey(PricingRelationship.id))
+    pricingrelationship_id = Column(Integer, ForeignKey(PricingRelationship.id, ondelete='CASCADE'), index=True)
     pricingrelationship = relationship('PricingRelationship', back_populates='resultfiles')
 
     # Define the 1-to-many relationhip between ResultFile and ResultYearLoss
-    resultyearlosses = relationship('ResultYearLoss', back_populates='resultfile', cascade='all, delete-orphan')
+    resultyearlosses = relationship('ResultYearLoss', back_populates='resultfile',
+                                    cascade='all, delete-orphan', passive_deletes=True)
+
+    # The result files are looked up by analysis and pricing relationship
+    __table_args__ = (
+        Index('ix_resultfile_analysis_id_pricingrelationship_id', 'analysis_id', 'pricingrelationship_id'),
+    )
 
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
@@ -343,12 +393,51 @@ class ResultYearLoss(db.Model):
     netloss = Column(Integer)  # Cedant's net loss
 
     # Define the 1-to-many relationhip between ResultFile and ResultYearLoss
-    resultfile_id = Column(Integer, ForeignKey(ResultFile.id))
+    resultfile_id = Column(Integer, ForeignKey(ResultFile.id, ondelete='CASCADE'))
     resultfile = relationship('ResultFile', back_populates='resultyearlosses')
 
     # Define the 1-to-many relationship between LayerToModelfile and ResultYearLoss
-    layertomodelfile_id = Column(Integer, ForeignKey(LayerToModelfile.id))
+    layertomodelfile_id = Column(Integer, ForeignKey(LayerToModelfile.id, ondelete='CASCADE'), index=True)
     layertomodelfile = relationship('LayerToModelfile')
 
+    # The result year losses are read by result file, then grouped by layer-to-modelfile and year
+    __table_args__ = (
+        Index(
+            'ix_resultyearloss_resultfile_id_layertomodelfile_id_year',
+            'resultfile_id', 'layertomodelfile_id', 'year',
+        ),
+    )
+
+    def __repr__(self):
+        return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50))
+
+    # Define the specific columns
+    kind = Column(String(50))  # Name of the job handler, e.g. 'process_pricingrelationship'
+    params = Column(JSON)  # Keyword arguments of the job handler
+    result = Column(JSON)  # Return value of the job handler
+    status = Column(String(10), default='queued')  # queued, running, done, failed or cancelled
+    progress = Column(Float, default=0)  # Between 0 and 1
+    message = Column(String(200))
+    error = Column(Text)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    cancel_requested = Column(Boolean, default=False)
+    worker = Column(String(100))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)  # Updated by the worker while the job is running
+    finished_at = Column(DateTime)
+
+    # The workers look for the oldest queued job
+    __table_args__ = (
+        Index('ix_job_status_id', 'status', 'id'),
+    )
+
     def __repr__(self):
         return f'<{self.__tablename__.capitalize()} {self.id} {self.name}>'
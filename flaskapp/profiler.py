@@ -0,0 +1,200 @@
+"""
+This module defines an opt-in profiler of the SQL statements, for the development and staging servers and the tests.
+
+The statements are counted with engine events for each request, a Dash callback being one request labelled with its
+callback id, e.g. 'results.view.layout'. At the end of a request, a summary is logged with:
+- the number of statements and their time
+- the statements slower than SQL_SLOW_QUERY_MS milliseconds
+- the N+1 suspects: the statement shapes run N_PLUS_ONE_THRESHOLD times or more, typically a lazy load of a
+  relationship in a loop, the shape of a statement being its SQL text with the lists of IN parameters collapsed
+The profiler of the requests is enabled by the SQL_PROFILER setting. With the SQL_RAISELOAD setting, the lazy loads of
+the relationships that would emit SQL raise an exception instead, so that the tests find them.
+
+The statements of a block of code are profiled with profile_queries() and bounded with assert_max_queries(), e.g.
+in the benchmarks: with assert_max_queries(4): layout(analysis_id)
+
+Functions:
+- profile_queries(name): Context manager profiling the statements run in its block.
+- assert_max_queries(max_queries, name): Context manager raising an AssertionError when its block runs more than
+  max_queries statements.
+- enable_raiseload(): Make the lazy loads of the relationships that would emit SQL raise an exception.
+- disable_raiseload(): Restore the lazy loads of the relationships.
+- init_app(flask_app, dashapp): Profile the requests of the app when the SQL_PROFILER setting is set.
+
+Dependencies:
+- sqlalchemy
+
+"""
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import raiseload
+from flaskapp.extensions import db
+from flaskapp.metrics import get_callback_id
+
+logger = logging.getLogger(__name__)
+
+# Number of runs of the same statement shape in a request from which it is reported as an N+1 suspect
+N_PLUS_ONE_THRESHOLD = 5
+
+# Default duration from which a statement is logged as slow
+SLOW_QUERY_MS = 100
+
+# Id of the component of the content of the pages, the output of the routing callback of Dash pages
+PAGES_CONTENT = '_pages_content'
+
+# Lists of parameters of the IN conditions, e.g. (?, ?, ?) or (%(id_1_1)s, %(id_1_2)s), collapsed in the shapes
+IN_PARAMETERS = re.compile(r'\((?:\s*(?:\?|%\(\w+\)s)\s*,)+\s*(?:\?|%\(\w+\)s)\s*\)')
+WHITESPACE = re.compile(r'\s+')
+
+# Profiles of the blocks running in the current context, a statement being recorded by all of them
+profiles = ContextVar('profiler_profiles', default=())
+
+
+def get_shape(statement):
+    return IN_PARAMETERS.sub('(?)', WHITESPACE.sub(' ', statement).strip())
+
+
+class QueryProfile:
+    def __init__(self, name, slow_query_ms=SLOW_QUERY_MS):
+        self.name = name
+        self.slow_query_ms = slow_query_ms
+        # Tuples (shape, duration in seconds, executemany) of the statements in their order
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def duration(self):
+        return sum(duration for _, duration, _ in self.statements)
+
+    def get_slow_statements(self):
+        return [(shape, duration) for shape, duration, _ in self.statements if duration * 1000 >= self.slow_query_ms]
+
+    def get_suspects(self, threshold=N_PLUS_ONE_THRESHOLD):
+        # An executemany is a single statement for many rows, not an N+1
+        shapes = Counter(shape for shape, _, executemany in self.statements if not executemany)
+        return [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+    def get_summary(self):
+        lines = [f'{self.name}: {self.count} statements in {self.duration * 1000:.1f} ms']
+        for shape, duration in self.get_slow_statements():
+            lines.append(f'  slow ({duration * 1000:.1f} ms): {shape}')
+        for shape, count in self.get_suspects():
+            lines.append(f'  N+1 suspect ({count} times): {shape}')
+        return '\n'.join(lines)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if profiles.get():
+        context.profiler_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'profiler_start', None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+
+    shape = get_shape(statement)
+    for profile in profiles.get():
+        profile.statements.append((shape, duration, executemany))
+
+
+@contextmanager
+def profile_queries(name='block', slow_query_ms=SLOW_QUERY_MS):
+    """
+    Profile the statements run in the block, e.g. with profile_queries('layout') as profile: ...
+    Yield the QueryProfile, whose count, statements and N+1 suspects can be read after the block.
+    """
+    profile = QueryProfile(name, slow_query_ms)
+    token = profiles.set(profiles.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        profiles.reset(token)
+
+
+@contextmanager
+def assert_max_queries(max_queries, name='block'):
+    with profile_queries(name) as profile:
+        yield profile
+
+    if profile.count > max_queries:
+        statements = '\n'.join(f'  {shape}' for shape, _, _ in profile.statements)
+        raise AssertionError(f'{name} ran {profile.count} statements, more than {max_queries}:\n{statements}')
+
+
+def add_raiseload(orm_execute_state):
+    # The objects loaded by the ORM raise on the lazy loads that would emit SQL, not on those served by the session
+    if orm_execute_state.is_select and not orm_execute_state.is_column_load:
+        orm_execute_state.statement = orm_execute_state.statement.options(raiseload('*', sql_only=True))
+
+
+def enable_raiseload():
+    if not event.contains(db.session, 'do_orm_execute', add_raiseload):
+        event.listen(db.session, 'do_orm_execute', add_raiseload)
+
+
+def disable_raiseload():
+    if event.contains(db.session, 'do_orm_execute', add_raiseload):
+        event.remove(db.session, 'do_orm_execute', add_raiseload)
+
+
+def get_request_name(dashapp):
+    # The request of a Dash callback is named after the callback, the routing callback of the pages after the page
+    # and the other requests after their path
+    if request.path.endswith('_dash-update-component'):
+        body = request.get_json(silent=True) or {}
+        output = body.get('output')
+        if output and output.startswith(f'..{PAGES_CONTENT}.'):
+            return 'page ' + next((item.get('value') for item in body.get('inputs', [])
+                                   if item.get('property') == 'pathname'), '')
+        callback = dashapp.callback_map.get(output, {}).get('callback')
+        if callback is not None:
+            return get_callback_id(callback)
+    return f'{request.method} {request.path}'
+
+
+def init_app(flask_app, dashapp):
+    if flask_app.config.get('SQL_RAISELOAD'):
+        enable_raiseload()
+
+    if not flask_app.config.get('SQL_PROFILER'):
+        return
+
+    slow_query_ms = flask_app.config.get('SQL_SLOW_QUERY_MS', SLOW_QUERY_MS)
+    # The summaries are logged at the INFO level, below the default level of the root logger
+    logger.setLevel(logging.INFO)
+    if not logging.getLogger().handlers:
+        from flask.logging import default_handler
+        logger.addHandler(default_handler)
+        logger.propagate = False
+
+    @flask_app.before_request
+    def start_profile():
+        g.profile_token = profiles.set(profiles.get() + (QueryProfile(get_request_name(dashapp), slow_query_ms),))
+
+    @flask_app.teardown_request
+    def log_profile(exception=None):
+        token = g.pop('profile_token', None)
+        if token is None:
+            return
+        profile = profiles.get()[-1]
+        profiles.reset(token)
+
+        if profile.count:
+            level = logging.WARNING if profile.get_slow_statements() or profile.get_suspects() else logging.INFO
+            logger.log(level, profile.get_summary())
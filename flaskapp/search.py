@@ -0,0 +1,139 @@
+"""
+This module defines the search of the analyses by quote, name and client.
+
+The search runs in the database with keyset pagination: the analyses are sorted by descending id and a page starts
+after the last id of the previous page, so that a page is read from the indexes whatever its position.
+
+The text is matched with an index of the database:
+- PostgreSQL: trigram GIN indexes (extension pg_trgm) on the name, the client and the quote as text,
+  which serve the ILIKE '%text%' conditions
+- SQLite: the FTS5 table analysis_fts, kept in sync with the analysis table by triggers, with prefix queries
+
+The search objects are created with SEARCH_DDL by create_all(), and by the migration that introduced them with a
+frozen copy of SEARCH_DDL: a change of SEARCH_DDL needs a new migration.
+They are not part of the metadata of the models: migrations/env.py excludes them from the autogenerated migrations.
+
+Functions:
+- create_search_index(connection): Create the search objects of the dialect of the connection.
+- drop_search_index(connection): Drop the search objects of the dialect of the connection.
+- search_analyses(text, after_id, limit): Get a page of the analyses matching a text.
+
+Dependencies:
+- sqlalchemy
+
+"""
+
+from sqlalchemy import select, event, text as sql_text, and_, or_, cast, Text
+from flaskapp.extensions import db
+from flaskapp.models import Analysis
+
+# Number of analyses of a page of results
+PAGE_SIZE = 50
+
+SEARCH_DDL = {
+    'postgresql': {
+        'create': [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE INDEX IF NOT EXISTS ix_analysis_name_trgm ON analysis USING gin (name gin_trgm_ops)',
+            'CREATE INDEX IF NOT EXISTS ix_analysis_client_trgm ON analysis USING gin (client gin_trgm_ops)',
+            'CREATE INDEX IF NOT EXISTS ix_analysis_quote_trgm ON analysis USING gin ((quote::text) gin_trgm_ops)',
+        ],
+        'drop': [
+            'DROP INDEX IF EXISTS ix_analysis_name_trgm',
+            'DROP INDEX IF EXISTS ix_analysis_client_trgm',
+            'DROP INDEX IF EXISTS ix_analysis_quote_trgm',
+        ],
+    },
+    'sqlite': {
+        'create': [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS analysis_fts USING fts5("
+            "quote, name, client, content='analysis', content_rowid='id', prefix='1 2 3')",
+            "CREATE TRIGGER IF NOT EXISTS analysis_fts_insert AFTER INSERT ON analysis BEGIN "
+            "INSERT INTO analysis_fts(rowid, quote, name, client) VALUES (new.id, new.quote, new.name, new.client); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS analysis_fts_delete AFTER DELETE ON analysis BEGIN "
+            "INSERT INTO analysis_fts(analysis_fts, rowid, quote, name, client) "
+            "VALUES ('delete', old.id, old.quote, old.name, old.client); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS analysis_fts_update AFTER UPDATE ON analysis BEGIN "
+            "INSERT INTO analysis_fts(analysis_fts, rowid, quote, name, client) "
+            "VALUES ('delete', old.id, old.quote, old.name, old.client); "
+            "INSERT INTO analysis_fts(rowid, quote, name, client) VALUES (new.id, new.quote, new.name, new.client); "
+            "END",
+            # Index the existing analyses
+            "INSERT INTO analysis_fts(analysis_fts) VALUES ('rebuild')",
+        ],
+        'drop': [
+            'DROP TRIGGER IF EXISTS analysis_fts_insert',
+            'DROP TRIGGER IF EXISTS analysis_fts_delete',
+            'DROP TRIGGER IF EXISTS analysis_fts_update',
+            'DROP TABLE IF EXISTS analysis_fts',
+        ],
+    },
+}
+
+
+def create_search_index(connection):
+    for statement in SEARCH_DDL.get(connection.dialect.name, {}).get('create', []):
+        connection.execute(sql_text(statement))
+
+
+def drop_search_index(connection):
+    for statement in SEARCH_DDL.get(connection.dialect.name, {}).get('drop', []):
+        connection.execute(sql_text(statement))
+
+
+@event.listens_for(Analysis.__table__, 'after_create')
+def after_create_analysis(target, connection, **kwargs):
+    create_search_index(connection)
+
+
+@event.listens_for(Analysis.__table__, 'before_drop')
+def before_drop_analysis(target, connection, **kwargs):
+    drop_search_index(connection)
+
+
+def get_search_condition(dialect, text):
+    # Every word of the text must match the quote, the name or the client
+    words = text.split()
+
+    if dialect == 'sqlite':
+        # FTS5 query of prefixes, e.g. '"acme"* "2023"*', the double quotes being escaped by doubling them
+        match = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+        return Analysis.id.in_(
+            select(sql_text('rowid')).select_from(sql_text('analysis_fts')).where(sql_text('analysis_fts MATCH :match'))
+            .params(match=match)
+        )
+
+    def escape(word):
+        return word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    return and_(*[
+        or_(
+            Analysis.name.ilike(f'%{escape(word)}%', escape='\\'),
+            Analysis.client.ilike(f'%{escape(word)}%', escape='\\'),
+            cast(Analysis.quote, Text).ilike(f'%{escape(word)}%', escape='\\'),
+        )
+        for word in words
+    ])
+
+
+def search_analyses(text=None, after_id=None, limit=PAGE_SIZE):
+    """
+    Get a page of the analyses matching text, sorted by descending id.
+
+    after_id: the last id of the previous page, None for the first page
+    Return a tuple (rows, has_more), rows being a list of dictionaries with the keys id, quote, name and client.
+    """
+    query = select(Analysis.id, Analysis.quote, Analysis.name, Analysis.client)
+
+    if text and text.strip():
+        query = query.where(get_search_condition(db.engine.dialect.name, text.strip()))
+
+    if after_id is not None:
+        query = query.where(Analysis.id < after_id)
+
+    # Read one more row to know if there is a next page
+    rows = db.session.execute(query.order_by(Analysis.id.desc()).limit(limit + 1)).all()
+
+    return [row._asdict() for row in rows[:limit]], len(rows) > limit
@@ -0,0 +1,51 @@
+"""
+This module defines the handlers of the background jobs (see flaskapp.jobs).
+
+Each handler receives the JobContext of the job, followed by the parameters given to submit_job() as keyword arguments,
+and returns a JSON serializable result.
+
+Handlers:
+- process_pricingrelationship(context, pricingrelationship_id): Price a relationship and save its result file.
+- process_pricingrelationships(context, pricingrelationship_ids): Price relationships over a process pool and save
+  their result files.
+- save_lognorm_modelfile(context, analysis_id, name, s, scale, nbyears, store_ylt): Simulate and save a log-normal loss
+  model.
+
+"""
+
+from flaskapp.jobs import job_handler
+from flaskapp.engine import pricing, parallel, simulation
+
+
+@job_handler('process_pricingrelationship')
+def process_pricingrelationship(context, pricingrelationship_id):
+    context.report_progress(0, 'Pricing')
+    resultfile_id = pricing.process_pricingrelationship(pricingrelationship_id)
+
+    return {'resultfile_id': resultfile_id}
+
+
+@job_handler('process_pricingrelationships')
+def process_pricingrelationships(context, pricingrelationship_ids):
+    context.report_progress(0, 'Pricing')
+
+    def on_progress(nbdone, nbtotal):
+        context.report_progress(nbdone / nbtotal, f'{nbdone} of {nbtotal} relationships priced')
+
+    resultfile_ids = parallel.process_pricingrelationships(pricingrelationship_ids, on_progress=on_progress)
+
+    # The keys of a JSON object are strings
+    return {'resultfile_ids': {str(pr_id): resultfile_id for pr_id, resultfile_id in resultfile_ids.items()}}
+
+
+@job_handler('save_lognorm_modelfile')
+def save_lognorm_modelfile(context, analysis_id, name, s, scale, nbyears=simulation.NBYEARS, store_ylt=True):
+    def on_progress(progress):
+        context.report_progress(progress, 'Simulating')
+
+    on_progress(0)
+    modelfile_id = simulation.save_lognorm_modelfile(
+        analysis_id, name, s, scale, nbyears, store_ylt=store_ylt, on_progress=on_progress
+    )
+
+    return {'modelfile_id': modelfile_id}
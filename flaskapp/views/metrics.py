@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from flaskapp.metrics import render_metrics
+
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.route('/metrics')
+def index():
+    # Prometheus text exposition format
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
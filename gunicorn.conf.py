@@ -0,0 +1,106 @@
+"""
+Configuration of the gunicorn server of the app, used by startup.sh: gunicorn -c gunicorn.conf.py app:app
+
+The app is created once by the master process (preload_app) before the workers are forked, so that the workers share
+the memory of the imported libraries and of the page registry copy-on-write instead of each importing them. The heavy
+libraries that the pages import on first use (PRELOAD_MODULES) are imported by the master as well, and the objects of
+the master are frozen out of the garbage collector, whose passes would otherwise write to the shared pages.
+
+create_app() opens no connection to the database. After the fork, each worker drops the connection pool and resets
+the caches and metrics inherited from the master with init_worker(), which also bounds the caches of the worker: the
+regenerated YLTs and the priced pairs are kept by the job worker for the long pricing, a web worker only needs a few.
+
+The number of workers is computed from the cores and the memory of the host (or of its container), the memory budgeted
+for a worker being its own memory plus the bounds of its caches. It can be set with the environment variables:
+- GUNICORN_WORKERS: number of worker processes
+- GUNICORN_THREADS: number of threads of a worker (default: 4)
+- GUNICORN_WORKER_MEMORY_MB: memory of a worker without its caches (default: 250)
+- GUNICORN_YLT_CACHE_MB: memory of the cache of the regenerated YLTs of a worker (default: 128)
+- GUNICORN_PRICING_CACHE_MB: memory of the cache of the priced pairs of a worker (default: 64)
+- GUNICORN_PRELOAD_MODULES: modules imported by the master, separated by spaces (empty to import them in the workers)
+
+"""
+
+import gc
+import importlib
+import os
+
+# Share of the memory of the host given to the workers, the rest being left to the master and to the job worker
+WORKERS_MEMORY_SHARE = 0.75
+
+# Memory of a worker, without and with its caches
+WORKER_MEMORY = int(os.environ.get('GUNICORN_WORKER_MEMORY_MB', 250)) * 2 ** 20
+YLT_CACHE_MAX_BYTES = int(os.environ.get('GUNICORN_YLT_CACHE_MB', 128)) * 2 ** 20
+PRICING_CACHE_MAX_BYTES = int(os.environ.get('GUNICORN_PRICING_CACHE_MB', 64)) * 2 ** 20
+WORKER_BUDGET = WORKER_MEMORY + YLT_CACHE_MAX_BYTES + PRICING_CACHE_MAX_BYTES
+
+# orjson is imported by plotly on the first serialization of a response, which fails when concurrent threads race
+# for its first import
+PRELOAD_MODULES = os.environ.get('GUNICORN_PRELOAD_MODULES', 'pandas plotly.express scipy.stats orjson').split()
+
+
+def get_cores():
+    # Cores available to the process, which may be fewer than the cores of the host
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def get_memory():
+    # Memory limit of the container (cgroup v2, then v1), or memory of the host, in bytes
+    for path in ['/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes']:
+        try:
+            with open(path) as file:
+                limit = file.read().strip()
+        except OSError:
+            continue
+        # Without limit, cgroup v2 reads 'max' and cgroup v1 a huge number
+        if limit.isdigit() and int(limit) < 2 ** 60:
+            return int(limit)
+
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def get_workers():
+    # Two workers per core, within the memory budgeted for the workers
+    max_workers = int(get_memory() * WORKERS_MEMORY_SHARE // WORKER_BUDGET)
+    return max(1, min(2 * get_cores(), max_workers))
+
+
+bind = '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS', 0)) or get_workers()
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 60
+preload_app = True
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    # Import the heavy libraries in the master, then freeze its objects before the workers are forked
+    preloaded = []
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # An optional module that is not installed, e.g. orjson
+            continue
+        preloaded.append(module)
+    gc.freeze()
+    server.log.info(f'Preloaded {", ".join(preloaded) or "no module"}, starting {workers} workers of {threads} threads')
+    server.log.info(f'Memory budget of a worker: {WORKER_BUDGET // 2 ** 20} MB including its caches')
+
+
+def pre_fork(server, worker):
+    # The master keeps no connection for the workers to inherit
+    from flaskapp.extensions import db
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def post_fork(server, worker):
+    from flaskapp import init_worker
+    init_worker(server.app.wsgi(), YLT_CACHE_MAX_BYTES, PRICING_CACHE_MAX_BYTES)
@@ -0,0 +1,70 @@
+"""add the search index of the analyses
+
+Revision ID: 3b8f0c6d2a71
+Revises: 6026dee14ec1
+Create Date: 2026-10-18 21:02:41.518304
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8f0c6d2a71'
+down_revision = '6026dee14ec1'
+branch_labels = None
+depends_on = None
+
+# Search objects of each dialect at this revision, frozen from flaskapp.search
+SEARCH_DDL = {
+    'postgresql': {
+        'create': [
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            'CREATE INDEX IF NOT EXISTS ix_analysis_name_trgm ON analysis USING gin (name gin_trgm_ops)',
+            'CREATE INDEX IF NOT EXISTS ix_analysis_client_trgm ON analysis USING gin (client gin_trgm_ops)',
+            'CREATE INDEX IF NOT EXISTS ix_analysis_quote_trgm ON analysis USING gin ((quote::text) gin_trgm_ops)',
+        ],
+        'drop': [
+            'DROP INDEX IF EXISTS ix_analysis_name_trgm',
+            'DROP INDEX IF EXISTS ix_analysis_client_trgm',
+            'DROP INDEX IF EXISTS ix_analysis_quote_trgm',
+        ],
+    },
+    'sqlite': {
+        'create': [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS analysis_fts USING fts5("
+            "quote, name, client, content='analysis', content_rowid='id', prefix='1 2 3')",
+            "CREATE TRIGGER IF NOT EXISTS analysis_fts_insert AFTER INSERT ON analysis BEGIN "
+            "INSERT INTO analysis_fts(rowid, quote, name, client) VALUES (new.id, new.quote, new.name, new.client); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS analysis_fts_delete AFTER DELETE ON analysis BEGIN "
+            "INSERT INTO analysis_fts(analysis_fts, rowid, quote, name, client) "
+            "VALUES ('delete', old.id, old.quote, old.name, old.client); "
+            "END",
+            "CREATE TRIGGER IF NOT EXISTS analysis_fts_update AFTER UPDATE ON analysis BEGIN "
+            "INSERT INTO analysis_fts(analysis_fts, rowid, quote, name, client) "
+            "VALUES ('delete', old.id, old.quote, old.name, old.client); "
+            "INSERT INTO analysis_fts(rowid, quote, name, client) VALUES (new.id, new.quote, new.name, new.client); "
+            "END",
+            # Index the existing analyses
+            "INSERT INTO analysis_fts(analysis_fts) VALUES ('rebuild')",
+        ],
+        'drop': [
+            'DROP TRIGGER IF EXISTS analysis_fts_insert',
+            'DROP TRIGGER IF EXISTS analysis_fts_delete',
+            'DROP TRIGGER IF EXISTS analysis_fts_update',
+            'DROP TABLE IF EXISTS analysis_fts',
+        ],
+    },
+}
+
+
+def upgrade():
+    # Trigram indexes on PostgreSQL, FTS5 table and its triggers on SQLite
+    for statement in SEARCH_DDL.get(op.get_bind().dialect.name, {}).get('create', []):
+        op.execute(sa.text(statement))
+
+
+def downgrade():
+    for statement in SEARCH_DDL.get(op.get_bind().dialect.name, {}).get('drop', []):
+        op.execute(sa.text(statement))
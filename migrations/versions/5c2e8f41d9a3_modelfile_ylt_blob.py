@@ -0,0 +1,133 @@
+"""Store the model files' year loss tables as binary arrays
+
+Revision ID: 5c2e8f41d9a3
+Revises: ba7e7a7d058f
+Create Date: 2026-10-18 09:12:44.102311
+
+"""
+import struct
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8f41d9a3'
+down_revision = 'ba7e7a7d058f'
+branch_labels = None
+depends_on = None
+
+# Number of model files converted per transaction batch
+BATCH_SIZE = 20
+
+# Binary format of the YLTs at this revision, frozen from flaskapp.engine.ylt: header of 16 bytes (magic, format
+# version, dtype code, compression code, padding, number of years) and loss ratios as float64 compressed with zlib
+MAGIC = b'SLYT'
+HEADER = struct.Struct('<4sBBBxQ')
+FORMAT_VERSION = 1
+FLOAT64 = 0
+COMPRESSION_ZLIB = 1
+
+modelfile = sa.table(
+    'modelfile',
+    sa.column('id', sa.Integer),
+    sa.column('nbyears', sa.Integer),
+    sa.column('ylt', sa.LargeBinary),
+)
+modelyearloss = sa.table(
+    'modelyearloss',
+    sa.column('id', sa.Integer),
+    sa.column('year', sa.Integer),
+    sa.column('amount', sa.Float),
+    sa.column('modelfile_id', sa.Integer),
+)
+
+
+def pack_ylt(loss_ratios):
+    data = np.ascontiguousarray(loss_ratios, dtype='<f8').tobytes()
+    return HEADER.pack(MAGIC, FORMAT_VERSION, FLOAT64, COMPRESSION_ZLIB, len(loss_ratios)) + zlib.compress(data, 1)
+
+
+def unpack_ylt(blob):
+    magic, _, dtype_code, compression, nbyears = HEADER.unpack_from(blob)
+    if magic != MAGIC or dtype_code != FLOAT64:
+        raise ValueError('The binary data is not a year loss table of this revision')
+
+    payload = memoryview(blob)[HEADER.size:]
+    if compression == COMPRESSION_ZLIB:
+        payload = zlib.decompress(payload)
+    return np.frombuffer(payload, dtype='<f8', count=nbyears)
+
+
+def get_columns(table_name):
+    return [column['name'] for column in sa.inspect(op.get_bind()).get_columns(table_name)]
+
+
+def upgrade():
+    # The columns may exist already when a previous run failed during the backfill, which commits its batches
+    if 'ylt' not in get_columns('modelfile'):
+        with op.batch_alter_table('modelfile') as batch_op:
+            batch_op.add_column(sa.Column('nbyears', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('ylt', sa.LargeBinary(), nullable=True))
+
+    # Backfill the binary YLT of the existing model files, BATCH_SIZE model files per transaction: the migration
+    # transaction is committed first, and each batch is committed on its own connection, so that the backfill of a large
+    # table neither holds its locks until the end nor starts over after a failure
+    # The years of the legacy model files run from 1 to the number of years, so the year is implied by the position
+    with op.get_context().autocommit_block():
+        engine = op.get_bind().engine
+        with engine.connect() as connection:
+            modelfile_ids = connection.execute(
+                sa.select(modelyearloss.c.modelfile_id).distinct().order_by(modelyearloss.c.modelfile_id)
+            ).scalars().all()
+
+        for start in range(0, len(modelfile_ids), BATCH_SIZE):
+            batch_ids = modelfile_ids[start:start + BATCH_SIZE]
+
+            with engine.begin() as connection:
+                for modelfile_id in batch_ids:
+                    loss_ratios = np.array(connection.execute(
+                        sa.select(modelyearloss.c.amount)
+                        .where(modelyearloss.c.modelfile_id == modelfile_id)
+                        .order_by(modelyearloss.c.year)
+                    ).scalars().all(), dtype=np.float64)
+
+                    connection.execute(
+                        modelfile.update()
+                        .where(modelfile.c.id == modelfile_id)
+                        .values(ylt=pack_ylt(loss_ratios), nbyears=len(loss_ratios))
+                    )
+
+                connection.execute(modelyearloss.delete().where(modelyearloss.c.modelfile_id.in_(batch_ids)))
+
+
+def downgrade():
+    # Expand the binary YLT back into one row per year, one model file per transaction: the YLT of an expanded model
+    # file is cleared with its expansion, so that a failed run resumes with the model files left
+    with op.get_context().autocommit_block():
+        engine = op.get_bind().engine
+        with engine.connect() as connection:
+            modelfile_ids = connection.execute(
+                sa.select(modelfile.c.id).where(modelfile.c.ylt.is_not(None)).order_by(modelfile.c.id)
+            ).scalars().all()
+
+        for modelfile_id in modelfile_ids:
+            with engine.begin() as connection:
+                blob = connection.execute(sa.select(modelfile.c.ylt).where(modelfile.c.id == modelfile_id)).scalar()
+                loss_ratios = unpack_ylt(blob)
+                connection.execute(
+                    modelyearloss.insert(),
+                    [
+                        {'year': year, 'amount': amount, 'modelfile_id': modelfile_id}
+                        for year, amount in enumerate(loss_ratios.tolist(), start=1)
+                    ]
+                )
+                connection.execute(
+                    modelfile.update().where(modelfile.c.id == modelfile_id).values(ylt=None, nbyears=None)
+                )
+
+    with op.batch_alter_table('modelfile') as batch_op:
+        batch_op.drop_column('ylt')
+        batch_op.drop_column('nbyears')
@@ -0,0 +1,62 @@
+"""cascade the deletes of the analyses in the database
+
+Revision ID: bf238f40576f
+Revises: 3b8f0c6d2a71
+Create Date: 2026-10-18 20:25:02.222809
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'bf238f40576f'
+down_revision = '3b8f0c6d2a71'
+branch_labels = None
+depends_on = None
+
+
+# Foreign keys that cascade the deletes: (table, column, referred table)
+FOREIGN_KEYS = [
+    ('layer', 'analysis_id', 'analysis'),
+    ('histolossfile', 'analysis_id', 'analysis'),
+    ('histoloss', 'lossfile_id', 'histolossfile'),
+    ('premiumfile', 'analysis_id', 'analysis'),
+    ('premium', 'premiumfile_id', 'premiumfile'),
+    ('riskprofilefile', 'analysis_id', 'analysis'),
+    ('riskprofile', 'riskprofilefile_id', 'riskprofilefile'),
+    ('modelfile', 'analysis_id', 'analysis'),
+    ('modelyearloss', 'modelfile_id', 'modelfile'),
+    ('pricingrelationship', 'analysis_id', 'analysis'),
+    ('layertomodelfile', 'pricingrelationship_id', 'pricingrelationship'),
+    ('layertomodelfile', 'layer_id', 'layer'),
+    ('layertomodelfile', 'modelfile_id', 'modelfile'),
+    ('resultfile', 'analysis_id', 'analysis'),
+    ('resultfile', 'pricingrelationship_id', 'pricingrelationship'),
+    ('resultyearloss', 'resultfile_id', 'resultfile'),
+    ('resultyearloss', 'layertomodelfile_id', 'layertomodelfile'),
+]
+
+# The foreign keys were created without name: PostgreSQL names them <table>_<column>_fkey,
+# and the batch mode gives the same names to the foreign keys reflected from SQLite
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def replace_foreign_keys(ondelete):
+    tables = {}
+    for table, column, referent in FOREIGN_KEYS:
+        tables.setdefault(table, []).append((column, referent))
+
+    for table, foreign_keys in tables.items():
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            for column, referent in foreign_keys:
+                name = f'{table}_{column}_fkey'
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referent, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
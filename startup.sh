@@ -1,4 +1,9 @@
 flask db upgrade
-gunicorn --workers 2 --threads 4 --timeout 60 --access-logfile \
-    '-' --error-logfile '-' --bind=0.0.0.0:8000 \
-     --chdir=/home/site/wwwroot app:app
+# Run a worker of the background job queue next to the web server
+# More workers can be started on other nodes with worker.sh: they all drain the queue of the shared database
+flask jobs worker &
+# The workers share their metrics through METRICS_DIR, emptied at each start so that the counters start from zero
+export METRICS_DIR=/tmp/sly-metrics
+rm -rf "$METRICS_DIR"
+# The app is preloaded by the master and the workers are forked from it, see gunicorn.conf.py
+gunicorn -c gunicorn.conf.py --chdir=/home/site/wwwroot app:app
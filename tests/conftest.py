@@ -0,0 +1,29 @@
+import os
+
+# config.py reads the settings of the database when it is imported
+for name in ['SECRET_KEY', 'DBUSER', 'DBPASS', 'DBHOST', 'DBNAME']:
+    os.environ.setdefault(name, 'test')
+
+import pytest
+
+from config import SQLiteConfig
+from flaskapp import create_app
+from flaskapp.extensions import db
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    class TestConfig(SQLiteConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path_factory.mktemp("db") / "test.db"}'
+
+    return create_app(TestConfig)
+
+
+@pytest.fixture
+def session(app):
+    # Each test runs on empty tables
+    with app.app_context():
+        db.create_all()
+        yield db.session
+        db.session.remove()
+        db.drop_all()
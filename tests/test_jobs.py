@@ -0,0 +1,147 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from flaskapp import jobs
+from flaskapp.extensions import db
+from flaskapp.models import Job
+
+
+def get_job(session, job_id):
+    return session.execute(select(Job).where(Job.id == job_id).execution_options(populate_existing=True)).scalar()
+
+
+def reclaim(job_id, worker):
+    # Another worker requeues the job, as after a heartbeat timeout, and claims it again
+    with db.engine.begin() as connection:
+        connection.execute(
+            update(Job).where(Job.id == job_id)
+            .values(status=jobs.RUNNING, worker=worker, attempts=Job.attempts + 1, heartbeat_at=datetime.utcnow())
+        )
+
+
+def test_claim_job_once(session):
+    job_id = jobs.submit_job('test', {})
+
+    assert jobs.claim_job('worker-a').id == job_id
+    assert jobs.claim_job('worker-b') is None
+    job = get_job(session, job_id)
+    assert (job.status, job.worker, job.attempts) == (jobs.RUNNING, 'worker-a', 1)
+
+
+def test_claim_job_race(session, monkeypatch):
+    # worker-b claims the job between the select and the update of worker-a
+    job_id = jobs.submit_job('test', {})
+    execute = session.execute
+
+    def racing_execute(statement, *args, **kwargs):
+        # The result is fetched first, an open cursor holding a lock of the database on SQLite
+        result = execute(statement, *args, **kwargs).freeze()
+        if statement.is_select:
+            monkeypatch.setattr(session, 'execute', execute)
+            reclaim(job_id, 'worker-b')
+        return result()
+
+    monkeypatch.setattr(session, 'execute', racing_execute)
+
+    assert jobs.claim_job('worker-a') is None
+    job = get_job(session, job_id)
+    assert (job.status, job.worker, job.attempts) == (jobs.RUNNING, 'worker-b', 1)
+
+
+def test_requeue_abandoned_jobs(session):
+    abandoned_id = jobs.submit_job('test', {})
+    running_id = jobs.submit_job('test', {})
+    jobs.claim_job('worker-a')
+    jobs.claim_job('worker-b')
+    session.execute(update(Job).where(Job.id == abandoned_id).values(heartbeat_at=datetime(2000, 1, 1)))
+    session.commit()
+
+    jobs.requeue_abandoned_jobs()
+
+    assert (get_job(session, abandoned_id).status, get_job(session, abandoned_id).worker) == (jobs.QUEUED, None)
+    assert get_job(session, running_id).status == jobs.RUNNING
+    assert jobs.claim_job('worker-c').attempts == 2
+
+
+def test_abandoned_job_fails_at_last_attempt(session):
+    # A job that kills its worker at every attempt is not claimed again after max_attempts
+    job_id = jobs.submit_job('test', {}, max_attempts=2)
+
+    for attempts in [1, 2]:
+        assert jobs.claim_job('worker-a').attempts == attempts
+        session.execute(update(Job).where(Job.id == job_id).values(heartbeat_at=datetime(2000, 1, 1)))
+        session.commit()
+        jobs.requeue_abandoned_jobs()
+
+    job = get_job(session, job_id)
+    assert (job.status, job.worker, job.attempts) == (jobs.FAILED, None, 2)
+    assert job.finished_at is not None
+    assert jobs.claim_job('worker-b') is None
+
+
+def test_heartbeat_during_handler(session, monkeypatch):
+    # A handler that never reports its progress keeps its job alive
+    monkeypatch.setattr(jobs, 'HEARTBEAT_INTERVAL', 0.05)
+
+    def handler(context):
+        with db.engine.begin() as connection:
+            connection.execute(update(Job).where(Job.id == context.job_id).values(heartbeat_at=datetime(2000, 1, 1)))
+        for _ in range(100):
+            time.sleep(0.02)
+            if get_job(session, context.job_id).heartbeat_at.year > 2000:
+                return 'alive'
+        return 'abandoned'
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test', handler)
+    job_id = jobs.submit_job('test', {})
+
+    assert jobs.run_job(jobs.claim_job('worker-a')) == jobs.DONE
+    assert get_job(session, job_id).result == 'alive'
+
+
+def test_stale_runner_keeps_new_status(session, monkeypatch):
+    # The job is claimed again while its first runner is still running, which must not overwrite the new claim
+    def handler(context):
+        reclaim(context.job_id, 'worker-b')
+        return 'stale'
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test', handler)
+    job_id = jobs.submit_job('test', {})
+
+    assert jobs.run_job(jobs.claim_job('worker-a')) == jobs.LOST
+    job = get_job(session, job_id)
+    assert (job.status, job.worker, job.attempts, job.result) == (jobs.RUNNING, 'worker-b', 2, None)
+
+
+def test_stale_runner_stops_at_progress(session, monkeypatch):
+    reported = []
+
+    def handler(context):
+        context.report_progress(0.5)
+        reclaim(context.job_id, 'worker-b')
+        context.report_progress(0.75)
+        reported.append(0.75)
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test', handler)
+    job_id = jobs.submit_job('test', {})
+
+    assert jobs.run_job(jobs.claim_job('worker-a')) == jobs.LOST
+    assert reported == []
+    job = get_job(session, job_id)
+    assert (job.status, job.worker, job.progress) == (jobs.RUNNING, 'worker-b', 0.5)
+
+
+def test_failed_job_requeued(session, monkeypatch):
+    def handler(context):
+        raise ValueError('failed')
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test', handler)
+    job_id = jobs.submit_job('test', {}, max_attempts=2)
+
+    assert jobs.run_job(jobs.claim_job('worker-a')) == jobs.QUEUED
+    assert jobs.run_job(jobs.claim_job('worker-a')) == jobs.FAILED
+    job = get_job(session, job_id)
+    assert (job.status, job.attempts) == (jobs.FAILED, 2)
+    assert 'ValueError' in job.error
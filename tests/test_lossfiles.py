@@ -0,0 +1,28 @@
+from flaskapp.lossfiles import parse_lossfile
+
+
+def test_tsv_thousands_separators():
+    # Pasted from Excel: tab-separated, with a decimal comma in the loss ratios
+    content = 'year\tpremium\tloss\tloss_ratio\n2020\t1,234\t1 000\t0,81\n2021\t1.234.567,5\t12,5\t\n'
+    losses, errors = parse_lossfile('losses.tsv', content.encode())
+
+    assert errors == []
+    assert losses['premium'].tolist() == [1234, 1234567.5]
+    assert losses['loss'].tolist() == [1000, 12.5]
+    assert losses['loss_ratio'].iloc[0] == 0.81
+
+
+def test_csv_thousands_separators():
+    content = 'year,premium,loss\n2020,"1,234",100\n2021,"1,000.5","2,000,000"\n'
+    losses, errors = parse_lossfile('losses.csv', content.encode())
+
+    assert errors == []
+    assert losses['premium'].tolist() == [1234, 1000.5]
+    assert losses['loss'].tolist() == [100, 2000000]
+
+
+def test_invalid_separators_reported():
+    content = 'year\tpremium\tloss\n2020\t1,23,456\t5\n'
+    _, errors = parse_lossfile('losses.tsv', content.encode())
+
+    assert errors == ['losses.tsv, row 2: premium is not a number']
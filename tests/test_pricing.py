@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+
+from flaskapp.models import Analysis, Layer, LayerToModelfile, ModelFile, PricingRelationship
+from flaskapp.engine.pricing import get_sl_recoveries, price_layertomodelfile, get_fingerprints, get_pricing_plan, \
+    get_stale_pricingrelationship_ids, process_pricingrelationship
+from flaskapp.engine.ylt import write_modelfile_ylt
+
+
+def get_sl_recovery(gross_loss, premium, limit, deductible):
+    # Per-year formula applied to each model year loss before the vectorized engine
+    return min(limit / 100 * premium, max(0, gross_loss - deductible / 100 * premium))
+
+
+# With a premium of 1000, a deductible of 50% and a limit of 30%, the cover attaches at a gross loss of 500 and is
+# exhausted at 800: the loss ratios cover no loss, a loss below the deductible, exactly at the deductible, within the
+# layer, exactly at the deductible plus the limit and above it
+LOSS_RATIOS = [0, 0.2, 0.4999, 0.5, 0.5001, 0.65, 0.7999, 0.8, 0.8001, 1.5, 12.3456]
+
+
+@pytest.mark.parametrize('premium, deductible, limit', [
+    (1000, 50, 30),
+    (1000, 0, 100),
+    (1000, 80, 0),
+    (123457, 65, 35),
+    (0, 50, 30),
+])
+def test_sl_recoveries_match_per_year_formula(premium, deductible, limit):
+    loss_ratios = np.array(LOSS_RATIOS)
+    results = get_sl_recoveries(loss_ratios, premium, deductible, limit)
+
+    grosslosses = [premium * loss_ratio for loss_ratio in LOSS_RATIOS]
+    recoveries = [get_sl_recovery(grossloss, premium, limit, deductible) for grossloss in grosslosses]
+    netlosses = [grossloss - recovery for grossloss, recovery in zip(grosslosses, recoveries)]
+
+    # The result year losses are stored as integers
+    assert results['grossloss'].tolist() == np.rint(grosslosses).astype(np.int64).tolist()
+    assert results['recovery'].tolist() == np.rint(recoveries).astype(np.int64).tolist()
+    assert results['netloss'].tolist() == np.rint(netlosses).astype(np.int64).tolist()
+
+
+def test_sl_recoveries_at_the_boundaries():
+    results = get_sl_recoveries(np.array([0.2, 0.5, 0.65, 0.8, 1.5]), 1000, 50, 30)
+
+    assert results['grossloss'].tolist() == [200, 500, 650, 800, 1500]
+    assert results['recovery'].tolist() == [0, 0, 150, 300, 300]
+    assert results['netloss'].tolist() == [200, 500, 500, 500, 1200]
+
+
+def test_price_layertomodelfile():
+    ylt = {'year': np.arange(1, 4, dtype=np.int64), 'amount': np.array([0.2, 0.65, 1.5])}
+    results = price_layertomodelfile(ylt, 7, 1000, 50, 30)
+
+    assert results['layertomodelfile_id'].tolist() == [7, 7, 7]
+    assert results['year'].tolist() == [1, 2, 3]
+    assert results['recovery'].tolist() == [0, 150, 300]
+
+
+@pytest.fixture
+def relationship(session):
+    # A relationship of 2 layers and 2 model files, not priced yet
+    analysis = Analysis(name='Analysis', quote=1, client='Client')
+    session.add(analysis)
+    session.flush()
+
+    layers = [
+        Layer(name=f'Layer {i}', premium=1000, deductible=50 + 10 * i, limit=30, display_order=i,
+              analysis_id=analysis.id)
+        for i in range(2)
+    ]
+    modelfiles = [ModelFile(name=f'Model file {i}', analysis_id=analysis.id) for i in range(2)]
+    for seed, modelfile in enumerate(modelfiles):
+        write_modelfile_ylt(modelfile, np.random.default_rng(seed).lognormal(-0.3, 0.3, 100))
+    pricingrelationship = PricingRelationship(name='Relationship', analysis_id=analysis.id)
+    session.add_all(layers + modelfiles + [pricingrelationship])
+    session.flush()
+
+    pairs = {
+        (layer.id, modelfile.id): LayerToModelfile(name='Pair', pricingrelationship_id=pricingrelationship.id,
+                                                   layer_id=layer.id, modelfile_id=modelfile.id)
+        for layer in layers for modelfile in modelfiles
+    }
+    session.add_all(pairs.values())
+    session.commit()
+
+    return pricingrelationship.id, layers, modelfiles, {key: pair.id for key, pair in pairs.items()}
+
+
+def test_pricing_plan_without_result_file(relationship):
+    pricingrelationship_id, _, _, pairs = relationship
+    plan = get_pricing_plan([pricingrelationship_id])
+
+    resultfile_id, fingerprints, layertomodelfile_ids = plan[pricingrelationship_id]
+    assert resultfile_id is None
+    assert layertomodelfile_ids is None
+    assert fingerprints.keys() == set(pairs.values())
+
+
+def test_pricing_plan_up_to_date(relationship):
+    pricingrelationship_id, _, _, _ = relationship
+    process_pricingrelationship(pricingrelationship_id)
+
+    assert get_pricing_plan([pricingrelationship_id]) == {}
+    assert get_stale_pricingrelationship_ids([pricingrelationship_id]) == set()
+
+
+def test_edited_deductible_marks_only_the_pairs_of_the_layer_stale(session, relationship):
+    pricingrelationship_id, layers, modelfiles, pairs = relationship
+    resultfile_id = process_pricingrelationship(pricingrelationship_id)
+    fingerprints = get_fingerprints([pricingrelationship_id])[pricingrelationship_id]
+
+    layers[0].deductible = 70
+    session.commit()
+
+    plan = get_pricing_plan([pricingrelationship_id])
+    assert plan[pricingrelationship_id][0] == resultfile_id
+    assert plan[pricingrelationship_id][2] == {pairs[layers[0].id, modelfile.id] for modelfile in modelfiles}
+    assert get_stale_pricingrelationship_ids([pricingrelationship_id]) == {pricingrelationship_id}
+
+    # The fingerprints of the pairs of the other layer are unchanged
+    new_fingerprints = get_fingerprints([pricingrelationship_id])[pricingrelationship_id]
+    unchanged_ids = {pairs[layers[1].id, modelfile.id] for modelfile in modelfiles}
+    assert {key: new_fingerprints[key] for key in unchanged_ids} == {key: fingerprints[key] for key in unchanged_ids}
+
+    # Pricing the changed pairs again brings the result file up to date
+    assert process_pricingrelationship(pricingrelationship_id) == resultfile_id
+    assert get_pricing_plan([pricingrelationship_id]) == {}
+
+
+def test_replaced_ylt_marks_only_the_pairs_of_the_model_file_stale(session, relationship):
+    pricingrelationship_id, layers, modelfiles, pairs = relationship
+    resultfile_id = process_pricingrelationship(pricingrelationship_id)
+
+    write_modelfile_ylt(modelfiles[1], np.random.default_rng(2).lognormal(-0.3, 0.3, 100))
+    session.commit()
+
+    plan = get_pricing_plan([pricingrelationship_id])
+    assert plan[pricingrelationship_id][0] == resultfile_id
+    assert plan[pricingrelationship_id][2] == {pairs[layer.id, modelfiles[1].id] for layer in layers}
+
+
+def test_renamed_model_file_stays_up_to_date(session, relationship):
+    pricingrelationship_id, _, modelfiles, _ = relationship
+    process_pricingrelationship(pricingrelationship_id)
+
+    modelfiles[0].name = 'Renamed'
+    session.commit()
+
+    assert get_pricing_plan([pricingrelationship_id]) == {}
@@ -0,0 +1 @@
+flask jobs worker